@@ -0,0 +1,69 @@
+# End-to-end check of ndy_batch_export.py without Blender.
+# Runs manifest with two jobs through stub Blender launcher (bench/stub_blender.py): one exports
+# synthetic hierarchy and one refers to missing object, and checks results JSON and exit code 1.
+#
+#   python bench/bench_batch_export.py [--faces 1000] [--keep <dir>]
+import argparse
+import json
+import shlex
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+kBenchDir    = Path(__file__).resolve().parent
+kBatchScript = kBenchDir.parent / 'ndy_batch_export.py'
+kStubBlender = kBenchDir / 'stub_blender.py'
+
+sys.path.insert(0, str(kBatchScript.parent))
+
+import ndy_batch_export
+
+def run_check(work_dir: Path, num_faces: int) -> bool:
+    with open(work_dir / 'level.blend.json', 'w', encoding='utf-8') as f:
+        json.dump({ 'room': num_faces }, f)
+    with open(work_dir / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump({
+            'defaults': { 'version': 'IJIM' },
+            'jobs': [
+                { 'blend': 'level.blend.json', 'object': 'room0', 'out_file': 'room.ndy' },
+                { 'blend': 'level.blend.json', 'object': 'missing', 'out_file': 'missing.ndy' },
+            ]
+        }, f)
+
+    results_file = work_dir / 'results.json'
+    blender = ' '.join(shlex.quote(str(a)) for a in (sys.executable, kStubBlender))
+    start = time.perf_counter()
+    rc = ndy_batch_export.main([str(work_dir / 'manifest.json'), '--blender', blender, '--results', str(results_file)])
+    print(f"\nBatch export finished with exit code {rc} in {time.perf_counter() - start:.2f}s")
+
+    with open(results_file, 'r', encoding='utf-8') as f:
+        results = { r['object']: r for r in json.load(f)['results'] }
+    room, missing = results.get('room0'), results.get('missing')
+    room_ndy = work_dir / 'room.ndy'
+    checks = [
+        ('exit code is 1',             rc == 1),
+        ('results of both jobs',       len(results) == 2 and room is not None and missing is not None),
+        ('room0 exported',             room is not None and room['ok'] and room_ndy.is_file() and b'World surfaces' in room_ndy.read_bytes()),
+        ('missing object failed',      missing is not None and not missing['ok'] and 'not found' in (missing['error'] or '')),
+        ('missing.ndy not written',    not (work_dir / 'missing.ndy').exists()),
+    ]
+    for name, ok in checks:
+        print(f"{'OK    ' if ok else 'FAILED'} {name}")
+    return all(ok for _, ok in checks)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Checks ndy_batch_export.py with stub Blender launcher.')
+    parser.add_argument('--faces', type=int, default=1000, help='number of faces of exported synthetic hierarchy')
+    parser.add_argument('--keep', type=Path, help='directory to keep manifest, results and exported files in')
+    args = parser.parse_args()
+
+    if args.keep:
+        args.keep.mkdir(parents=True, exist_ok=True)
+        return 0 if run_check(args.keep, args.faces) else 1
+    with tempfile.TemporaryDirectory(prefix='ndy_batch_check_') as tmp_dir:
+        return 0 if run_check(Path(tmp_dir), args.faces) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
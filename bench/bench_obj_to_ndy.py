@@ -0,0 +1,232 @@
+# Benchmark of obj_to_ndy.py export stages on synthetic sector hierarchies.
+# Runs with regular Python, Blender and Sith addon are replaced with stand-ins from bench/stubs.
+#
+#   python bench/bench_obj_to_ndy.py --sizes 1000 10000 100000 --out results.json
+#   python bench/bench_obj_to_ndy.py --compare results.json       # compare with previous run
+#   python bench/bench_obj_to_ndy.py --sizes 1000000 --memory     # also measure peak memory of each stage
+#   python bench/bench_obj_to_ndy.py --set bake_lights=True        # also bake light of synthetic lights
+#   python bench/bench_obj_to_ndy.py --sizes 10000 --sector-faces 2500 --walls --set auto_adjoins=True --set weld_vertices=True
+#
+# Each stage is timed separately (wall and CPU time, output size, faces per second).
+# SHA-256 of the whole exported file is checked against bench/golden.json, so optimizations
+# which change exported bytes are caught. Use --update-golden after intended output change.
+# Golden key is '<version>/<size>' followed by non-default --sector-faces, --walls and --set variables,
+# cases without golden hash are not checked. bench/check_baseline.py compares golden cases with pre-series writer.
+
+import argparse
+import ast
+import hashlib
+import importlib.util
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+kBenchDir     = Path(__file__).resolve().parent
+kScript       = kBenchDir.parent / 'obj_to_ndy.py'
+kGoldenFile   = kBenchDir / 'golden.json'
+kDefaultSizes = [1000, 10000, 100000, 1000000]
+
+import synthetic # adds stand-ins to sys.path
+
+def load_script(path: Path, settings: Dict[str, object]):
+    spec = importlib.util.spec_from_file_location('obj_to_ndy', path)
+    mod  = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = mod # so sector block workers can find script functions
+    spec.loader.exec_module(mod)
+    for name, value in settings.items():
+        if not hasattr(mod, name):
+            raise ValueError(f"Script has no variable '{name}'")
+        setattr(mod, name, value)
+    return mod
+
+def _consume(chunks: Iterable[str]) -> int:
+    # Consumes text chunks and returns number of written bytes
+    return sum(len(c) for c in chunks)
+
+def _hash(chunks: Iterable[str]) -> Tuple[int, str]:
+    h = hashlib.sha256()
+    size = 0
+    for c in chunks:
+        b = c.encode('utf-8')
+        h.update(b)
+        size += len(b)
+    return size, h.hexdigest()
+
+def measure(fn: Callable, memory: bool):
+    # Runs fn and returns its result and stats: wall & CPU time and peak of traced memory allocations
+    if memory:
+        tracemalloc.start()
+    wall = time.perf_counter()
+    cpu  = time.process_time()
+    result = fn()
+    stats = { 'wall': time.perf_counter() - wall, 'cpu': time.process_time() - cpu }
+    if memory:
+        stats['peak_mem'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, stats
+
+def run_case(mod, version_name: str, num_faces: int, memory: bool, sector_faces: int = 10000, walls: bool = False) -> dict:
+    version = mod.NdyVersion[version_name]
+    root    = synthetic.make_hierarchy(num_faces, sector_faces, walls=walls)
+
+    stages: Dict[str, dict] = {}
+    def _stage(name: str, fn: Callable):
+        result, stats = measure(fn, memory)
+        if isinstance(result, int):
+            stats['bytes'] = result
+        stages[name] = stats
+        return result
+
+    model       = _stage('model', lambda: mod._make_export_model([root], version))
+    world_verts = _stage('world_vertices', lambda: mod._get_world_vertices(model))
+    sector_lights = None
+    if mod.bake_lights:
+        lights = synthetic.make_lights(root)
+        model, sector_lights = _stage('bake_lights', lambda: mod._bake_lights(model, world_verts, lights))
+    frags       = _stage('fragments', lambda: mod._SectorFragments(version, model, world_verts, None, sector_lights))
+    _stage('vertices', lambda: _consume(mod._ndy_iter_vertices(frags, 0)))
+    _stage('uvs', lambda: _consume(mod._ndy_iter_uv_vertices(frags, 0)))
+    _stage('surfaces', lambda: _consume(mod._ndy_iter_surfaces(frags, range(len(model.materials)), 0, 0, 0, 0)))
+    _stage('normals', lambda: _consume(mod._ndy_iter_surface_normals(frags, 0)))
+    _stage('sectors', lambda: _consume(mod._ndy_iter_section_sectors(frags, 0, 0, 0)))
+
+    (size, sha256), stats = measure(lambda: _hash(mod._ndy_iter_export(version, frags, 0, 0, 0, 0, 0, 0)), memory)
+    stages['export'] = { **stats, 'bytes': size }
+
+    faces = frags.num_faces
+    for stats in stages.values():
+        stats['faces_per_s'] = faces / stats['wall'] if stats['wall'] > 0 else 0.0
+    return {
+        'version'  : version_name,
+        'faces'    : faces,
+        'size'     : num_faces,
+        'sectors'  : len(frags.meshes),
+        'vertices' : sum(len(m.vertices) for m in frags.meshes),
+        'sha256'   : sha256,
+        'stages'   : stages
+    }
+
+def _best(runs: List[dict]) -> dict:
+    # Merges repeated runs of case, keeping minimum of each stage stat
+    best = dict(runs[0])
+    best['stages'] = {}
+    for name in runs[0]['stages']:
+        stats = [r['stages'][name] for r in runs]
+        best['stages'][name] = { k: (max if k == 'faces_per_s' else min)(s[k] for s in stats) for k in stats[0] }
+    return best
+
+def print_case(case: dict):
+    print(f"\n{case['version']} {case['faces']} faces, {case['sectors']} sectors, {case['vertices']} vertices")
+    print(f"  {'stage':<15}{'wall ms':>10}{'cpu ms':>10}{'MB':>9}{'kfaces/s':>11}{'peak MB':>10}")
+    for name, s in case['stages'].items():
+        size = '{:.2f}'.format(s['bytes'] / 1e6) if 'bytes' in s else '-'
+        peak = '{:.1f}'.format(s['peak_mem'] / 1e6) if 'peak_mem' in s else '-'
+        print(f"  {name:<15}{s['wall'] * 1e3:>10.1f}{s['cpu'] * 1e3:>10.1f}{size:>9}{s['faces_per_s'] / 1e3:>11.1f}{peak:>10}")
+
+def print_comparison(cases: List[dict], baseline: dict):
+    base = { (c['version'], c['size']): c for c in baseline.get('cases', []) }
+    print('\nComparison with baseline (wall time, speedup > 1 is faster):')
+    for case in cases:
+        old = base.get((case['version'], case['size']))
+        if old is None:
+            continue
+        same = 'same output' if old['sha256'] == case['sha256'] else 'OUTPUT DIFFERS'
+        print(f"  {case['version']} {case['faces']} faces ({same})")
+        for name, s in case['stages'].items():
+            if name in old['stages']:
+                o = old['stages'][name]['wall']
+                print(f"    {name:<15}{o * 1e3:>10.1f} -> {s['wall'] * 1e3:>10.1f} ms  x{o / s['wall'] if s['wall'] > 0 else 0.0:.2f}")
+
+def golden_key(version_name: str, num_faces: int, sector_faces: int = 10000, walls: bool = False, settings: Optional[Dict[str, object]] = None) -> str:
+    key = f"{version_name}/{num_faces}"
+    if sector_faces != 10000:
+        key += f"/sector_faces={sector_faces}"
+    if walls:
+        key += "/walls"
+    if settings:
+        key += '/' + ','.join(f'{k}={v!r}' for k, v in sorted(settings.items()))
+    return key
+
+def check_golden(cases: List[dict], golden: dict) -> bool:
+    ok = True
+    for case in cases:
+        expected = golden.get(case['key'])
+        if expected is None:
+            continue
+        if expected != case['sha256']:
+            print(f"FAILED golden check: {case['key']}, expected {expected} got {case['sha256']}")
+            ok = False
+        else:
+            print(f"OK golden check: {case['key']}")
+    return ok
+
+def _parse_setting(s: str) -> Tuple[str, object]:
+    name, sep, value = s.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"Expected <variable>=<value>, got '{s}'")
+    return name.strip(), ast.literal_eval(value.strip())
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks obj_to_ndy.py export stages on synthetic hierarchies.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=kDefaultSizes, help='number of faces of each benchmarked hierarchy')
+    parser.add_argument('--versions', nargs='+', default=['IJIM'], choices=['IJIM', 'JKDF2', 'MOTS'], type=str.upper)
+    parser.add_argument('--repeat', type=int, default=1, help='number of runs of each case, best run is reported')
+    parser.add_argument('--memory', action='store_true', help='measure peak memory of each stage (slower)')
+    parser.add_argument('--sector-faces', type=int, default=10000, help='approximate number of faces of each sector')
+    parser.add_argument('--walls', action='store_true', help='add coincident walls between neighbouring sectors (see synthetic.make_tile)')
+    parser.add_argument('--set', dest='settings', action='append', type=_parse_setting, default=[], metavar='VAR=VALUE',
+                        help='set script variable, e.g. --set weld_vertices=True')
+    parser.add_argument('--script', type=Path, default=kScript, help='path to obj_to_ndy.py')
+    parser.add_argument('--out', type=Path, help='write results to JSON file')
+    parser.add_argument('--compare', type=Path, help='JSON results of previous run to compare with')
+    parser.add_argument('--golden', type=Path, default=kGoldenFile, help='JSON file with SHA-256 of exported files')
+    parser.add_argument('--update-golden', action='store_true', help='store SHA-256 of exported files in golden file')
+    args = parser.parse_args(argv)
+
+    settings = dict(args.settings)
+    mod = load_script(args.script, settings)
+
+    cases = []
+    for version in args.versions:
+        for size in args.sizes:
+            case = _best([run_case(mod, version, size, args.memory, args.sector_faces, args.walls) for _ in range(max(1, args.repeat))])
+            case['key'] = golden_key(version, size, args.sector_faces, args.walls, settings)
+            print_case(case)
+            cases.append(case)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print_comparison(cases, json.load(f))
+
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({
+                'timestamp' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python'    : platform.python_version(),
+                'platform'  : platform.platform(),
+                'settings'  : { k: repr(v) for k, v in settings.items() },
+                'cases'     : cases
+            }, f, indent=2)
+
+    golden = {}
+    if args.golden.is_file():
+        with open(args.golden, 'r', encoding='utf-8') as f:
+            golden = json.load(f)
+
+    if args.update_golden:
+        golden.update({ c['key']: c['sha256'] for c in cases })
+        with open(args.golden, 'w', encoding='utf-8') as f:
+            json.dump(dict(sorted(golden.items())), f, indent=2)
+            f.write('\n')
+        print(f"\nUpdated golden file '{args.golden}'")
+        return 0
+    return 0 if check_golden(cases, golden) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+# Checks exports of obj_to_ndy.py against the pre-series writer (baseline) on golden cases of bench_obj_to_ndy.py.
+# Baseline is obj_to_ndy.py of the first commit, which is run as whole script with out_file and out_version replaced:
+#   git show 8d886ab:obj_to_ndy.py > baseline.py
+#   python bench/check_baseline.py baseline.py [--versions IJIM JKDF2 MOTS]
+#
+# With default script variables files must be equal except sector CENTER and RADIUS (bounding sphere is computed differently).
+# Baseline has no adjoins and welding, so exports with auto_adjoins and weld_vertices are compared by value:
+# surfaces by their material, flags, vertex positions, texture coordinates and intensities, and sectors
+# by their vertex positions, where adjoined surfaces may only differ by cleared material and geo mode.
+import argparse
+import re
+import sys
+import tempfile
+
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+kBenchDir = Path(__file__).resolve().parent
+sys.path.insert(0, str(kBenchDir.parent))
+
+import bench_obj_to_ndy # adds stand-ins to sys.path
+import ndy_reader
+import synthetic
+import bpy
+
+# (number of faces, faces per sector, walls, script variables), see bench_obj_to_ndy.golden_key
+kCases = [
+    (1000,  10000, False, {}),
+    (10000, 10000, False, {}),
+    (10000, 2500, False, {}),
+    (10000, 2500, True,  {}),
+    (10000, 2500, True,  { 'auto_adjoins': True, 'weld_vertices': True }),
+]
+kReSphere = re.compile(r'^(CENTER|RADIUS)\b')
+
+def export_baseline(script: Path, version_name: str, root, out_file: Path):
+    src = script.read_text(encoding='utf-8')
+    src = re.sub(r'^out_file(\s*)=.*$', lambda m: f'out_file{m.group(1)}= {str(out_file)!r}', src, count=1, flags=re.M)
+    src = re.sub(r'^out_version(\s*)=.*$', lambda m: f'out_version{m.group(1)}= NdyVersion.{version_name}', src, count=1, flags=re.M)
+    bpy.context.selected_objects = [root]
+    exec(compile(src, str(script), 'exec'), { '__name__': '__main__' })
+
+def export_current(settings: Dict[str, object], version_name: str, root, out_file: Path):
+    mod     = bench_obj_to_ndy.load_script(bench_obj_to_ndy.kScript, settings)
+    version = mod.NdyVersion[version_name]
+    model   = mod._make_export_model([root], version)
+    world_verts = mod._get_world_vertices(model)
+    frags   = mod._SectorFragments(version, model, world_verts)
+    with open(out_file, 'w', encoding='utf-8') as f:
+        f.writelines(mod._ndy_iter_export(version, frags, 0, 0, 0, 0, 0, 0))
+
+def _rows(ndy: ndy_reader.NdyReader, name: str) -> List[List[str]]:
+    return [ndy.row(name, i).replace(',', ' ').split()[1:] for i in range(ndy.index['lists'][name]['num_rows'])]
+
+def read_values(path: Path, version_name: str) -> Tuple[list, list]:
+    # Returns surfaces and sectors of NDY file with indices resolved to values:
+    # surface (material name, flags, extralight, vertex positions, texture coordinates, intensities, adjoined) and sector vertex positions
+    num_extralight = 4 if version_name == 'IJIM' else 1
+    with ndy_reader.NdyReader(str(path), stride=1, use_sidecar=False) as ndy:
+        materials = [r[0] for r in _rows(ndy, 'materials')]
+        verts     = np.array(_rows(ndy, 'vertices'), dtype=np.float64)
+        uvs       = np.array(_rows(ndy, 'texture vertices'), dtype=np.float64)
+        surfaces  = []
+        for r in _rows(ndy, 'surfaces'):
+            mat, flags, adjoin = int(r[0]), tuple(r[1:6]), int(r[6])
+            n = int(r[7 + num_extralight])
+            idx = np.array(r[8 + num_extralight:8 + num_extralight + 2 * n], dtype=np.int64).reshape(-1, 2)
+            surfaces.append((materials[mat] if mat >= 0 else None, flags, tuple(r[7:7 + num_extralight]),
+                             verts[idx[:, 0]], uvs[idx[:, 1]], tuple(r[8 + num_extralight + 2 * n:]), adjoin >= 0))
+        sectors = []
+        for i in range(ndy.index['lists']['sectors']['num_rows']):
+            pos = verts[ndy.sector(i)['VERTICES']]
+            sectors.append(pos[np.lexsort(pos.T[::-1])])
+    return surfaces, sectors
+
+def compare_values(base: Path, cur: Path, version_name: str) -> List[str]:
+    # Returns differences of surfaces and sectors of current export from baseline export
+    tol = 1e-6
+    base_surfaces, base_sectors = read_values(base, version_name)
+    cur_surfaces, cur_sectors   = read_values(cur, version_name)
+    if len(base_surfaces) != len(cur_surfaces) or len(base_sectors) != len(cur_sectors):
+        return ["number of surfaces or sectors differs"]
+    diffs = []
+    for i, (b, c) in enumerate(zip(base_surfaces, cur_surfaces)):
+        if c[6]: # adjoined surface has no material, surfflags and geo mode
+            b = (None, ('0x0', b[1][1], '0', *b[1][3:]), *b[2:6], True)
+        if b[0] != c[0] or b[1] != c[1] or b[2] != c[2] or b[5] != c[5] or b[6] != c[6] \
+           or b[3].shape != c[3].shape or not np.allclose(b[3], c[3], atol=tol) or not np.allclose(b[4], c[4], atol=tol):
+            diffs.append(f"surface {i}")
+    for i, (b, c) in enumerate(zip(base_sectors, cur_sectors)):
+        if b.shape != c.shape or not np.allclose(b, c, atol=tol):
+            diffs.append(f"vertices of sector {i}")
+    return diffs
+
+def compare_lines(base: Path, cur: Path) -> List[str]:
+    # Returns differing lines of current export from baseline export, except sector CENTER and RADIUS
+    base_lines = base.read_text(encoding='utf-8').splitlines()
+    cur_lines  = cur.read_text(encoding='utf-8').splitlines()
+    if len(base_lines) != len(cur_lines):
+        return [f"number of lines differs: {len(base_lines)} != {len(cur_lines)}"]
+    return [f"line {i + 1}: {c}" for i, (b, c) in enumerate(zip(base_lines, cur_lines)) if b != c and not (kReSphere.match(b) and kReSphere.match(c))]
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Checks exports of obj_to_ndy.py against the pre-series writer.')
+    parser.add_argument('baseline', type=Path, help='pre-series obj_to_ndy.py')
+    parser.add_argument('--versions', nargs='+', default=['IJIM', 'JKDF2', 'MOTS'], choices=['IJIM', 'JKDF2', 'MOTS'], type=str.upper)
+    args = parser.parse_args()
+
+    ok = True
+    with tempfile.TemporaryDirectory(prefix='ndy_baseline_check_') as tmp_dir:
+        base_file, cur_file = Path(tmp_dir) / 'baseline.ndy', Path(tmp_dir) / 'current.ndy'
+        for version in args.versions:
+            for num_faces, sector_faces, walls, settings in kCases:
+                root = synthetic.make_hierarchy(num_faces, sector_faces, walls=walls)
+                export_baseline(args.baseline, version, root, base_file)
+                export_current(settings, version, root, cur_file)
+                diffs = compare_values(base_file, cur_file, version) if settings else compare_lines(base_file, cur_file)
+                print(f"{'OK    ' if not diffs else 'FAILED'} {bench_obj_to_ndy.golden_key(version, num_faces, sector_faces, walls, settings)}")
+                for d in diffs[:10]:
+                    print(f"         {d}")
+                ok = ok and not diffs
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
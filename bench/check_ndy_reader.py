@@ -0,0 +1,84 @@
+# Checks ndy_reader.py on small handwritten NDY file: list rows, surfaces/normals boundary and sector key-values,
+# including keys whose values start with a letter (e.g. SOUND file name).
+#
+#   python bench/check_ndy_reader.py
+import sys
+import tempfile
+
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import ndy_reader
+
+kNdy = '''SECTION: GEORESOURCE
+
+World vertices 4
+#num:	vertex:
+0:	0.00000000	0.00000000	0.00000000
+1:	1.00000000	0.00000000	0.00000000
+2:	1.00000000	1.00000000	0.00000000
+3:	0.00000000	1.00000000	0.00000000
+
+World surfaces 1
+#num:	mat:	surfflags:	faceflags:	geo:	light:	tex:	adjoin:	extralight:	nverts:	vertices:	intensities:
+0:	0	0x4	0x0	4	3	1	-1		0.00000000	0.00000000	0.00000000	1.00000000	       4    0, 0	  1, 1	  2, 2	  3, 3		1.0	1.0	1.0	1.0
+
+#  --- Surface normals ---
+0:		0.00000000	0.00000000	1.00000000
+
+SECTION: SECTORS
+
+World sectors 2
+
+SECTOR	0
+FLAGS	0x0
+AMBIENT LIGHT	0.50000000	0.50000000	0.50000000
+EXTRA LIGHT	0.00000000	0.00000000	0.00000000
+COLORMAP	0
+TINT	0.00000000	0.00000000	0.00000000
+SOUND	drip01.wav	0.500000
+THRUST	0.00000000	0.00000000	1.00000000
+AVERAGE LIGHT INTENSITY	0.0 0.0 0.0
+CENTER	0.50000000	0.50000000	0.00000000
+RADIUS	0.70710678
+VERTICES	4
+0:	0
+1:	1
+2:	2
+3:	3
+SURFACES	0	1
+
+SECTOR	1
+FLAGS	0x0
+Sound	Wind Loop.wav	1.0
+VERTICES	0
+SURFACES	1	0
+
+SECTION: end
+'''
+
+def run_check(path: Path) -> bool:
+    path.write_text(kNdy, encoding='utf-8')
+    with ndy_reader.NdyReader(str(path), use_sidecar=False) as ndy:
+        lists = ndy.index['lists']
+        s0, s1 = ndy.sector(0), ndy.sector(1)
+        checks = [
+            ('vertex row 3',                   ndy.row('vertices', 3).split() == ['3:', '0.00000000', '1.00000000', '0.00000000']),
+            ('one surface and one normal',     lists['surfaces']['num_rows'] == 1 and lists['normals']['num_rows'] == 1),
+            ('SOUND file name is value',       s0.get('SOUND') == 'drip01.wav\t0.500000'),
+            ('multi-word keys',                s0.get('AMBIENT LIGHT', '').split() == ['0.50000000'] * 3 and 'AVERAGE LIGHT INTENSITY' in s0),
+            ('THRUST and TINT',                'THRUST' in s0 and 'TINT' in s0),
+            ('sector vertices and surfaces',   s0.get('VERTICES') == [0, 1, 2, 3] and s0.get('SURFACES') == (0, 1)),
+            ('lower case key, spaced value',   s1.get('SOUND') == 'Wind Loop.wav\t1.0' and s1.get('SURFACES') == (1, 0)),
+        ]
+    for name, ok in checks:
+        print(f"{'OK    ' if ok else 'FAILED'} {name}")
+    return all(ok for _, ok in checks)
+
+def main() -> int:
+    with tempfile.TemporaryDirectory(prefix='ndy_reader_check_') as tmp_dir:
+        return 0 if run_check(Path(tmp_dir) / 'check.ndy') else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
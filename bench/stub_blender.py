@@ -0,0 +1,72 @@
+# Stand-in for Blender executable which runs scripts with regular Python and stand-ins from bench/stubs,
+# so ndy_batch_export.py can be run without Blender:
+#   python ndy_batch_export.py manifest.json --blender "python bench/stub_blender.py"
+#
+# Accepts the arguments ndy_batch_export.py passes to Blender:
+#   --background <blend> --python-exit-code <code> --python <script> -- <script args>
+# Stub .blend file is JSON object which maps hierarchy name to its number of faces, e.g. { "room": 1000 }.
+# Each hierarchy is built by synthetic.make_hierarchy with tiles named '<name>0', '<name>1', ...
+# and all its objects are set to bpy.data.objects, so hierarchy 'room' is exported as object 'room0'.
+import json
+import os
+import runpy
+import sys
+import traceback
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import synthetic # adds stand-ins to sys.path
+import bpy
+
+def load_blend(path: str) -> dict:
+    # Returns objects of synthetic hierarchies described by stub .blend file by name
+    with open(path, 'r', encoding='utf-8') as f:
+        hierarchies = json.load(f)
+    objects = {}
+    for name, num_faces in hierarchies.items():
+        root = synthetic.make_hierarchy(num_faces, name=name)
+        for o in [root] + root.children:
+            objects[o.name] = o
+    return objects
+
+def main(argv: list) -> int:
+    blend, script, exit_code = None, None, 0
+    args = argv[argv.index('--'):] if '--' in argv else []
+    opts = argv[:len(argv) - len(args)]
+    i = 0
+    while i < len(opts):
+        if opts[i] == '--background':
+            pass
+        elif opts[i] == '--python-exit-code':
+            exit_code = int(opts[i + 1])
+            i += 1
+        elif opts[i] == '--python':
+            script = opts[i + 1]
+            i += 1
+        elif not opts[i].startswith('-'):
+            blend = opts[i]
+        else:
+            print(f"Error: unsupported argument '{opts[i]}'")
+            return 1
+        i += 1
+
+    if blend:
+        try:
+            bpy.data.objects = load_blend(blend)
+            bpy.data.filepath = os.path.abspath(blend)
+        except (OSError, ValueError) as e:
+            print(f"Error: couldn't load stub .blend file '{blend}': {e}")
+            return 1
+    if script:
+        sys.argv = [sys.argv[0]] + argv
+        try:
+            runpy.run_path(script, run_name='__main__')
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+        except Exception:
+            traceback.print_exc()
+            return exit_code
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,20 @@
+# Minimal stand-in for Blender's bpy module used by benchmarks.
+# Provides only what the scripts access at import time and what synthetic scenes set up.
+import types as _types
+
+class _Context:
+    selected_objects = []
+
+context = _Context()
+data    = _types.SimpleNamespace(materials=[], images=[], objects={}, filepath='')
+app     = _types.SimpleNamespace(driver_namespace={}, timers=None, background=True)
+
+class types:
+    class Object:
+        pass
+    class Material:
+        pass
+    class Image:
+        pass
+    class Mesh:
+        pass
@@ -0,0 +1,33 @@
+# Minimal stand-in for Blender's mathutils module used by benchmarks.
+# Matrix * Vector (Blender 2.7x API) is supported for the pre-series writer run by bench/check_baseline.py.
+import math
+
+class Vector(list):
+    def __init__(self, v=(0.0, 0.0, 0.0)):
+        super().__init__(float(x) for x in v)
+    x = property(lambda self: self[0], lambda self, v: self.__setitem__(0, v))
+    y = property(lambda self: self[1], lambda self, v: self.__setitem__(1, v))
+    z = property(lambda self: self[2], lambda self, v: self.__setitem__(2, v))
+
+    def angle(self, other) -> float:
+        d = sum(a * b for a, b in zip(self, other)) / math.sqrt(sum(a * a for a in self) * sum(b * b for b in other))
+        return math.acos(max(-1.0, min(1.0, d)))
+
+class Matrix(list):
+    # 4x4 row-major matrix
+    def __init__(self, rows=None):
+        rows = rows or [[1.0 if i == j else 0.0 for j in range(4)] for i in range(4)]
+        super().__init__([list(map(float, r)) for r in rows])
+
+    def __matmul__(self, v):
+        # transforms point
+        p = list(v) + [1.0]
+        return Vector(sum(self[i][j] * p[j] for j in range(4)) for i in range(3))
+    __mul__ = __matmul__
+
+    @staticmethod
+    def Translation(t):
+        m = Matrix()
+        for i in range(3):
+            m[i][3] = float(t[i])
+        return m
@@ -0,0 +1,71 @@
+# Minimal stand-in for Blender's mathutils.bvhtree used by benchmarks.
+# Triangles are sorted by grid cell of their centroids into leaves of _kLeafSize triangles and a ray is tested
+# against the bounding boxes of all leaves first, then against the triangles of hit leaves (two level BVH).
+import sys
+import numpy as np
+
+_kLeafSize = 64
+
+class BVHTree:
+    def __init__(self, triangles: np.ndarray, tri_polys: np.ndarray):
+        if len(triangles):
+            # sort by grid cell of centroid, so that triangles of a leaf are close together
+            c = triangles.mean(axis=1)
+            n = max(1, int(round((len(triangles) / _kLeafSize) ** (1 / 3))))
+            cell  = np.clip(((c - c.min(axis=0)) / np.maximum(np.ptp(c, axis=0), 1e-12) * n).astype(np.int64), 0, n - 1)
+            order = np.lexsort((c[:, 0], cell[:, 2], cell[:, 1], cell[:, 0]))
+            triangles, tri_polys = triangles[order], tri_polys[order]
+        self._v0    = triangles[:, 0]
+        self._e1    = triangles[:, 1] - triangles[:, 0]
+        self._e2    = triangles[:, 2] - triangles[:, 0]
+        self._polys = tri_polys
+        starts = np.arange(0, len(triangles), _kLeafSize)
+        self._leaf_min = np.minimum.reduceat(triangles.min(axis=1), starts) if len(starts) else np.zeros((0, 3))
+        self._leaf_max = np.maximum.reduceat(triangles.max(axis=1), starts) if len(starts) else np.zeros((0, 3))
+
+    @classmethod
+    def FromPolygons(cls, vertices, polygons, all_triangles=False, epsilon=0.0):
+        verts = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+        tris, tri_polys = [], []
+        for idx, poly in enumerate(polygons):
+            poly = list(poly)
+            for k in range(1, len(poly) - 1):
+                tris.append((poly[0], poly[k], poly[k + 1]))
+                tri_polys.append(idx)
+        return cls(verts[np.array(tris, dtype=np.int64).reshape(-1, 3)], np.array(tri_polys, dtype=np.int64))
+
+    def ray_cast(self, origin, direction, distance=sys.float_info.max):
+        # Returns (location, normal, index, distance) of the nearest hit
+        o, d = np.asarray(origin, dtype=np.float64), np.asarray(direction, dtype=np.float64)
+        d = d / np.linalg.norm(d)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            inv_d = 1.0 / d
+            t0 = (self._leaf_min - o) * inv_d
+            t1 = (self._leaf_max - o) * inv_d
+        t0, t1 = np.nan_to_num(t0, nan=-np.inf), np.nan_to_num(t1, nan=np.inf)
+        near = np.minimum(t0, t1).max(axis=1)
+        far  = np.maximum(t0, t1).min(axis=1)
+        leaves = np.flatnonzero((near <= far) & (far >= 0) & (near <= distance))
+        if len(leaves) == 0:
+            return None, None, None, None
+        tri = (leaves[:, None] * _kLeafSize + np.arange(_kLeafSize)).reshape(-1)
+        tri = tri[tri < len(self._v0)]
+
+        # Moller-Trumbore intersection with triangles of hit leaves
+        v0, e1, e2 = self._v0[tri], self._e1[tri], self._e2[tri]
+        p   = np.cross(d, e2)
+        det = np.einsum('ij,ij->i', e1, p)
+        ok  = np.abs(det) > 1e-12
+        inv = np.where(ok, 1.0 / np.where(ok, det, 1.0), 0.0)
+        s   = o - v0
+        u   = np.einsum('ij,ij->i', s, p) * inv
+        q   = np.cross(s, e1)
+        v   = (q @ d) * inv
+        t   = np.einsum('ij,ij->i', e2, q) * inv
+        hit = ok & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0) & (t <= distance)
+        if not hit.any():
+            return None, None, None, None
+        k = int(np.flatnonzero(hit)[np.argmin(t[hit])])
+        i = int(tri[k])
+        n = np.cross(self._e1[i], self._e2[i])
+        return tuple(o + d * t[k]), tuple(n / np.linalg.norm(n)), int(self._polys[i]), float(t[k])
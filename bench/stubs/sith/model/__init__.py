@@ -0,0 +1,43 @@
+# Stand-in for sith.model types with the attributes used by obj_to_ndy.py
+from sith.types import *
+
+kGModel3do = 'GModel3do'
+
+class Mesh3doFace:
+    def __init__(self):
+        self.materialIdx  = 0
+        self.type         = 0
+        self.geometryMode = 4
+        self.lightMode    = 3
+        self.textureMode  = 1
+        self.vertexIdxs   = []
+        self.uvIdxs       = []
+        self.color        = Vector4f(0.0, 0.0, 0.0, 1.0)
+        self.normal       = Vector3f(0.0, 0.0, 1.0)
+
+class Mesh3do:
+    def __init__(self, idx = 0, name = ''):
+        self.idx          = idx
+        self.name         = name
+        self.vertices     = []
+        self.vertexColors = []
+        self.normals      = []
+        self.uvs          = []
+        self.faces        = []
+
+class Model3doGeoSet:
+    def __init__(self):
+        self.meshes = []
+
+class Mesh3doNode:
+    def __init__(self, name = '', meshIdx = -1, obj = None):
+        self.name    = name
+        self.meshIdx = meshIdx
+        self.obj     = obj
+
+class Model3do:
+    def __init__(self, name = ''):
+        self.name          = name
+        self.geosets       = []
+        self.materials     = []
+        self.meshHierarchy = []
@@ -0,0 +1,26 @@
+# Stand-in for sith model exporter.
+# Synthetic objects carry prebuilt `sith_mesh` (Mesh3do with object local material indices)
+# and `sith_materials`, which are added to the model the same way the addon adds Blender meshes.
+from sith.model import Mesh3doNode
+
+def _model3do_add_obj(model, obj, parent = None, uvAbsolute = False, exportVertexColors = True, **kwargs):
+    mat_idxs = { name: i for i, name in enumerate(model.materials) }
+    stack = [obj]
+    while stack:
+        o = stack.pop(0)
+        mesh_idx = -1
+        mesh = getattr(o, 'sith_mesh', None)
+        if mesh is not None:
+            for name in o.sith_materials:
+                if name not in mat_idxs:
+                    mat_idxs[name] = len(model.materials)
+                    model.materials.append(name)
+            remap = [mat_idxs[name] for name in o.sith_materials]
+            for f in mesh.faces:
+                f.materialIdx = remap[f.materialIdx]
+
+            mesh_idx = len(model.geosets[0].meshes)
+            mesh.idx = mesh_idx
+            model.geosets[0].meshes.append(mesh)
+        model.meshHierarchy.append(Mesh3doNode(o.name, mesh_idx, o))
+        stack.extend(o.children)
@@ -0,0 +1,12 @@
+# Stand-in for sith 3DO writer number formatting
+def _vector_to_str(vector, compact = True, align = 10):
+    out = ''
+    for scalar in vector:
+        if compact:
+            out += '\t{:>{}.8f}'.format(scalar, align)
+        else:
+            out += ' {:>{}.6f}'.format(scalar, align)
+    return out
+
+def _radius_to_str(r):
+    return '{:.8f}'.format(r)
@@ -0,0 +1,16 @@
+# Stand-in for sith text serialization utils
+def writeLine(file, line):
+    file.write(line + '\n')
+
+def writeNewLine(file):
+    writeLine(file, '')
+
+def writeCommentLine(file, comment):
+    writeLine(file, '# ' + comment)
+
+def writeSectionTitle(file, section):
+    writeLine(file, 'SECTION: ' + section.upper())
+    writeNewLine(file)
+
+def writeKeyValue(file, key, value, keyWidth = 0):
+    writeLine(file, '{} {}'.format(key.ljust(keyWidth), value))
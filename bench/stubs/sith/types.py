@@ -0,0 +1,16 @@
+from typing import NamedTuple
+
+class Vector2f(NamedTuple):
+    x: float
+    y: float
+
+class Vector3f(NamedTuple):
+    x: float
+    y: float
+    z: float
+
+class Vector4f(NamedTuple):
+    x: float
+    y: float
+    z: float
+    w: float
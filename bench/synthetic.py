@@ -0,0 +1,152 @@
+# Synthetic sector hierarchies for benchmarks.
+# Hierarchy is a square grid of tiles (sectors), each tile is an n x n quad mesh of a smooth
+# height field, so neighbouring tiles share boundary vertices and surfaces have various slopes.
+import math
+import os
+import sys
+import types
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stubs'))
+
+from mathutils import Matrix
+from sith.model import Mesh3do, Mesh3doFace
+from sith.types import Vector2f, Vector3f, Vector4f
+
+kMaterials  = ['floor.mat', 'wall.mat', 'rock.mat', 'sand.mat', 'wood.mat', 'metal.mat', 'water.mat', 'grass.mat']
+kQuadSize   = 0.1
+kWallHeight = 1.0
+
+class _Collection:
+    # Blender property collection with foreach_get, properties are given as arrays with one row per item
+    def __init__(self, **props):
+        self.props = props
+
+    def __len__(self):
+        return len(next(iter(self.props.values())))
+
+    def foreach_get(self, attr, out):
+        out[:] = self.props[attr].ravel()
+
+class SyntheticMeshData:
+    # Blender mesh data of Mesh3do (before sith stand-in remaps its material indices),
+    # read by obj_to_ndy.py when export_mesh_data is set
+    def __init__(self, mesh: Mesh3do):
+        sizes = np.array([len(f.vertexIdxs) for f in mesh.faces], dtype=np.int32)
+        loops = np.array([i for f in mesh.faces for i in f.vertexIdxs], dtype=np.int32)
+        uvs   = np.array([tuple(mesh.uvs[i]) for f in mesh.faces for i in f.uvIdxs], dtype=np.float32).reshape(-1, 2)
+        uvs[:, 1] = 1.0 - uvs[:, 1] # Blender uv origin is bottom left corner
+        self.vertices = _Collection(co=np.array([tuple(v) for v in mesh.vertices], dtype=np.float32))
+        self.polygons = _Collection(
+            loop_start     = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int32),
+            loop_total     = sizes,
+            material_index = np.array([f.materialIdx for f in mesh.faces], dtype=np.int32),
+            normal         = np.array([tuple(f.normal) for f in mesh.faces], dtype=np.float32))
+        self.loops      = _Collection(vertex_index=loops)
+        self.uv_layers  = types.SimpleNamespace(active=types.SimpleNamespace(data=_Collection(uv=uvs)))
+        colors = _Collection(color=np.array([tuple(c) for c in mesh.vertexColors], dtype=np.float32))
+        self.color_attributes = types.SimpleNamespace(active_color=types.SimpleNamespace(domain='POINT', data=colors))
+
+class SyntheticObject:
+    # Object with the attributes obj_to_ndy.py and the sith stand-ins use
+    def __init__(self, name, mesh = None, matrix_world = None, children = ()):
+        self.name           = name
+        self.type           = 'MESH' if mesh is not None else 'EMPTY'
+        self.sith_mesh      = mesh
+        self.sith_materials = list(kMaterials)
+        self.data           = SyntheticMeshData(mesh) if mesh is not None else None
+        self.material_slots = [types.SimpleNamespace(name=m, material=None) for m in kMaterials]
+        self.matrix_world   = matrix_world or Matrix()
+        self.children       = list(children)
+        self.parent         = None
+        for c in self.children:
+            c.parent = self
+
+def _height(x: float, y: float) -> float:
+    return 0.4 * math.sin(x * 1.3) * math.cos(y * 0.9) + 0.15 * math.sin(x * 4.1 + y * 2.7)
+
+def make_tile(n: int, ox: float, oy: float, walls: bool = False) -> Mesh3do:
+    # Returns n x n quad mesh in local space of tile with world origin (ox, oy).
+    # If walls is set, tile also has walls of kWallHeight along its left and right edge facing inwards,
+    # so the walls of neighbouring tiles in a row are coincident (to be adjoined).
+    m = Mesh3do()
+    for j in range(n + 1):
+        for i in range(n + 1):
+            x, y = i * kQuadSize, j * kQuadSize
+            wx, wy = ox + x, oy + y
+            m.vertices.append(Vector3f(x, y, _height(wx, wy)))
+            m.vertexColors.append(Vector4f(0.5 + 0.5 * math.sin(wx), 0.5 + 0.5 * math.cos(wy), 0.5, 1.0))
+            m.uvs.append(Vector2f(i / n, j / n))
+
+    for j in range(n):
+        for i in range(n):
+            a = j * (n + 1) + i
+            f = Mesh3doFace()
+            f.vertexIdxs  = [a, a + 1, a + n + 2, a + n + 1]
+            f.uvIdxs      = list(f.vertexIdxs)
+            f.materialIdx = (i // 4 + j // 4) % len(kMaterials)
+            f.color       = Vector4f(0.1, 0.1, 0.1, 1.0)
+
+            # normal of quad from its diagonals
+            v0, v1, v2, v3 = (m.vertices[k] for k in f.vertexIdxs)
+            d1 = (v2.x - v0.x, v2.y - v0.y, v2.z - v0.z)
+            d2 = (v3.x - v1.x, v3.y - v1.y, v3.z - v1.z)
+            nx = d1[1] * d2[2] - d1[2] * d2[1]
+            ny = d1[2] * d2[0] - d1[0] * d2[2]
+            nz = d1[0] * d2[1] - d1[1] * d2[0]
+            l  = math.sqrt(nx * nx + ny * ny + nz * nz)
+            f.normal = Vector3f(nx / l, ny / l, nz / l)
+            m.faces.append(f)
+
+    if walls:
+        for i, nx in ((0, 1.0), (n, -1.0)):
+            top = len(m.vertices)
+            for j in range(n + 1):
+                v = m.vertices[j * (n + 1) + i]
+                m.vertices.append(Vector3f(v.x, v.y, v.z + kWallHeight))
+                m.vertexColors.append(m.vertexColors[j * (n + 1) + i])
+                m.uvs.append(Vector2f(j / n, 1.0))
+            for j in range(n):
+                f = Mesh3doFace()
+                quad = [j * (n + 1) + i, (j + 1) * (n + 1) + i, top + j + 1, top + j] # faces +x
+                f.vertexIdxs  = quad if nx > 0 else quad[::-1]
+                f.uvIdxs      = list(f.vertexIdxs)
+                f.materialIdx = 1 # wall.mat
+                f.color       = Vector4f(0.1, 0.1, 0.1, 1.0)
+                f.normal      = Vector3f(nx, 0.0, 0.0)
+                m.faces.append(f)
+    return m
+
+def make_hierarchy(num_faces: int, faces_per_sector: int = 10000, name: str = 'sector', walls: bool = False) -> SyntheticObject:
+    # Returns root object of hierarchy with approximately num_faces faces (without walls, see make_tile).
+    # The first tile is the root object and the rest are its children, tiles are named '<name><tile idx>'.
+    num_sectors = max(1, round(num_faces / faces_per_sector))
+    n    = max(1, round(math.sqrt(num_faces / num_sectors)))
+    cols = math.ceil(math.sqrt(num_sectors))
+    size = n * kQuadSize
+
+    tiles = []
+    for s in range(num_sectors):
+        ox, oy = (s % cols) * size, (s // cols) * size
+        tiles.append(SyntheticObject(f'{name}{s}', make_tile(n, ox, oy, walls), Matrix.Translation((ox, oy, 0.0))))
+    root = tiles[0]
+    root.children = tiles[1:]
+    for t in root.children:
+        t.parent = root
+    return root
+
+def make_lights(root: SyntheticObject, num_point_lights: int = 16) -> list:
+    # Returns a sun and grid of point lights above the hierarchy, as Blender light objects for light baking
+    objs = [root] + root.children
+    lo = np.min([np.array(o.matrix_world)[:3, 3] for o in objs], axis=0)
+    hi = np.max([np.array(o.matrix_world)[:3, 3] for o in objs], axis=0) + max(len(o.sith_mesh.vertices) for o in objs) ** 0.5 * kQuadSize
+    def _light(kind: str, pos, energy: float):
+        data = types.SimpleNamespace(type=kind, color=(1.0, 0.9, 0.8), energy=energy, use_custom_distance=False, cutoff_distance=0.0)
+        return types.SimpleNamespace(name=f'{kind.lower()}{pos}', type='LIGHT', data=data, matrix_world=Matrix.Translation(pos))
+    lights = [_light('SUN', (0.0, 0.0, 0.0), 0.5)]
+    n = max(1, round(math.sqrt(num_point_lights)))
+    for i in range(n):
+        for j in range(n):
+            lights.append(_light('POINT', (lo[0] + (hi[0] - lo[0]) * (i + 0.5) / n, lo[1] + (hi[1] - lo[1]) * (j + 0.5) / n, 2.0), 200.0))
+    return lights
@@ -1,39 +1,713 @@
 # Created by Crt Vavros.
 # Script tries to reimport all loaded MAT files from `mat_folder` directory
+# MAT files are read and decoded in parallel by a thread pool, and decoded textures
+# are copied to the existing images of Blender materials on the main thread.
+# MAT files which can't be decoded this way (e.g. color MATs) or materials without images
+# are reimported via Sith addon importMat on the main thread. By default only MAT formats whose decoded
+# pixels match importMat in a check run once per session are decoded in threads (see fast_decode).
+# Decoded textures can be stored in persistent cache (`mat_cache_dir`), so unchanged MAT files
+# are just memory-mapped from cache on the next reimport.
+# Path, size, mtime and content hash of each reimported MAT file are recorded in manifest
+# '<blend name>.mat_manifest.json' next to the .blend file. With reimport_mode = 'changed' only materials
+# whose MAT file differs from manifest are reimported, and with reimport_mode = 'watch' Blender timer
+# polls `mat_folder` and reimports changed MAT files. Running the script again in watch mode stops the watch
+# (running it in other mode also stops the watch and then reimports materials).
+# Set `profile` to print time spent in each reimport stage and write it to JSON report.
 import bpy
+import cProfile
+import hashlib
+import json
+import numpy as np
+import os
+import struct
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from pathlib import Path
 from sith.material import ColorMap, importMat
-from sith.utils import getDefaultCmpFilePath, getFilePathInDir
-from typing import Optional
+from sith.utils import getDefaultCmpFilePath
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 ############################################################
 # Adjust vars below
-mat_folder = '' # Path to directory containing .mat files
-cmp_file   = '' # Path to .cmp file (JKDF2 & MOTS)
+mat_folder  = '' # Path to directory containing .mat files
+cmp_file    = '' # Path to .cmp file (JKDF2 & MOTS)
+num_workers = 0  # Number of threads decoding MAT files, 0 = number of CPUs
+fast_decode = 'checked' # 'checked' - decode in threads only MAT formats whose pixels match importMat in the check
+                        # (8-bit, RGB565 and RGBA4444), other MATs are reimported via importMat,
+                        # 'all' - decode all texture MATs in threads without check, 'off' - reimport all via importMat
+
+mat_cache_dir      = '' # Directory of decoded MAT texture cache, cache is disabled if not set
+mat_cache_max_size = 1024 * 1024 * 1024 # max size of cache in bytes
+mat_cache_bypass   = False # don't use cache
+mat_cache_rebuild  = False # clear cache and decode all MAT files again
+
+reimport_mode  = 'all' # 'all' - all materials, 'changed' - only materials whose MAT file changed since last reimport,
+                       # 'watch' - poll mat_folder and reimport changed MAT files, run script again to stop watching
+watch_interval = 1.0   # seconds between polls of mat_folder in watch mode
+watch_debounce = 0.5   # seconds MAT files must stay unchanged before they are reimported in watch mode
+
+profile          = False # print time spent in each reimport stage and write JSON report
+profile_report   = ''    # path of JSON report, default '<blend name>.mat_reimport_profile.json'
+profile_memory   = False # also record peak of allocated memory of stages run on main thread (slower)
+profile_cprofile = False # dump cProfile stats of the slowest stage to '<profile_report>.<stage>.prof'.
+                         # Profiled stages are serialized, so MAT files are not decoded in parallel.
 ############################################################
 
+class MatCel(NamedTuple):
+    width: int
+    height: int
+    pixels: np.ndarray # RGBA float32 pixels (uint8 of cached cels, see cel_pixels), bottom row first as in Blender image
+
+class UnsupportedMatError(Exception):
+    pass
+
+_kMatHeader  = struct.Struct('<4s4i14i') # magic, version, type, num records, num textures, color format
+_kMatTexInfo = struct.Struct('<6i')      # texture type, color num, 4x padding
+_kMatTexExt  = struct.Struct('<4i')      # extended texture info, present if texture type has flag 0x8
+_kMatTexture = struct.Struct('<6i')      # width, height, transparent, 2x padding, num mipmaps
+_kCmpHeaderSize = 64
+_kDecoderVersion = 2 # decoded pixels of cache entries of older decoder differ
+
+# Color formats of MATs decoded by decode_mat and importMat in decoder check, fields are in MAT header order:
+# color mode, bpp, RGB bits, RGB left shifts, RGB right shifts, alpha bits, alpha left shift, alpha right shift
+_kCheckFormats = {
+    '8-bit'    : (0, 8,  0, 0, 0,  0, 0, 0,  0, 0, 0,  0, 0, 0),
+    'RGB565'   : (1, 16, 5, 6, 5,  11, 5, 0, 3, 2, 3,  0, 0, 0),
+    'RGBA4444' : (2, 16, 4, 4, 4,  12, 8, 4, 4, 4, 4,  4, 0, 4),
+}
+
+kManifestVersion = 1
+_kWatcherKey     = 'mat_reimporter_watcher' # key of running watcher in bpy.app.driver_namespace
+_kCheckKey       = 'mat_reimporter_checked_formats' # key of decoder check result in bpy.app.driver_namespace
+
 def import_colormap(cmp_file: str) -> Optional[ColorMap]:
     try:
         return ColorMap.load(cmp_file)
     except Exception as e:
         print(f"Warning: Failed to load ColorMap '{cmp_file}': {e}")
-        
-if len(cmp_file) == 0:
-    print('\nInfo: ColorMap path not set, loading default...')
-    cmp_file = getDefaultCmpFilePath(mat_folder)
-if cmp_file:
-    cmp = import_colormap(cmp_file)
-else:
-    print("Warning: No ColorMap was found!")
-        
-for mat in bpy.data.materials:
-    if Path(mat.name).suffix == '.mat':
-        mat_path = getFilePathInDir(mat.name, mat_folder)
-        if mat_path is not None:
+
+def load_palette(cmp_file: str) -> Optional[np.ndarray]:
+    # Returns ColorMap palette as (256, 3) array of RGB floats
+    try:
+        with open(cmp_file, 'rb') as f:
+            data = f.read(_kCmpHeaderSize + 256 * 3)
+        if data[:4] != b'CMP ' or len(data) < _kCmpHeaderSize + 256 * 3:
+            raise ValueError('invalid CMP file')
+        return np.frombuffer(data, np.uint8, 256 * 3, _kCmpHeaderSize).reshape(256, 3).astype(np.float32) / 255.0
+    except Exception as e:
+        print(f"Warning: Failed to load palette from ColorMap '{cmp_file}': {e}")
+
+def index_mat_dir(mat_folder: str) -> Dict[str, str]:
+    # Scans folder once and returns case-insensitive index of file name -> file path.
+    # Files in upper directories take precedence over files with the same name in sub-directories.
+    index = {}
+    for root, _, files in os.walk(mat_folder):
+        for f in files:
+            index.setdefault(f.lower(), os.path.join(root, f))
+    return index
+
+def _decode_channel(px: np.ndarray, bits: int, shl: int, shr: int) -> np.ndarray:
+    # Channel bits are expanded to 8 bits by header's right shift (the shift of 8-bit value right when encoding)
+    mask = (1 << bits) - 1
+    return np.minimum(((px >> shl) & mask) << shr, 255).astype(np.float32) / 255.0
+
+def _is_indexed_mat(data: bytes) -> bool:
+    return len(data) >= _kMatHeader.size and _kMatHeader.unpack_from(data, 0)[5] == 0
+
+def _color_format(color_info) -> Tuple[int, ...]:
+    # Returns color mode, bpp and bits of RGBA channels of MAT header color info
+    color_mode, bpp, r_bits, g_bits, b_bits, *_, a_bits, _, _ = color_info
+    return (color_mode, bpp, r_bits, g_bits, b_bits, a_bits)
+
+def _mat_format(data: bytes) -> Optional[Tuple[int, ...]]:
+    if len(data) < _kMatHeader.size:
+        return None
+    return _color_format(_kMatHeader.unpack_from(data, 0)[5:])
+
+def decode_mat(data: bytes, palette: Optional[np.ndarray]) -> List[MatCel]:
+    # Decodes the largest mipmap of each texture cel in MAT file data into RGBA pixels.
+    # Runs without bpy so it can be executed in worker thread.
+    magic, _, mat_type, num_records, num_textures, *color_info = _kMatHeader.unpack_from(data, 0)
+    if magic != b'MAT ':
+        raise ValueError('invalid MAT file')
+    if mat_type != 2 or num_textures < 1:
+        raise UnsupportedMatError('MAT has no textures')
+
+    color_mode, bpp, r_bits, g_bits, b_bits, r_shl, g_shl, b_shl, r_shr, g_shr, b_shr, a_bits, a_shl, a_shr = color_info
+    if color_mode == 0 and palette is None:
+        raise UnsupportedMatError('indexed MAT requires ColorMap')
+
+    pos = _kMatHeader.size
+    for _ in range(num_records):
+        tex_type = _kMatTexInfo.unpack_from(data, pos)[0]
+        pos += _kMatTexInfo.size
+        if tex_type & 0x8:
+            pos += _kMatTexExt.size
+
+    cels = []
+    pixel_size = bpp // 8
+    for _ in range(num_textures):
+        width, height, transparent, _, _, num_mipmaps = _kMatTexture.unpack_from(data, pos)
+        pos += _kMatTexture.size
+
+        n = width * height
+        raw = np.frombuffer(data, np.uint8, n * pixel_size, pos).reshape(n, pixel_size)
+        pixels = np.ones((n, 4), dtype=np.float32)
+        if color_mode == 0: # indexed
+            idx = raw[:, 0]
+            pixels[:, :3] = palette[idx]
+            if transparent:
+                pixels[idx == 0, 3] = 0.0
+        else: # RGB/RGBA
+            px = np.zeros(n, dtype=np.uint32)
+            for i in range(pixel_size):
+                px |= raw[:, i].astype(np.uint32) << (8 * i)
+            pixels[:, 0] = _decode_channel(px, r_bits, r_shl, r_shr)
+            pixels[:, 1] = _decode_channel(px, g_bits, g_shl, g_shr)
+            pixels[:, 2] = _decode_channel(px, b_bits, b_shl, b_shr)
+            if a_bits > 0:
+                pixels[:, 3] = _decode_channel(px, a_bits, a_shl, a_shr)
+
+        # MAT rows are top to bottom, Blender images bottom to top
+        cels.append(MatCel(width, height, np.ascontiguousarray(pixels.reshape(height, width, 4)[::-1])))
+        for level in range(num_mipmaps):
+            pos += (width >> level) * (height >> level) * pixel_size
+    return cels
+
+class MatCache:
+    # Content-addressed cache of decoded MAT textures.
+    # Entry '<key>.npy' holds RGBA uint8 pixels of all cels with shape (cels, height, width, 4)
+    # and is memory-mapped when loaded. Decoded pixels are multiples of 1/255, so uint8 entries are lossless
+    # and pixels are converted back to float when assigned to image (see cel_pixels).
+    # Key is hash of MAT file content and, for indexed MATs, ColorMap palette.
+    # Least recently used entries are evicted when cache grows over max_size bytes.
+    kVersion = 2 # entries of older versions held float32 pixels
+    def __init__(self, cache_dir: str, max_size: int, rebuild: bool = False):
+        self.cache_dir = cache_dir
+        self.max_size  = max_size
+        self.hits      = 0
+        self.misses    = 0
+        self._lock     = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        if rebuild:
+            for e in os.scandir(cache_dir):
+                if e.name.endswith('.npy'):
+                    os.remove(e.path)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.npy')
+
+    def key(self, mat_hash: str, indexed: bool, palette_hash: bytes) -> str:
+        key = '{}.{}.{}'.format(mat_hash, _kDecoderVersion, self.kVersion).encode()
+        return hashlib.blake2b(key + palette_hash if indexed else key, digest_size=16).hexdigest()
+
+    def load(self, key: str) -> Optional[List[MatCel]]:
+        path = self._path(key)
+        try:
+            pixels = np.load(path, mmap_mode='r')
+            os.utime(path) # mark as recently used
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return [MatCel(p.shape[1], p.shape[0], p) for p in pixels]
+
+    def store(self, key: str, cels: List[MatCel]):
+        if len({ (c.width, c.height) for c in cels }) != 1:
+            return # only cels of the same size are cached
+        path = self._path(key)
+        tmp_path = path + f'.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.stack([np.rint(c.pixels * 255).astype(np.uint8) for c in cels]))
+        os.replace(tmp_path, path)
+
+    def evict(self) -> Tuple[int, int]:
+        # Removes least recently used entries until cache size is under max_size.
+        # Returns number of entries and cache size in bytes.
+        entries = [(e.stat().st_mtime_ns, e.stat().st_size, e.path) for e in os.scandir(self.cache_dir) if e.name.endswith('.npy')]
+        size = sum(e[1] for e in entries)
+        num_entries = len(entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            os.remove(path)
+            size -= entry_size
+            num_entries -= 1
+        return num_entries, size
+
+    def report(self):
+        num_entries, size = self.evict()
+        print("Info: MAT cache: {} hits, {} misses, {} entries ({:.1f} MB)".format(self.hits, self.misses, num_entries, size / (1024 * 1024)))
+
+class MatProfiler:
+    # Collects time spent in reimport stages (colormap, index, read, cache, decode, assign, ...).
+    # Stages can run in worker threads, so time is measured per thread (thread CPU time)
+    # and summed; wall time of stages run in parallel can exceed total reimport time.
+    # Memory peak is only recorded on main thread, since tracemalloc traces the whole process.
+    def __init__(self, enabled: bool = False, memory: bool = False, cprofile: bool = False):
+        self.enabled  = enabled
+        self.memory   = enabled and memory
+        self.cprofile = enabled and cprofile
+        self.stages: Dict[str, dict] = {}
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._lock    = threading.Lock()
+        self._cprofile_lock = threading.RLock() # only one cProfile can be active at a time
+        self._local   = threading.local()        # cProfile depth of stages nested in this thread
+        self._start   = time.perf_counter()
+        self._tracing = False
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+    def count(self, name: str, items: int = 0, nbytes: int = 0):
+        if self.enabled:
+            with self._lock:
+                s = self.stages.setdefault(name, { 'wall': 0.0, 'cpu': 0.0, 'items': 0, 'bytes': 0 })
+                s['items'] += items
+                s['bytes'] += nbytes
+
+    @contextmanager
+    def stage(self, name: str, items: int = 0, nbytes: int = 0):
+        if not self.enabled:
+            yield
+            return
+        self.count(name, items, nbytes)
+        on_main = self.memory and threading.current_thread() is threading.main_thread()
+        if on_main:
+            mem_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        # Only the outermost stage of thread is profiled by cProfile, nested stage would re-enable active profiler
+        prof = None
+        if self.cprofile and not getattr(self._local, 'depth', 0):
+            self._cprofile_lock.acquire()
+            with self._lock:
+                prof = self._profiles.setdefault(name, cProfile.Profile())
+            prof.enable()
+        self._local.depth = getattr(self._local, 'depth', 0) + 1
+        wall = time.perf_counter()
+        cpu  = time.thread_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu  = time.thread_time() - cpu
+            self._local.depth -= 1
+            if prof:
+                prof.disable()
+                self._cprofile_lock.release()
+            with self._lock:
+                s = self.stages[name]
+                s['wall'] += wall
+                s['cpu']  += cpu
+                if on_main:
+                    s['alloc_peak'] = max(s.get('alloc_peak', 0), tracemalloc.get_traced_memory()[1] - mem_start)
+
+    def finish(self, report_path: Optional[str], info: dict):
+        # Prints summary, writes JSON report and cProfile stats of the slowest stage
+        if not self.enabled:
+            return
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+        total = time.perf_counter() - self._start
+        print("Info: MAT reimport profile, total {:.3f}s".format(total))
+        print("  {:<12}{:>9}{:>9}{:>8}{:>9}".format('stage', 'wall s', 'cpu s', 'items', 'MB'))
+        for name, s in self.stages.items():
+            print("  {:<12}{:>9.3f}{:>9.3f}{:>8}{:>9.2f}".format(name, s['wall'], s['cpu'], s['items'], s['bytes'] / (1024 * 1024)))
+
+        if not report_path:
+            print("Warning: .blend file is not saved and profile_report is not set, profile report won't be written")
+            return
+        report = { **info, 'total_wall': total, 'stages': self.stages }
+        if self._profiles:
+            slowest = max(self._profiles, key=lambda n: self.stages[n]['wall'])
+            prof_path = '{}.{}.prof'.format(report_path, slowest)
+            self._profiles[slowest].dump_stats(prof_path)
+            report['cprofile'] = { 'stage': slowest, 'file': prof_path }
+            print("Info: cProfile stats of the slowest stage '{}' written to '{}'".format(slowest, prof_path))
+        try:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print("Info: MAT reimport profile written to '{}'".format(report_path))
+        except OSError as e:
+            print("Warning: Couldn't write profile report '{}': {}".format(report_path, e))
+
+_kNoProfiler = MatProfiler()
+
+def get_profile_report_path() -> Optional[str]:
+    if profile_report:
+        return profile_report
+    if not bpy.data.filepath:
+        return None
+    return os.path.splitext(bpy.data.filepath)[0] + '.mat_reimport_profile.json'
+
+def load_mat(mat_path: str, palette: Optional[np.ndarray], palette_hash: bytes, cache: Optional[MatCache],
+             prev_hash: Optional[str] = None, formats: Optional[set] = None, profiler: MatProfiler = _kNoProfiler) -> Tuple[str, Optional[List[MatCel]]]:
+    # Reads MAT file and returns its content hash and decoded cels, from cache if available.
+    # Cels are None if content hash equals prev_hash i.e. file didn't change,
+    # and empty list if MAT can't be decoded and has to be reimported via importMat.
+    # If formats is set, only MATs of these color formats (see _color_format) are decoded.
+    with profiler.stage('read', 1):
+        with open(mat_path, 'rb') as f:
+            data = f.read()
+        mat_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
+    profiler.count('read', nbytes=len(data))
+    if mat_hash == prev_hash:
+        return mat_hash, None
+    if formats is not None and _mat_format(data) not in formats:
+        return mat_hash, []
+
+    try:
+        cels = None
+        if cache is not None:
+            key = cache.key(mat_hash, _is_indexed_mat(data), palette_hash)
+            with profiler.stage('cache_load', 1):
+                cels = cache.load(key)
+        if cels is None:
+            with profiler.stage('decode', 1):
+                cels = decode_mat(data, palette)
+            profiler.count('decode', nbytes=sum(c.pixels.nbytes for c in cels))
+            if cache is not None:
+                with profiler.stage('cache_store', 1):
+                    cache.store(key, cels)
+        return mat_hash, cels
+    except UnsupportedMatError:
+        return mat_hash, []
+
+def get_manifest_path() -> Optional[str]:
+    # Returns path of manifest next to .blend file or None if .blend file is not saved
+    if not bpy.data.filepath:
+        return None
+    return os.path.splitext(bpy.data.filepath)[0] + '.mat_manifest.json'
+
+def load_manifest(path: Optional[str]) -> dict:
+    if path:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == kManifestVersion:
+                return manifest
+        except (OSError, ValueError):
+            pass
+    return {}
+
+def save_manifest(path: Optional[str], manifest: dict):
+    if not path:
+        print("Warning: .blend file is not saved, MAT manifest won't be stored")
+        return
+    try:
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"Warning: Couldn't write MAT manifest '{path}': {e}")
+
+def _material_images(mat: bpy.types.Material) -> List[bpy.types.Image]:
+    images = []
+    if getattr(mat, 'use_nodes', False) and mat.node_tree:
+        images = [n.image for n in mat.node_tree.nodes if n.type == 'TEX_IMAGE' and n.image]
+    elif hasattr(mat, 'texture_slots'): # Blender 2.7x
+        images = [s.texture.image for s in mat.texture_slots if s and s.texture and getattr(s.texture, 'image', None)]
+    return list(dict.fromkeys(images)) # remove duplicates, keep order
+
+def cel_pixels(cel: MatCel) -> np.ndarray:
+    # Returns RGBA float32 pixels of cel, cels loaded from MatCache hold uint8 pixels
+    return cel.pixels if cel.pixels.dtype == np.float32 else cel.pixels.astype(np.float32) / np.float32(255)
+
+def assign_cels(mat: bpy.types.Material, cels: List[MatCel]) -> bool:
+    # Copies decoded cels to images of material set up by importMat on previous import.
+    # Returns False if material's images don't match cels, material then has to be set up again by importMat.
+    images = _material_images(mat)
+    if not images or len(images) != len(cels):
+        return False
+    for img, cel in zip(images, cels):
+        if tuple(img.size) != (cel.width, cel.height):
+            img.scale(cel.width, cel.height)
+        if hasattr(img.pixels, 'foreach_set'):
+            img.pixels.foreach_set(cel_pixels(cel).ravel())
+        else:
+            img.pixels[:] = cel_pixels(cel).ravel()
+        img.update()
+        if img.packed_file:
+            img.pack()
+    return True
+
+def _make_check_mat(color_info: Tuple[int, ...], width: int = 16, height: int = 16) -> bytes:
+    # Returns MAT file data with one texture of given color format whose pixels cover the whole range of channel values
+    bpp = color_info[1]
+    rng = np.random.default_rng(7)
+    px  = rng.integers(0, 1 << bpp, width * height, dtype=np.uint32)
+    px[:2] = (0, (1 << bpp) - 1)
+    if bpp == 8:
+        px[:256] = np.arange(256)
+    data  = _kMatHeader.pack(b'MAT ', 0x32, 2, 1, 1, *color_info)
+    data += _kMatTexInfo.pack(8, 0, 0, 0, 0, 0) + _kMatTexExt.pack(0, 0, 0, 0)
+    data += _kMatTexture.pack(width, height, 1, 0, 0, 1) # transparent, one mipmap
+    return data + px.astype(np.uint8 if bpp == 8 else np.uint16).tobytes()
+
+def _image_pixels(img: bpy.types.Image) -> np.ndarray:
+    pixels = np.zeros(img.size[0] * img.size[1] * 4, dtype=np.float32)
+    if hasattr(img.pixels, 'foreach_get'):
+        img.pixels.foreach_get(pixels)
+    else:
+        pixels[:] = img.pixels[:]
+    return pixels
+
+def _remove_material(name: str):
+    mat = bpy.data.materials.get(name)
+    if mat is not None:
+        images = _material_images(mat)
+        bpy.data.materials.remove(mat)
+        for img in images:
+            bpy.data.images.remove(img)
+
+def check_decoder(palette: Optional[np.ndarray], cmp: Optional[ColorMap]) -> set:
+    # Decodes one 8-bit, RGB565 and RGBA4444 MAT with decode_mat and with importMat and compares their pixels.
+    # Returns color formats (see _color_format) whose pixels match, only these are decoded in worker threads.
+    # Check MATs are imported as temporary materials which are removed afterwards.
+    formats = set()
+    with tempfile.TemporaryDirectory(prefix='mat_reimporter_check_') as tmp_dir:
+        for name, color_info in _kCheckFormats.items():
+            if color_info[0] == 0 and palette is None:
+                continue
+            mat_name = 'mat_reimporter_check_{}.mat'.format(name.lower().replace('-', ''))
+            mat_path = os.path.join(tmp_dir, mat_name)
+            data = _make_check_mat(color_info)
+            with open(mat_path, 'wb') as f:
+                f.write(data)
+            try:
+                cels = decode_mat(data, palette)
+                mat  = importMat(mat_path, cmp) or bpy.data.materials.get(mat_name)
+                images = _material_images(mat) if mat is not None else []
+                ok = len(images) == len(cels) and all(tuple(img.size) == (c.width, c.height)
+                    and np.allclose(_image_pixels(img), c.pixels.ravel(), atol=1.0 / 255) for img, c in zip(images, cels))
+            except Exception as e:
+                print("Warning: MAT decoder check of {} MAT failed: {}".format(name, e))
+                ok = False
+            finally:
+                _remove_material(mat_name)
+            if ok:
+                formats.add(_color_format(color_info))
+            else:
+                print("Info: Decoded {} MAT doesn't match importMat, {} MATs are reimported via importMat".format(name, name))
+    return formats
+
+def _decoded_formats(palette: Optional[np.ndarray], palette_hash: bytes, cmp: Optional[ColorMap]) -> Optional[set]:
+    # Returns color formats of MATs decoded in worker threads according to fast_decode, None = all formats.
+    # Result of decoder check is kept for the Blender session.
+    if fast_decode == 'all':
+        return None
+    if fast_decode != 'checked':
+        return set()
+    checked = bpy.app.driver_namespace.get(_kCheckKey)
+    if checked is None or checked[0] != (palette_hash, _kDecoderVersion):
+        checked = ((palette_hash, _kDecoderVersion), check_decoder(palette, cmp))
+        bpy.app.driver_namespace[_kCheckKey] = checked
+    return checked[1]
+
+def _find_mats(mat_folder: str) -> Tuple[List[Tuple[bpy.types.Material, str]], List[str]]:
+    # Returns list of (material, MAT file path) and names of materials whose MAT file wasn't found
+    mat_index = index_mat_dir(mat_folder)
+    found   = []
+    missing = []
+    for mat in bpy.data.materials:
+        if Path(mat.name).suffix == '.mat':
+            mat_path = mat_index.get(mat.name.lower())
+            if mat_path is not None:
+                found.append((mat, mat_path))
+            else:
+                missing.append(mat.name)
+    return found, missing
+
+def reimport_materials(mat_folder: str, cmp_file: str, num_workers: int = 0, cache: Optional[MatCache] = None,
+                       manifest: Optional[dict] = None, changed_only: bool = False, profiler: MatProfiler = _kNoProfiler) -> dict:
+    # Reimports materials and returns new manifest.
+    # If changed_only is set, materials whose MAT file path, size and mtime or content hash
+    # equal the entry in manifest are skipped.
+    start = time.perf_counter()
+    if len(cmp_file) == 0:
+        print('\nInfo: ColorMap path not set, loading default...')
+        cmp_file = getDefaultCmpFilePath(mat_folder)
+
+    palette = None
+    with profiler.stage('colormap'):
+        if cmp_file:
+            palette = load_palette(cmp_file)
+        else:
+            print("Warning: No ColorMap was found!")
+        palette_hash = hashlib.blake2b(palette.tobytes() if palette is not None else b'').digest()
+
+    # Sith ColorMap is only needed when MAT is reimported via importMat or decoder is checked against it
+    cmp = None
+    cmp_loaded = False
+    def _colormap() -> Optional[ColorMap]:
+        nonlocal cmp, cmp_loaded
+        if cmp_file and not cmp_loaded:
+            with profiler.stage('colormap'):
+                cmp = import_colormap(cmp_file)
+            cmp_loaded = True
+        return cmp
+
+    # Manifest entries are valid only for the same ColorMap palette
+    manifest = manifest or {}
+    prev_entries = manifest.get('materials', {}) if manifest.get('cmp_hash') == palette_hash.hex() else {}
+    entries = {}
+
+    with profiler.stage('index'):
+        found, missing = _find_mats(mat_folder)
+    profiler.count('index', len(found) + len(missing))
+    for name in missing:
+        print("Warning: Couldn't find material: ", name)
+
+    jobs = []
+    with profiler.stage('stat', len(found)):
+        for mat, mat_path in found:
+            st = os.stat(mat_path)
+            prev = prev_entries.get(mat.name) if changed_only else None
+            if prev and prev['path'] != mat_path:
+                prev = None
+            if prev and prev['size'] == st.st_size and prev['mtime_ns'] == st.st_mtime_ns:
+                entries[mat.name] = prev
+                continue
+            jobs.append((mat, mat_path, st, prev['hash'] if prev else None))
+
+    formats = None
+    if jobs:
+        # ColorMap is loaded before the check, so its stage isn't nested in check's stage
+        cmp_check = _colormap() if fast_decode == 'checked' else None
+        with profiler.stage('decode_check'):
+            formats = _decoded_formats(palette, palette_hash, cmp_check)
+
+    failed    = 0
+    unchanged = len(found) - len(jobs)
+    with ThreadPoolExecutor(max_workers=num_workers or None) as pool:
+        # numpy releases GIL while decoding, so threads decode in parallel
+        futures = { pool.submit(load_mat, mat_path, palette, palette_hash, cache, prev_hash, formats, profiler): (mat, mat_path, st)
+                    for mat, mat_path, st, prev_hash in jobs }
+        for future in as_completed(futures):
+            mat, mat_path, st = futures[future]
             try:
-                importMat(mat_path, cmp)
+                mat_hash, cels = future.result()
+                if cels is None: # file was touched but content didn't change
+                    unchanged += 1
+                else:
+                    assigned = False
+                    if cels:
+                        with profiler.stage('assign', 1, sum(c.pixels.nbytes for c in cels)):
+                            assigned = assign_cels(mat, cels)
+                    if not assigned:
+                        _colormap()
+                        with profiler.stage('import_mat', 1):
+                            importMat(mat_path, cmp)
+                entries[mat.name] = { 'path': mat_path, 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'hash': mat_hash }
             except Exception as e:
                 print("Warning: Couldn't load material: ", mat_path)
                 print("  Error: {}".format(e))
-        else:
-            print("Warning: Couldn't find material: ", mat.name)
\ No newline at end of file
+                failed += 1
+
+    print("Info: Reimported {} materials: found={} unchanged={} missing={} failed={} in {:.2f}s"
+        .format(len(found) - unchanged - failed, len(found), unchanged, len(missing), failed, time.perf_counter() - start))
+    if cache:
+        with profiler.stage('cache_evict'):
+            cache.report()
+
+    return { 'version': kManifestVersion, 'cmp_hash': palette_hash.hex(), 'materials': entries }
+
+def reimport_and_save(mat_folder: str, cmp_file: str, num_workers: int, cache: Optional[MatCache],
+                      manifest_path: Optional[str], manifest: dict, changed_only: bool) -> dict:
+    # Reimports materials, stores new manifest and, if profiling is enabled, writes profile report
+    profiler = MatProfiler(profile, profile_memory, profile_cprofile)
+    manifest = reimport_materials(mat_folder, cmp_file, num_workers, cache, manifest, changed_only, profiler)
+    with profiler.stage('manifest', len(manifest['materials'])):
+        save_manifest(manifest_path, manifest)
+    profiler.finish(get_profile_report_path(), {
+        'mat_folder'  : mat_folder,
+        'mode'        : 'changed' if changed_only else 'all',
+        'materials'   : len(manifest['materials']),
+        'num_workers' : num_workers or os.cpu_count(),
+        'cache'       : { 'hits': cache.hits, 'misses': cache.misses } if cache else None
+    })
+    return manifest
+
+class MatWatcher:
+    # Blender timer callback which polls MAT files of materials and reimports changed files.
+    # Reimport is debounced until files stop changing for `debounce` seconds,
+    # so MAT files which are still being written are not loaded.
+    def __init__(self, mat_folder: str, cmp_file: str, num_workers: int, cache: Optional[MatCache],
+                 interval: float, debounce: float):
+        self.mat_folder    = mat_folder
+        self.cmp_file      = cmp_file
+        self.num_workers   = num_workers
+        self.cache         = cache
+        self.interval      = interval
+        self.debounce      = debounce
+        self.manifest_path = get_manifest_path()
+        self.manifest      = load_manifest(self.manifest_path)
+        self.snapshot      = None
+        self.last_change   = None
+
+    def _snapshot(self) -> Dict[str, Tuple[str, int, int]]:
+        snapshot = {}
+        for mat, mat_path in _find_mats(self.mat_folder)[0]:
+            try:
+                st = os.stat(mat_path)
+                snapshot[mat.name] = (mat_path, st.st_size, st.st_mtime_ns)
+            except OSError:
+                pass
+        return snapshot
+
+    def reimport(self):
+        self.manifest = reimport_and_save(self.mat_folder, self.cmp_file, self.num_workers, self.cache,
+                                          self.manifest_path, self.manifest, changed_only=True)
+
+    def __call__(self) -> float:
+        try:
+            snapshot = self._snapshot()
+            if snapshot != self.snapshot:
+                self.snapshot    = snapshot
+                self.last_change = time.monotonic()
+            elif self.last_change is not None and time.monotonic() - self.last_change >= self.debounce:
+                self.last_change = None
+                self.reimport()
+        except Exception as e:
+            print("Warning: MAT watch failed: {}".format(e))
+        return self.interval
+
+def start_watching(watcher: MatWatcher):
+    stop_watching()
+    watcher.reimport()
+    watcher.snapshot = watcher._snapshot()
+    bpy.app.driver_namespace[_kWatcherKey] = watcher
+    bpy.app.timers.register(watcher, first_interval=watcher.interval, persistent=True)
+    print("Info: Watching MAT folder '{}', run script again to stop".format(watcher.mat_folder))
+
+def stop_watching() -> bool:
+    # Returns True if watcher was running
+    watcher = bpy.app.driver_namespace.pop(_kWatcherKey, None)
+    if watcher is None:
+        return False
+    if bpy.app.timers.is_registered(watcher):
+        bpy.app.timers.unregister(watcher)
+    print("Info: Stopped watching MAT folder '{}'".format(watcher.mat_folder))
+    return True
+
+if __name__ == '__main__':
+    watching = stop_watching()
+    cache = None
+    if mat_cache_dir and not mat_cache_bypass and not (watching and reimport_mode == 'watch'):
+        cache = MatCache(mat_cache_dir, mat_cache_max_size, mat_cache_rebuild)
+    if reimport_mode == 'watch':
+        if not watching: # running script again in watch mode only stops the watch
+            start_watching(MatWatcher(mat_folder, cmp_file, num_workers, cache, watch_interval, watch_debounce))
+    else:
+        manifest_path = get_manifest_path()
+        reimport_and_save(mat_folder, cmp_file, num_workers, cache, manifest_path,
+                          load_manifest(manifest_path), changed_only=(reimport_mode == 'changed'))
@@ -0,0 +1,153 @@
+# Batch exports objects from multiple .blend files to NDY/JKL format.
+# Export jobs are run in parallel by a pool of background Blender processes,
+# each worker opens one .blend file and runs obj_to_ndy.py for its objects.
+#
+# Script runs with regular Python (not inside Blender):
+#   python ndy_batch_export.py manifest.json [--blender <path>] [--workers N] [--results results.json]
+#
+# Manifest format (relative paths are resolved against manifest directory):
+#   {
+#     "defaults": { "version": "IJIM" },
+#     "jobs": [
+#       { "blend": "level.blend", "object": "room1", "out_file": "room1.ndy",
+#         "mat_start_idx": 120, "vert_start_idx": 5400, "uv_start_idx": 6100, "adjoin_start_idx": 700,
+#         "surface_start_idx": 2300, "sector_idx": 80 },
+#       { "blend": "level.blend", "object": "room2", "out_file": "level_new.ndy", "splice_file": "level.ndy" },
+#       { "blend": "level.blend", "object": ["room3", "room4"], "out_file": "rooms.ndy" }
+#     ]
+#   }
+# Job "object" can be list of objects whose hierarchies are exported together to one file.
+# Job values which are not set fall back to "defaults" and then to obj_to_ndy.py script variables.
+# Without Blender, bench/stub_blender.py can be passed as --blender, see bench/bench_batch_export.py.
+
+import argparse
+import json
+import os
+import shlex
+import subprocess
+import sys
+import tempfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+kExportScript = Path(__file__).resolve().parent / 'obj_to_ndy.py'
+
+def load_manifest(path: Path) -> List[dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = { 'jobs': manifest }
+
+    base_dir = path.resolve().parent
+    defaults = manifest.get('defaults', {})
+    jobs = []
+    for idx, j in enumerate(manifest.get('jobs', [])):
+        job = { **defaults, **j }
+        if 'blend' not in job or 'object' not in job:
+            raise ValueError(f"Manifest job {idx} must specify 'blend' and 'object'")
+        job['blend'] = str(base_dir / job['blend'])
+        for key in ('splice_file', 'export_cache_dir', 'profile_report'):
+            if job.get(key):
+                job[key] = str(base_dir / job[key])
+        if 'out_file' in job:
+            job['out_file'] = str(base_dir / job['out_file'])
+        else:
+            name = job['object'] if isinstance(job['object'], str) else job['object'][0]
+            job['out_file'] = str(base_dir / (name + '.ndy'))
+        jobs.append(job)
+    return jobs
+
+def make_worker_batches(jobs: List[dict], objects_per_worker: int) -> List[Tuple[str, List[dict]]]:
+    # Groups jobs by .blend file so each file is loaded once per worker.
+    # If objects_per_worker > 0, jobs of the same file are split among more workers.
+    by_blend: Dict[str, List[dict]] = {}
+    for job in jobs:
+        by_blend.setdefault(job['blend'], []).append(job)
+
+    batches = []
+    for blend, blend_jobs in by_blend.items():
+        n = objects_per_worker if objects_per_worker > 0 else len(blend_jobs)
+        for i in range(0, len(blend_jobs), n):
+            batches.append((blend, blend_jobs[i:i + n]))
+    return batches
+
+def run_worker(blender_cmd: List[str], script: Path, blend: str, jobs: List[dict], timeout: Optional[float]) -> List[dict]:
+    # Runs background Blender process which exports jobs from blend file and returns per-job results
+    with tempfile.TemporaryDirectory(prefix='ndy_export_') as tmp_dir:
+        jobs_file    = os.path.join(tmp_dir, 'jobs.json')
+        results_file = os.path.join(tmp_dir, 'results.json')
+        with open(jobs_file, 'w', encoding='utf-8') as f:
+            json.dump(jobs, f)
+
+        cmd = blender_cmd + ['--background', blend, '--python-exit-code', '1', '--python', str(script),
+                             '--', '--jobs', jobs_file, '--results', results_file]
+        start = time.perf_counter()
+        error = None
+        try:
+            p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors='replace', timeout=timeout)
+            if p.returncode != 0:
+                error = 'Blender exited with code {}:\n{}'.format(p.returncode, '\n'.join(p.stdout.splitlines()[-20:]))
+        except subprocess.TimeoutExpired:
+            error = f'Blender worker timed out after {timeout} seconds'
+        except OSError as e:
+            error = f'Failed to start Blender: {e}'
+        worker_time = time.perf_counter() - start
+
+        results = []
+        if os.path.isfile(results_file):
+            with open(results_file, 'r', encoding='utf-8') as f:
+                results = json.load(f)
+
+    # Jobs without result didn't run because worker failed
+    for job in jobs[len(results):]:
+        results.append({ 'object': job['object'], 'out_file': job['out_file'], 'ok': False, 'error': error or 'No result', 'time': 0.0 })
+    for r in results:
+        r['blend'] = blend
+        r['worker_time'] = worker_time
+    return results
+
+def run_batch(jobs: List[dict], blender_cmd: List[str], script: Path = kExportScript, workers: Optional[int] = None,
+              objects_per_worker: int = 0, timeout: Optional[float] = None) -> List[dict]:
+    batches = make_worker_batches(jobs, objects_per_worker)
+    # Threads only wait for Blender worker processes, the export itself runs in Blender
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(run_worker, blender_cmd, script, blend, batch, timeout) for blend, batch in batches]
+        return [r for f in futures for r in f.result()]
+
+def print_summary(results: List[dict], wall_time: float):
+    for r in results:
+        status = 'OK    ' if r['ok'] else 'FAILED'
+        obj    = r['object'] if isinstance(r['object'], str) else ','.join(r['object'])
+        print(f"{status} {r['time']:8.2f}s  {Path(r['blend']).name}:{obj} -> {r['out_file']}")
+        if not r['ok']:
+            print(f"  Error: {r['error']}")
+    num_ok = sum(1 for r in results if r['ok'])
+    print(f"\nExported {num_ok}/{len(results)} objects in {wall_time:.2f}s")
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Batch exports Blender objects to NDY/JKL files using background Blender processes.')
+    parser.add_argument('manifest', type=Path, help='JSON manifest with export jobs')
+    parser.add_argument('--blender', default=os.environ.get('BLENDER', 'blender'), help='Blender executable or command (default: $BLENDER or blender)')
+    parser.add_argument('--script', type=Path, default=kExportScript, help='path to obj_to_ndy.py')
+    parser.add_argument('--workers', type=int, default=None, help='max number of parallel Blender processes (default: CPU count)')
+    parser.add_argument('--objects-per-worker', type=int, default=0, help='max objects exported by one Blender process, 0 = all objects of .blend file')
+    parser.add_argument('--timeout', type=float, default=None, help='timeout in seconds for each Blender process')
+    parser.add_argument('--results', type=Path, help='write per-job results to JSON file')
+    args = parser.parse_args(argv)
+
+    jobs  = load_manifest(args.manifest)
+    start = time.perf_counter()
+    results = run_batch(jobs, shlex.split(args.blender), args.script, args.workers, args.objects_per_worker, args.timeout)
+    wall_time = time.perf_counter() - start
+
+    print_summary(results, wall_time)
+    if args.results:
+        with open(args.results, 'w', encoding='utf-8') as f:
+            json.dump({ 'wall_time': wall_time, 'results': results }, f, indent=2)
+    return 0 if all(r['ok'] for r in results) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+# Lightweight random-access reader for NDY/JKL level files.
+# On first open the file is scanned once and index of section and list offsets is built,
+# together with offset of every N-th list row. The index is stored next to the level file
+# as '<file>.idx' sidecar and is rebuilt automatically when file's size or mtime changes.
+# Row and sector lookups then seek to the nearest indexed row of memory-mapped file and
+# read at most N rows, instead of re-scanning the whole file.
+#
+# Script doesn't require Blender and can be used from regular Python:
+#   python ndy_reader.py level.ndy info
+#   python ndy_reader.py level.ndy row surfaces 51234
+#   python ndy_reader.py level.ndy sector 300
+# or imported, e.g. in Blender Python console:
+#   with NdyReader('level.ndy') as ndy:
+#       ndy.row('surfaces', 51234)
+#       ndy.sector(300)['VERTICES']
+
+import argparse
+import json
+import mmap
+import os
+import re
+import sys
+
+from typing import Dict, List, Optional, Tuple
+
+kIndexVersion  = 2
+kDefaultStride = 256 # offset of every N-th row is stored in index
+
+_kReSection   = re.compile(rb'^[ \t]*SECTION:[ \t]*(\w+)', re.M | re.I)
+_kReListCount = re.compile(rb'^[ \t]*World[ \t]+(materials|colormaps|vertices|texture vertices|adjoins|surfaces|sectors)[ \t]+(\d+)', re.M | re.I)
+_kReRow       = re.compile(rb'^[ \t]*(\d+):', re.M)
+_kReSurfRow   = re.compile(rb'[ \t]*\d+:(?:[ \t]+[^ \t\r\n]+){4}') # surface row has more values than normal row (x, y, z)
+_kReSector    = re.compile(rb'^[ \t]*SECTOR[ \t]+(\d+)', re.M | re.I)
+
+# Known sector keys, longest first so that multi-word keys match whole. Other keys are single word,
+# so values which start with a letter (e.g. SOUND file name) aren't taken as part of the key.
+_kSectorKeys  = sorted(('SECTOR', 'SECTION', 'FLAGS', 'AMBIENT LIGHT', 'EXTRA LIGHT', 'COLORMAP', 'TINT', 'BOUNDBOX', 'COLLIDEBOX',
+                        'SOUND', 'THRUST', 'CENTER', 'RADIUS', 'VERTICES', 'SURFACES',
+                        'AVERAGE LIGHT INTENSITY', 'AVERAGE LIGHT POSITION', 'AVERAGE LIGHT FALLOFF'), key=len, reverse=True)
+_kReKeyValue  = re.compile(r'(' + '|'.join(k.replace(' ', r'[ \t]+') for k in _kSectorKeys) + r'|[A-Za-z]\w*)\b:?[ \t]*(.*)', re.I)
+
+def _index_file_path(path: str) -> str:
+    return path + '.idx'
+
+def build_index(mm: mmap.mmap, stride: int = kDefaultStride) -> dict:
+    # Scans NDY/JKL file and returns index of section and list offsets.
+    # List entry: offset of count line, count, number of rows and offsets of every stride-th row.
+    # Surface normals are indexed as separate 'normals' list which follows surfaces list, surfaces list ends at the first
+    # row which isn't surface row ('World surfaces' count is only stored as list count, it's not used to find list end).
+    size     = len(mm)
+    sections = { m.group(1).decode().upper(): m.start() for m in _kReSection.finditer(mm) }
+    section_offsets = sorted(sections.values())
+    counts   = list(_kReListCount.finditer(mm))
+
+    def _list_end(pos: int, next_count: int) -> int:
+        next_section = next((s for s in section_offsets if s > pos), size)
+        return min(next_count, next_section)
+
+    def _index_rows(start: int, end: int, row_re: Optional[re.Pattern] = None) -> Tuple[int, List[int], int]:
+        # Returns number of rows, offsets of every stride-th row and offset where rows end.
+        # If row_re is set, rows end at the first row which doesn't match it.
+        num_rows = 0
+        offsets  = []
+        rows_end = end
+        for r in _kReRow.finditer(mm, start, end):
+            if row_re is not None and not row_re.match(mm, r.start()):
+                rows_end = r.start()
+                break
+            if num_rows % stride == 0:
+                offsets.append(r.start())
+            num_rows += 1
+        return num_rows, offsets, rows_end
+
+    lists = {}
+    for i, m in enumerate(counts):
+        name  = m.group(1).decode().lower()
+        count = int(m.group(2))
+        end   = _list_end(m.end(), counts[i + 1].start() if i + 1 < len(counts) else size)
+
+        if name == 'sectors':
+            offsets  = []
+            num_rows = 0
+            for s in _kReSector.finditer(mm, m.end(), end):
+                if num_rows % stride == 0:
+                    offsets.append(s.start())
+                num_rows += 1
+            lists[name] = { 'offset': m.start(), 'count': count, 'num_rows': num_rows, 'rows': offsets }
+        elif name == 'surfaces':
+            num_rows, offsets, rows_end = _index_rows(m.end(), end, _kReSurfRow)
+            lists[name] = { 'offset': m.start(), 'count': count, 'num_rows': num_rows, 'rows': offsets }
+            num_rows, offsets, _ = _index_rows(rows_end, end)
+            lists['normals'] = { 'offset': rows_end, 'count': count, 'num_rows': num_rows, 'rows': offsets }
+        else:
+            num_rows, offsets, _ = _index_rows(m.end(), end)
+            lists[name] = { 'offset': m.start(), 'count': count, 'num_rows': num_rows, 'rows': offsets }
+
+    return {
+        'version'  : kIndexVersion,
+        'stride'   : stride,
+        'sections' : sections,
+        'lists'    : lists
+    }
+
+class NdyReader:
+    def __init__(self, path: str, stride: int = kDefaultStride, use_sidecar: bool = True):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mm   = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.index = self._load_index(stride, use_sidecar)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def _load_index(self, stride: int, use_sidecar: bool) -> dict:
+        st = os.stat(self._file.fileno())
+        idx_path = _index_file_path(self.path)
+        if use_sidecar:
+            try:
+                with open(idx_path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                if index.get('version') == kIndexVersion and index.get('stride') == stride \
+                    and index.get('size') == st.st_size and index.get('mtime_ns') == st.st_mtime_ns:
+                    return index
+            except (OSError, ValueError):
+                pass
+
+        index = build_index(self._mm, stride)
+        index['size']     = st.st_size
+        index['mtime_ns'] = st.st_mtime_ns
+        if use_sidecar:
+            try:
+                with open(idx_path, 'w', encoding='utf-8') as f:
+                    json.dump(index, f)
+            except OSError as e:
+                print(f"Warning: Couldn't write index file '{idx_path}': {e}")
+        return index
+
+    def _line_at(self, pos: int) -> Tuple[str, int]:
+        # Returns line at offset pos and offset of the next line
+        end = self._mm.find(b'\n', pos)
+        if end < 0:
+            end = len(self._mm)
+        return self._mm[pos:end].decode('utf-8', errors='replace').rstrip('\r'), end + 1
+
+    def _list(self, name: str) -> dict:
+        try:
+            return self.index['lists'][name.lower()]
+        except KeyError:
+            raise KeyError(f"List '{name}' not found in '{self.path}'") from None
+
+    def section_offset(self, name: str) -> int:
+        return self.index['sections'][name.upper()]
+
+    def count(self, name: str) -> int:
+        # Returns value of 'World <name>' count line
+        return self._list(name)['count']
+
+    def row(self, name: str, idx: int) -> str:
+        # Returns text of idx-th row in list (e.g. 'vertices', 'texture vertices', 'surfaces', 'normals')
+        lst = self._list(name)
+        if idx < 0 or idx >= lst['num_rows']:
+            raise IndexError(f"Row {idx} out of range of list '{name}' with {lst['num_rows']} rows")
+
+        stride = self.index['stride']
+        pos = lst['rows'][idx // stride]
+        n   = idx % stride
+        while True:
+            if _kReRow.match(self._mm, pos):
+                if n == 0:
+                    return self._line_at(pos)[0]
+                n -= 1
+            pos = self._line_at(pos)[1]
+
+    def row_fields(self, name: str, idx: int) -> List[str]:
+        # Returns whitespace separated values of row without 'idx:' prefix
+        return self.row(name, idx).split(':', 1)[1].split()
+
+    def sector(self, idx: int) -> Dict[str, object]:
+        # Returns sector's key-values, 'VERTICES' is list of vertex indices and 'SURFACES' tuple (start, count)
+        lst = self._list('sectors')
+        if idx < 0 or idx >= lst['num_rows']:
+            raise IndexError(f"Sector {idx} out of range, number of sectors: {lst['num_rows']}")
+
+        stride = self.index['stride']
+        pos = lst['rows'][idx // stride]
+        end = len(self._mm)
+        # skip to sector
+        for _ in range(idx % stride + 1):
+            m = _kReSector.search(self._mm, pos, end)
+            pos = m.end()
+
+        sector = { 'SECTOR': idx }
+        num_verts = 0
+        while pos < end:
+            line, pos = self._line_at(pos)
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if num_verts > 0:
+                sector['VERTICES'].append(int(line.split(':', 1)[1]))
+                num_verts -= 1
+                continue
+
+            # multi-word keys e.g. AMBIENT LIGHT, AVERAGE LIGHT INTENSITY (see _kSectorKeys)
+            kv = _kReKeyValue.match(line)
+            if kv is None:
+                raise ValueError(f"Unexpected line in sector {idx} of '{self.path}': '{line}'")
+            key, value = kv.groups()
+            key = ' '.join(key.upper().split())
+            if key in ('SECTOR', 'SECTION'):
+                break
+
+            if key == 'VERTICES':
+                num_verts = int(value)
+                sector[key] = []
+            elif key == 'SURFACES':
+                start, count = value.split()
+                sector[key] = (int(start), int(count))
+                break
+            else:
+                sector[key] = value
+        return sector
+
+    def sector_vertices(self, idx: int) -> List[int]:
+        return self.sector(idx).get('VERTICES', [])
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Random-access NDY/JKL reader')
+    parser.add_argument('file', help='NDY/JKL file')
+    parser.add_argument('--stride', type=int, default=kDefaultStride, help='index offset of every N-th row')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    sub.add_parser('info', help='print sections and list counts')
+    p = sub.add_parser('row', help='print list row')
+    p.add_argument('list', help="list name: materials, vertices, 'texture vertices', adjoins, surfaces, normals")
+    p.add_argument('idx', type=int)
+    p = sub.add_parser('sector', help='print sector')
+    p.add_argument('idx', type=int)
+    args = parser.parse_args(argv)
+
+    with NdyReader(args.file, args.stride) as ndy:
+        if args.cmd == 'info':
+            for name, offset in ndy.index['sections'].items():
+                print(f'SECTION: {name:<15} @{offset}')
+            for name, lst in ndy.index['lists'].items():
+                print(f"World {name:<16} {lst['count']:>8} ({lst['num_rows']} rows) @{lst['offset']}")
+        elif args.cmd == 'row':
+            print(ndy.row(args.list, args.idx))
+        elif args.cmd == 'sector':
+            for key, value in ndy.sector(args.idx).items():
+                print(key, value)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
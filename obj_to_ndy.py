@@ -2,15 +2,44 @@
 # The idea of this script is to export blender object hierarchy geometry to NDY/JKL file format and
 # then paste exported sections to the end of existing NDY/JKL file to be modified.
 # To get correct indices of exported object's georesurces set script's variables:
-#   mat_start_idx, vert_start_idx, uv_start_idx and surface_start_idx accordingly.
-# Exported NDY/JKL sections: copyright, header, materials and georesources without adjoin section.
+#   mat_start_idx, vert_start_idx, uv_start_idx, adjoin_start_idx and surface_start_idx accordingly.
+# Alternatively set `splice_file` to existing NDY/JKL file and the exported geometry is merged
+# into a copy of it written to `out_file`, with start indices computed from the file. Materials already
+# listed in the file (compared case-insensitively) are reused and only missing materials are appended.
+# Exported NDY/JKL sections: copyright, header, materials, georesources and sectors.
+# Coincident surfaces of different sectors (meshes in hierarchy) can be connected with adjoins automatically (see auto_adjoins).
+# Sectors which exceed size limits are split into grid of smaller sectors (see split_max_vertices, split_max_faces and split_max_extent).
+# Light of scene's point and sun lights can be baked into vertex colors and sector average light (see bake_lights).
+# Hierarchy is converted to compact export model (flat numpy arrays of each sector mesh) which is consumed by all section writers.
 
 # Script requires Sith Blender addon to be installed
 # Copy the script in Blender script editor, select object and run the script.
+# If more objects are selected, their hierarchies are exported together in order of object names.
+# Script can also be run headless, e.g.:
+#   blender --background level.blend --python obj_to_ndy.py -- --object <name> --out-file out.ndy
+# or for multiple .blend files and objects via ndy_batch_export.py.
 
+import argparse
 import bpy
-from math import degrees, pow, sqrt
-from mathutils import Vector, Matrix
+import cProfile
+import hashlib
+import io
+import json
+import mmap
+import multiprocessing
+import numpy as np
+import os
+import pickle
+import re
+import sys
+import time
+import tracemalloc
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from math import cos, pi, radians
+from mathutils import Matrix
+from mathutils.bvhtree import BVHTree
 
 from sith.text.serutils import *
 from sith.model import *
@@ -20,7 +49,8 @@ from sith.model.model3doExporter import _model3do_add_obj as model3do_add_obj
 from sith.types import Vector3f, Vector4f
 
 from enum import Enum
-from typing import List, Tuple
+from itertools import chain, compress, islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 
 class NdyVersion(Enum):
     IJIM  = 0,
@@ -34,21 +64,775 @@ out_version          = NdyVersion.IJIM
 mat_start_idx        = 0
 vert_start_idx       = 0
 uv_start_idx         = 0
+adjoin_start_idx     = 0
 surface_start_idx    = 0
 sector_idx           = 0
 ambient_light        = Vector3f(1.0, 1.0, 1.0)
 sector_extra_light   = Vector3f(0.0, 0.0, 0.0)
 default_surfflags    = 0x04 # collision
 
+# Surface classification by angle between surface normal and up axis, angles are in whole degrees
+floor_angle          = 45   # surfaces banked up to this angle are floor (surfflags 0x1 | 0x4)
+ceiling_angle        = 45   # surfaces facing down up to this angle from down axis are ceiling
+ceiling_surfflags    = 0x00 # surfflags added to ceiling surfaces, 0 = ceilings are not classified
+surfflags_object_overrides   = {} # object name -> surfflags of all surfaces of object
+surfflags_material_overrides = {} # material name -> surfflags of surfaces with material, takes precedence over object overrides
+
 # JKDF2 & MOTS specific
 colormaps            = ["dflt.cmp"]
 default_colormap_idx = 0
 
 separate_sector_surfaces = True
+
+# Build export model directly from Blender mesh data (foreach_get) instead of converting hierarchy via Sith Model3do.
+# Blender mesh has no face modes and extralight, faces are exported with mesh_data_face_modes and zero extralight.
+export_mesh_data         = False
+mesh_data_face_modes     = (0x0, 4, 3, 3) # faceflags, geo (4 - texture), light (3 - gouraud), tex (3 - perspective)
+
+# Connect coincident surfaces of different sectors with adjoins, adjoined surfaces are cleared of material and geo mode
+auto_adjoins             = False # caps of split sectors are always adjoined
+adjoin_flags             = 0x07 # 0x1 - visible, 0x2 - passable, 0x4 - passable for AI
+adjoin_tolerance         = 0.0001 # max distance of coincident vertices in world space
+
+# Split sectors (meshes in hierarchy) which exceed any of the limits below into a grid of smaller sectors, 0 = no limit.
+# Faces crossing grid planes are clipped and closed openings at the cuts are filled with surfaces
+# without material, which are then connected by adjoins.
+split_max_vertices       = 0
+split_max_faces          = 0
+split_max_extent         = 0.0 # max size of sector along world axis
+
+# Bake light of scene's point and sun lights into vertex colors (vertex colors are multiplied by received light)
+# and write average light of each sector (IJIM). Irradiance of point light is energy / (4 * pi * distance^2) and
+# of sun light its strength, both are multiplied by light color, bake_light_scale and cosine of angle to vertex normal.
+bake_lights              = False
+bake_light_scale         = 1.0
+bake_ambient             = Vector3f(0.0, 0.0, 0.0) # light added to baked light of every vertex
+# Shadows are opt-in and not vectorized: a BVH ray is cast one by one in Python for each unique vertex position and light
+# which lights the position by at least bake_shadow_min_light, so cost grows with number of vertices times lights
+# (number of cast rays is printed). Rays are capped at bake_shadow_distance, lights farther away don't cast shadow.
+bake_shadows             = False # lights occluded by exported surfaces don't light vertex (BVH ray cast)
+bake_shadow_min_light    = 1.0 / 255 # vertex-light pairs receiving less light (max of RGB) aren't tested for shadow
+bake_shadow_distance     = 100.0     # max length of shadow ray, 0 = unlimited
+
+# Merge world space vertices and texture vertices which fall into the same cell of tolerance sized grid,
+# e.g. vertices shared by sectors are written only once
+weld_vertices            = False
+weld_tolerance           = 0.0001
+weld_uv_tolerance        = 0.00001
+
+# Path to existing NDY/JKL file to splice exported geometry into.
+# When set, start indices above are computed from the file and merged file is written to out_file.
+splice_file              = ''
+
+# Directory of persistent export cache. When set, formatted rows of hierarchy nodes which
+# didn't change since previous export are reused instead of being formatted again.
+export_cache_dir         = ''
+export_cache_max_size    = 512 * 1024 * 1024 # max size of export cache in bytes
+out_buffer_size          = 4 * 1024 * 1024 # size of output write blocks in characters
+
+# Text blocks of sectors can be formatted concurrently by forked worker processes (not available on Windows).
+# Output is the same as with serial formatting. Workers are forked only when Blender runs in background
+# (e.g. via ndy_batch_export.py), since forked copy of Blender with UI can deadlock on a lock held by another thread.
+num_workers              = 1     # number of worker processes, 0 = number of CPUs, 1 = format serially
+parallel_min_faces       = 50000 # exports with fewer faces are formatted serially
+parallel_in_ui           = False # also fork workers when Blender runs with UI, at your own risk
+
+# Export profiling, prints time, CPU time, number of items and bytes written of each export stage
+# and writes JSON report to profile_report (default: '<out_file>.profile.json')
+profile                  = False
+profile_report           = ''
+profile_memory           = False # trace peak of allocated memory of each stage (slower)
+profile_cprofile         = False # dump cProfile stats of the slowest stage to '<profile_report>.<stage>.prof'
 ##############################################
 
-def _vec_convert_to_space(mat: Matrix, vec):
-    return mat * Vector(vec)
+_kRowsPerChunk = 4096 # max number of rows in text chunk yielded by section generators
+
+def _to_str(write_fn, *args) -> str:
+    # Returns text written by serutils style write function
+    buf = io.StringIO()
+    write_fn(buf, *args)
+    return buf.getvalue()
+
+_kNewLine         = _to_str(writeNewLine)
+_kSectorVertexRow = _to_str(writeKeyValue, '', '{}: {}')[:-len(_kNewLine)]
+
+# Probe rows used to verify that bulk formatted rows are identical to vec2str
+_kFormatProbes = [
+    (0.0, -0.0, 1.0), (-1.0, 0.5, 0.25), (1e-9, -1e-9, 4.9999999e-9), (-5.00000001e-9, 0.123456785, -0.123456785),
+    (123.456789012, -98765.4321, 1e7), (-1e12, 2.5e-8, 3.14159265358979), (0.1, 0.2, 0.30000000000000004)
+]
+_row_formats: Dict[Tuple[bool, int, int], Optional[str]] = {}
+
+def _vec_row_format(compact: bool, align: int, size: int) -> Optional[str]:
+    # Returns %-format of vector with size components which produces the same text as vec2str(vector, compact, align).
+    # The format is inferred from vec2str output and verified with probe values,
+    # None is returned if vec2str output can't be reproduced.
+    key = (compact, align, size)
+    if key in _row_formats:
+        return _row_formats[key]
+
+    fmt = None
+    long_str = vec2str((-123456789.5,), compact, align)
+    m = re.search(r'-123456789\.5(0*)$', long_str)
+    if m:
+        sep       = long_str[:m.start()]
+        precision = 1 + len(m.group(1))
+        width     = len(vec2str((0.0,), compact, align)) - len(sep)
+        fmt = (sep.replace('%', '%%') + '%{}.{}f'.format(width, precision)) * size
+        probes = [(p * size)[:size] for p in _kFormatProbes]
+        if any(vec2str(p, compact, align) != fmt % p for p in probes):
+            fmt = None
+    _row_formats[key] = fmt
+    return fmt
+
+def _format_vec_rows(values: np.ndarray, compact: bool, align: int) -> List[str]:
+    # Returns vec2str(row, compact, align) of each row of 2D array.
+    # Whole array is formatted with a single %-format call when possible.
+    if len(values) == 0:
+        return []
+    fmt = _vec_row_format(compact, align, values.shape[1])
+    if fmt is None:
+        return [vec2str(r, compact, align) for r in values.tolist()]
+    return ((fmt + '\n') * len(values) % tuple(values.ravel().tolist())).split('\n')[:-1]
+
+def _format_float_rows(values: np.ndarray, fmt: str) -> List[str]:
+    # Returns fmt % v of each value of 1D array
+    if len(values) == 0:
+        return []
+    return ((fmt + '\n') * len(values) % tuple(values.tolist())).split('\n')[:-1]
+
+class _ExportProfiler:
+    # Opt-in instrumentation of export stages.
+    # Records wall and CPU time, number of items and bytes of text produced by each stage, and optionally
+    # peak of allocated memory (tracemalloc) and cProfile stats. Disabled profiler passes everything through.
+    def __init__(self, enabled: bool = False, memory: bool = False, cprofile: bool = False):
+        self.enabled   = enabled
+        self.memory    = enabled and memory
+        self.cprofile  = enabled and cprofile
+        self.stages: Dict[str, dict] = {}
+        self._profiles: Dict[str, cProfile.Profile] = {}
+        self._start    = time.perf_counter()
+        self._tracing  = False
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing = True
+
+    def _stats(self, name: str) -> dict:
+        return self.stages.setdefault(name, { 'wall': 0.0, 'cpu': 0.0, 'items': 0, 'bytes': 0 })
+
+    @contextmanager
+    def stage(self, name: str, items: int = 0):
+        if not self.enabled:
+            yield
+            return
+        stats = self._stats(name)
+        stats['items'] += items
+        if self.memory:
+            mem_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        prof = None
+        if self.cprofile:
+            prof = self._profiles.setdefault(name, cProfile.Profile())
+            prof.enable()
+        wall = time.perf_counter()
+        cpu  = time.process_time()
+        try:
+            yield
+        finally:
+            stats['wall'] += time.perf_counter() - wall
+            stats['cpu']  += time.process_time() - cpu
+            if prof:
+                prof.disable()
+            if self.memory:
+                stats['alloc_peak'] = max(stats.get('alloc_peak', 0), tracemalloc.get_traced_memory()[1] - mem_start)
+
+    def iter_stage(self, name: str, chunks: Iterable[str], items: int = 0) -> Iterable[str]:
+        # Wraps text chunks of export section. Time spent producing chunks and their size is recorded to stage.
+        if not self.enabled:
+            return chunks
+        return self._iter_stage(name, iter(chunks), items)
+
+    def _iter_stage(self, name: str, chunks: Iterator[str], items: int) -> Iterator[str]:
+        stats = self._stats(name)
+        stats['items'] += items
+        while True:
+            with self.stage(name):
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            stats['bytes'] += len(chunk)
+            yield chunk
+
+    def finish(self, report_path: str, info: dict):
+        # Prints summary and writes JSON report and cProfile stats of the slowest stage
+        if not self.enabled:
+            return
+        if self._tracing:
+            tracemalloc.stop()
+        total = time.perf_counter() - self._start
+        print("Info: export profile, total {:.3f}s".format(total))
+        print("  {:<16}{:>9}{:>9}{:>7}{:>10}{:>9}".format('stage', 'wall s', 'cpu s', '%', 'items', 'MB'))
+        for name, s in self.stages.items():
+            print("  {:<16}{:>9.3f}{:>9.3f}{:>6.1f}%{:>10}{:>9.2f}".format(name, s['wall'], s['cpu'], 100 * s['wall'] / total if total else 0.0, s['items'], s['bytes'] / (1024 * 1024)))
+
+        report = { **info, 'total_wall': total, 'stages': self.stages }
+        if self.cprofile and self.stages:
+            slowest = max(self.stages, key=lambda n: self.stages[n]['wall'])
+            if slowest in self._profiles:
+                prof_path = '{}.{}.prof'.format(report_path, slowest)
+                self._profiles[slowest].dump_stats(prof_path)
+                report['cprofile'] = { 'stage': slowest, 'file': prof_path }
+                print("Info: cProfile stats of the slowest stage '{}' written to '{}'".format(slowest, prof_path))
+        try:
+            with open(report_path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2)
+            print("Info: profile report written to '{}'".format(report_path))
+        except OSError as e:
+            print("Warning: Couldn't write profile report '{}': {}".format(report_path, e))
+
+_kNoProfiler = _ExportProfiler()
+
+class _ColumnarMesh(NamedTuple):
+    # Sector mesh as flat typed arrays.
+    # Face i has corners face_offsets[i]:face_offsets[i + 1] in face_verts and face_uvs.
+    name: str                  # name of object
+    world_matrix: np.ndarray   # (4, 4) float64
+    vertices: np.ndarray       # (V, 3) float64, local space
+    vertex_colors: np.ndarray  # (V, 4) float64, RGBA
+    uvs: np.ndarray            # (U, 2) float64
+    face_offsets: np.ndarray   # (F + 1,) int64
+    face_verts: np.ndarray     # (C,) int64
+    face_uvs: np.ndarray       # (C,) int64
+    face_materials: np.ndarray # (F,) int64, index to _ExportModel.materials
+    face_modes: np.ndarray     # (F, 4) int64, faceflags, geometry, light and texture mode
+    face_colors: np.ndarray    # (F, N) float64, extralight
+    normals: np.ndarray        # (F, 3) float64, local space
+
+    @property
+    def num_faces(self) -> int:
+        return len(self.face_offsets) - 1
+
+class _ExportModel(NamedTuple):
+    name: str
+    materials: List[str]
+    meshes: List[_ColumnarMesh] # sectors in hierarchy order
+
+def _columnar_mesh_from_model3do(mesh: Mesh3do, name: str, world_matrix: Matrix) -> _ColumnarMesh:
+    faces = mesh.faces
+    sizes = np.fromiter((len(f.vertexIdxs) for f in faces), dtype=np.int64, count=len(faces))
+    face_uvs = np.fromiter(chain.from_iterable(f.uvIdxs for f in faces), dtype=np.int64)
+    if len(face_uvs) != sizes.sum():
+        raise ValueError("Mesh '{}' has faces with different number of vertices and texture vertices".format(name))
+    return _ColumnarMesh(
+        name,
+        np.array(world_matrix, dtype=np.float64),
+        np.array(mesh.vertices, dtype=np.float64).reshape(-1, 3),
+        np.array(mesh.vertexColors, dtype=np.float64).reshape(-1, 4),
+        np.array(mesh.uvs, dtype=np.float64).reshape(-1, 2),
+        np.concatenate(([0], np.cumsum(sizes))),
+        np.fromiter(chain.from_iterable(f.vertexIdxs for f in faces), dtype=np.int64, count=len(face_uvs)),
+        face_uvs,
+        np.fromiter((f.materialIdx for f in faces), dtype=np.int64, count=len(faces)),
+        np.array([(f.type, f.geometryMode, f.lightMode, f.textureMode) for f in faces], dtype=np.int64).reshape(-1, 4),
+        np.array([tuple(f.color) for f in faces], dtype=np.float64).reshape(len(faces), -1) if faces else np.zeros((0, 4)),
+        np.array([tuple(f.normal) for f in faces], dtype=np.float64).reshape(-1, 3))
+
+def _make_model3do_from_obj(obj: bpy.types.Object, version: NdyVersion):
+    model = Model3do(obj.name)
+    model.geosets.append(Model3doGeoSet())
+    uvAbsolute = False if version == NdyVersion.IJIM else True
+    model3do_add_obj(model, obj, parent=obj, uvAbsolute=uvAbsolute, exportVertexColors=True)
+    return model
+
+def _make_export_model_from_model3do(obj: bpy.types.Object, version: NdyVersion) -> _ExportModel:
+    # Converts hierarchy via Sith addon, then per-face objects of Model3do are dropped
+    model = _make_model3do_from_obj(obj, version)
+    assert len(model.geosets) == 1, "Converted OBJ to 3DO model must have exact 1 geoset"
+    meshes = [_columnar_mesh_from_model3do(model.geosets[0].meshes[n.meshIdx], n.obj.name, n.obj.matrix_world)
+              for n in model.meshHierarchy if n.meshIdx > -1]
+    return _ExportModel(model.name, model.materials, meshes)
+
+def _foreach_get(collection, attr: str, dtype, size: int, width: int = 1) -> np.ndarray:
+    arr = np.empty(size * width, dtype=dtype)
+    collection.foreach_get(attr, arr)
+    return arr.reshape(-1, width) if width > 1 else arr
+
+def _unique_rows(rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Returns unique rows in order of their first occurrence and index of unique row of each row
+    _, first, inverse = np.unique(rows, axis=0, return_index=True, return_inverse=True)
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    return rows[np.sort(first)], rank[inverse.reshape(-1)]
+
+def _material_image_size(mat: Optional[bpy.types.Material]) -> Tuple[float, float]:
+    # Returns size of the first image texture of material or (1, 1) if material has no image
+    if mat is not None and getattr(mat, 'use_nodes', False) and mat.node_tree:
+        for n in mat.node_tree.nodes:
+            if n.type == 'TEX_IMAGE' and n.image and n.image.size[0] > 0:
+                return float(n.image.size[0]), float(n.image.size[1])
+    return 1.0, 1.0
+
+def _columnar_mesh_from_data(obj: bpy.types.Object, materials: Dict[str, int], uv_absolute: bool) -> _ColumnarMesh:
+    # Reads mesh data of object into flat arrays with foreach_get
+    mesh = obj.data
+    num_verts, num_faces, num_loops = len(mesh.vertices), len(mesh.polygons), len(mesh.loops)
+    if num_faces and not obj.material_slots:
+        raise ValueError("Object '{}' has no material".format(obj.name))
+
+    loop_start   = _foreach_get(mesh.polygons, 'loop_start', np.int32, num_faces).astype(np.int64)
+    loop_total   = _foreach_get(mesh.polygons, 'loop_total', np.int32, num_faces).astype(np.int64)
+    face_offsets = np.concatenate(([0], np.cumsum(loop_total)))
+    # loops of face corners in face order, polygons don't have to be ordered by loop_start
+    corners      = np.repeat(loop_start - face_offsets[:-1], loop_total) + np.arange(face_offsets[-1])
+    loop_verts   = _foreach_get(mesh.loops, 'vertex_index', np.int32, num_loops).astype(np.int64)
+
+    # Materials used by faces are added to model materials in slot order
+    slot_idxs = np.clip(_foreach_get(mesh.polygons, 'material_index', np.int32, num_faces), 0, max(len(obj.material_slots) - 1, 0))
+    slot_mats = np.zeros(max(len(obj.material_slots), 1), dtype=np.int64)
+    for i in np.unique(slot_idxs).tolist():
+        slot_mats[i] = materials.setdefault(obj.material_slots[i].name, len(materials))
+
+    # Texture vertices are shared by face corners with the same uv
+    uv_layer = mesh.uv_layers.active
+    if uv_layer is not None:
+        loop_uvs = _foreach_get(uv_layer.data, 'uv', np.float32, num_loops, 2).astype(np.float64)[corners]
+    else:
+        loop_uvs = np.zeros((len(corners), 2))
+    loop_uvs[:, 1] = 1.0 - loop_uvs[:, 1] # origin of NDY texture coordinates is top left corner
+    if uv_absolute and num_faces:
+        sizes = np.array([_material_image_size(s.material) for s in obj.material_slots], dtype=np.float64)
+        loop_uvs *= np.repeat(sizes[slot_idxs], loop_total, axis=0)
+    uvs, face_uvs = _unique_rows(loop_uvs) if len(loop_uvs) else (loop_uvs, np.zeros(0, dtype=np.int64))
+
+    # Vertex colors of color attribute (Blender 3.2+) or vertex color layer, face corner colors are
+    # reduced to vertex colors by the first corner of each vertex
+    colors = np.ones((num_verts, 4))
+    color_attrs = getattr(mesh, 'color_attributes', None)
+    layer = color_attrs.active_color if color_attrs is not None else mesh.vertex_colors.active
+    if layer is not None:
+        if getattr(layer, 'domain', 'CORNER') == 'POINT':
+            colors = _foreach_get(layer.data, 'color', np.float32, num_verts, 4).astype(np.float64)
+        else:
+            loop_colors = _foreach_get(layer.data, 'color', np.float32, num_loops, 4).astype(np.float64)
+            verts, first = np.unique(loop_verts, return_index=True)
+            colors[verts] = loop_colors[first]
+
+    return _ColumnarMesh(
+        obj.name,
+        np.array(obj.matrix_world, dtype=np.float64),
+        _foreach_get(mesh.vertices, 'co', np.float32, num_verts, 3).astype(np.float64),
+        colors,
+        uvs,
+        face_offsets,
+        loop_verts[corners],
+        face_uvs,
+        slot_mats[slot_idxs],
+        np.tile(np.array(mesh_data_face_modes, dtype=np.int64), (num_faces, 1)),
+        np.zeros((num_faces, 4)),
+        _foreach_get(mesh.polygons, 'normal', np.float32, num_faces, 3).astype(np.float64))
+
+def _make_export_model_from_mesh_data(obj: bpy.types.Object, version: NdyVersion) -> _ExportModel:
+    # Builds export model from mesh objects of hierarchy in depth-first order
+    materials: Dict[str, int] = {}
+    meshes = []
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if o.type == 'MESH' and o.data is not None:
+            meshes.append(_columnar_mesh_from_data(o, materials, version != NdyVersion.IJIM))
+        stack.extend(reversed(o.children))
+    return _ExportModel(obj.name, list(materials), meshes)
+
+def _make_export_model(objs: List[bpy.types.Object], version: NdyVersion) -> _ExportModel:
+    # Joins hierarchies of objects into one model in order of objs,
+    # material indices of faces are remapped to the joined material list
+    make = _make_export_model_from_mesh_data if export_mesh_data else _make_export_model_from_model3do
+    models = [make(obj, version) for obj in objs]
+    if len(models) == 1:
+        model = models[0]
+    else:
+        materials: Dict[str, int] = {}
+        meshes = []
+        for m in models:
+            remap = np.array([materials.setdefault(name, len(materials)) for name in m.materials], dtype=np.int64)
+            meshes += [mesh._replace(face_materials=remap[mesh.face_materials]) for mesh in m.meshes]
+        model = _ExportModel(models[0].name, list(materials), meshes)
+
+    if split_max_vertices or split_max_faces or split_max_extent:
+        model = model._replace(meshes=[p for m in model.meshes for p in _split_sector_mesh(m)])
+    return model
+
+def _top_level_objects(objs: List[bpy.types.Object]) -> List[bpy.types.Object]:
+    # Returns objects which are not in hierarchy of another object of objs, sorted by name
+    names = { o.name for o in objs }
+    def _is_top_level(obj: bpy.types.Object) -> bool:
+        parent = obj.parent
+        while parent is not None:
+            if parent.name in names:
+                return False
+            parent = parent.parent
+        return True
+    return sorted((o for o in objs if _is_top_level(o)), key=lambda o: o.name)
+
+_kSplitEpsilon  = 1e-7 # vertices closer to cut plane are on the plane
+_kSplitMaxCells = 4096 # max number of grid cells sector is split into
+
+def _mesh_world_vertices(mesh: _ColumnarMesh) -> np.ndarray:
+    return mesh.vertices @ mesh.world_matrix[:3, :3].T + mesh.world_matrix[:3, 3]
+
+def _exceeds_sector_limits(mesh: _ColumnarMesh, world_verts: np.ndarray) -> bool:
+    if split_max_faces and mesh.num_faces > split_max_faces:
+        return True
+    if split_max_vertices and len(mesh.vertices) > split_max_vertices:
+        return True
+    return bool(split_max_extent and len(world_verts) and (world_verts.max(axis=0) - world_verts.min(axis=0)).max() > split_max_extent)
+
+def _split_grid(mesh: _ColumnarMesh, world_verts: np.ndarray) -> List[np.ndarray]:
+    # Returns positions of cut planes along each world axis of uniform grid whose cells are within sector limits.
+    # Faces and vertices of cell are estimated by cells of face centers, cells are added along the axis of the longest cell.
+    lo, hi  = world_verts.min(axis=0), world_verts.max(axis=0)
+    extent  = hi - lo
+    cells   = np.ones(3, dtype=np.int64)
+    if split_max_extent:
+        cells = np.maximum(np.ceil(extent / split_max_extent).astype(np.int64), 1)
+
+    sizes   = np.diff(mesh.face_offsets)
+    centers = np.add.reduceat(world_verts[mesh.face_verts], mesh.face_offsets[:-1]) / sizes[:, None]
+    scale   = np.where(extent > 0, extent, 1.0)
+    while extent.max() > 0 and cells.prod() < _kSplitMaxCells:
+        cell_idx   = np.clip(((centers - lo) / scale * cells).astype(np.int64), 0, cells - 1)
+        face_cells = np.ravel_multi_index(cell_idx.T, cells)
+        over = bool(split_max_faces) and np.bincount(face_cells).max() > split_max_faces
+        if not over and split_max_vertices:
+            # unique (cell, vertex) pairs of face corners
+            pairs = np.unique(np.repeat(face_cells, sizes) * len(world_verts) + mesh.face_verts)
+            over  = np.bincount(pairs // len(world_verts)).max() > split_max_vertices
+        if not over:
+            break
+        cells[np.argmax(extent / cells)] += 1
+    return [lo[a] + extent[a] * np.arange(1, cells[a]) / cells[a] for a in range(3)]
+
+def _cut_contours(offsets: np.ndarray, face_verts: np.ndarray, on_plane: np.ndarray) -> Tuple[List[List[int]], int]:
+    # Returns closed contours of boundary edges of faces which lie on cut plane, contours run in direction of face edges.
+    # Edge is on boundary if faces don't have the same edge in opposite direction.
+    # Returns also number of boundary edges which don't form closed contour (e.g. mesh isn't watertight).
+    nxt = np.arange(1, len(face_verts) + 1)
+    nxt[offsets[1:] - 1] = offsets[:-1]
+    edge_a, edge_b = face_verts, face_verts[nxt]
+    on    = on_plane[edge_a] & on_plane[edge_b] & (edge_a != edge_b)
+    edges = list(dict.fromkeys(zip(edge_a[on].tolist(), edge_b[on].tolist())))
+    edge_set = set(edges)
+    boundary: Dict[int, List[int]] = {}
+    for a, b in edges:
+        if (b, a) not in edge_set:
+            boundary.setdefault(a, []).append(b)
+
+    contours = []
+    visited  = set()
+    for start in boundary:
+        contour, v = [], start
+        while v not in visited and len(boundary.get(v, ())) == 1:
+            visited.add(v)
+            contour.append(v)
+            v = boundary[v][0]
+        if v == start and len(contour) >= 3:
+            contours.append(contour)
+    return contours, sum(len(e) for e in boundary.values()) - sum(len(c) for c in contours)
+
+def _newell_normal(points: np.ndarray) -> np.ndarray:
+    n = np.cross(points, np.roll(points, -1, axis=0)).sum(axis=0)
+    length = np.linalg.norm(n)
+    return n / length if length > 0 else n
+
+def _mesh_part(mesh: _ColumnarMesh, verts: np.ndarray, colors: np.ndarray, uvs: np.ndarray,
+               sizes: List[np.ndarray], face_verts: List[np.ndarray], face_uvs: List[np.ndarray], src_faces: np.ndarray,
+               caps: List[List[int]], cap_uv: int) -> _ColumnarMesh:
+    # Returns mesh of faces src_faces (clipped face corners are in face_verts and face_uvs) and cap faces.
+    # Only used vertices and texture vertices are kept.
+    cap_normals = np.array([_newell_normal(verts[c]) for c in caps]).reshape(-1, 3)
+    sizes       = np.concatenate(sizes + [np.array([len(c) for c in caps], dtype=np.int64)])
+    used_verts, face_verts = np.unique(np.concatenate(face_verts + [np.array(c, dtype=np.int64) for c in caps]), return_inverse=True)
+    used_uvs, face_uvs     = np.unique(np.concatenate(face_uvs + [np.full(sum(len(c) for c in caps), cap_uv, dtype=np.int64)]), return_inverse=True)
+    return _ColumnarMesh(
+        mesh.name,
+        mesh.world_matrix,
+        verts[used_verts],
+        colors[used_verts],
+        uvs[used_uvs],
+        np.concatenate(([0], np.cumsum(sizes))),
+        face_verts.reshape(-1),
+        face_uvs.reshape(-1),
+        np.concatenate((mesh.face_materials[src_faces], np.full(len(caps), -1, dtype=np.int64))),
+        np.concatenate((mesh.face_modes[src_faces], np.zeros((len(caps), 4), dtype=np.int64))),
+        np.concatenate((mesh.face_colors[src_faces], np.zeros((len(caps), mesh.face_colors.shape[1])))),
+        np.concatenate((mesh.normals[src_faces], cap_normals)))
+
+def _cut_mesh(mesh: _ColumnarMesh, axis: int, plane: float) -> Tuple[Optional[_ColumnarMesh], Optional[_ColumnarMesh], int]:
+    # Cuts mesh with world axis plane at position plane into parts on negative and positive side of the plane (None = empty part).
+    # Crossing faces are clipped, cut vertices are interpolated in local space from the negative to positive vertex of edge,
+    # so faces shared by parts are cut into the same vertices. Closed contours of cut are capped with faces
+    # without material on both parts. Returns also number of cut edges which couldn't be capped.
+    dist = mesh.vertices @ mesh.world_matrix[axis, :3] + mesh.world_matrix[axis, 3] - plane
+    side = np.where(dist > _kSplitEpsilon, 1, np.where(dist < -_kSplitEpsilon, -1, 0))
+    corner_side = side[mesh.face_verts]
+    starts = mesh.face_offsets[:-1]
+    fmin   = np.minimum.reduceat(corner_side, starts)
+    fmax   = np.maximum.reduceat(corner_side, starts)
+    parts_faces = (np.flatnonzero((fmax <= 0) & (fmin < 0)), np.flatnonzero(fmin >= 0)) # faces on the plane are on positive side
+    crossing    = np.flatnonzero((fmin < 0) & (fmax > 0))
+    if len(crossing) == 0:
+        if len(parts_faces[0]) == 0:
+            return None, mesh, 0
+        if len(parts_faces[1]) == 0:
+            return mesh, None, 0
+
+    # Clip crossing faces
+    num_verts, num_uvs = len(mesh.vertices), len(mesh.uvs)
+    cut_verts: Dict[Tuple[int, int], int] = {}
+    cut_uvs: Dict[Tuple[int, int, int, int], int] = {}
+    new_verts, new_colors, new_uvs = [], [], []
+    def _cut_corner(a: int, ua: int, b: int, ub: int) -> Tuple[int, int]:
+        # a is on negative side and b on positive side
+        t = dist[a] / (dist[a] - dist[b])
+        v = cut_verts.get((a, b))
+        if v is None:
+            v = cut_verts[(a, b)] = num_verts + len(new_verts)
+            new_verts.append(mesh.vertices[a] + t * (mesh.vertices[b] - mesh.vertices[a]))
+            new_colors.append(mesh.vertex_colors[a] + t * (mesh.vertex_colors[b] - mesh.vertex_colors[a]))
+        u = cut_uvs.get((a, ua, b, ub))
+        if u is None:
+            u = cut_uvs[(a, ua, b, ub)] = num_uvs + len(new_uvs)
+            new_uvs.append(mesh.uvs[ua] + t * (mesh.uvs[ub] - mesh.uvs[ua]))
+        return v, u
+
+    sides, fv, fu, offsets = side.tolist(), mesh.face_verts.tolist(), mesh.face_uvs.tolist(), mesh.face_offsets.tolist()
+    clipped = ([], []) # (verts, uvs) of clipped faces on negative and positive side
+    for f in crossing.tolist():
+        neg_face, pos_face = ([], []), ([], [])
+        start, end = offsets[f], offsets[f + 1]
+        for k in range(start, end):
+            n = k + 1 if k + 1 < end else start
+            a, ua, b, ub = fv[k], fu[k], fv[n], fu[n]
+            if sides[a] <= 0:
+                neg_face[0].append(a)
+                neg_face[1].append(ua)
+            if sides[a] >= 0:
+                pos_face[0].append(a)
+                pos_face[1].append(ua)
+            if sides[a] * sides[b] < 0:
+                v, u = _cut_corner(a, ua, b, ub) if sides[a] < 0 else _cut_corner(b, ub, a, ua)
+                for face in (neg_face, pos_face):
+                    face[0].append(v)
+                    face[1].append(u)
+        clipped[0].append(neg_face)
+        clipped[1].append(pos_face)
+
+    verts    = np.concatenate((mesh.vertices, np.array(new_verts).reshape(-1, 3)))
+    colors   = np.concatenate((mesh.vertex_colors, np.array(new_colors).reshape(-1, 4)))
+    uvs      = np.concatenate((mesh.uvs, np.array(new_uvs).reshape(-1, 2), [[0.0, 0.0]])) # last uv is uv of caps
+    on_plane = np.concatenate((side == 0, np.ones(len(new_verts), dtype=bool)))
+
+    parts = []
+    for faces, polys in zip(parts_faces, clipped):
+        face_sizes = np.diff(mesh.face_offsets)[faces]
+        corners = np.repeat(mesh.face_offsets[faces] - np.concatenate(([0], np.cumsum(face_sizes)[:-1])), face_sizes) + np.arange(face_sizes.sum())
+        parts.append((
+            [face_sizes, np.array([len(p[0]) for p in polys], dtype=np.int64)],
+            [mesh.face_verts[corners], np.array([v for p in polys for v in p[0]], dtype=np.int64)],
+            [mesh.face_uvs[corners], np.array([u for p in polys for u in p[1]], dtype=np.int64)],
+            np.concatenate((faces, crossing))))
+
+    # Contours of positive part are capped with reversed faces on positive part and the same faces on negative part
+    sizes, face_verts = parts[1][0], parts[1][1]
+    contours, num_open = _cut_contours(np.concatenate(([0], np.cumsum(np.concatenate(sizes)))), np.concatenate(face_verts), on_plane)
+    caps = (contours, [c[::-1] for c in contours])
+    return (*(_mesh_part(mesh, verts, colors, uvs, *p, c, len(uvs) - 1) for p, c in zip(parts, caps)), num_open)
+
+def _split_sector_mesh(mesh: _ColumnarMesh) -> List[_ColumnarMesh]:
+    # Splits mesh which exceeds sector limits into parts by planes of grid (see _split_grid).
+    # Every part is cut by every plane of grid, so cut faces of neighbouring parts stay coincident and get adjoined.
+    # Parts are ordered by grid cells along x, y and z axis.
+    world_verts = _mesh_world_vertices(mesh)
+    if mesh.num_faces == 0 or not _exceeds_sector_limits(mesh, world_verts):
+        return [mesh]
+
+    parts    = [mesh]
+    num_open = 0
+    for axis, positions in enumerate(_split_grid(mesh, world_verts)):
+        cut = []
+        for part in parts:
+            for plane in positions.tolist():
+                neg, part, n = _cut_mesh(part, axis, plane)
+                num_open += n
+                if neg is not None:
+                    cut.append(neg)
+                if part is None:
+                    break
+            if part is not None:
+                cut.append(part)
+        parts = cut
+
+    print("Info: sector '{}' ({} faces, {} vertices) split into {} sectors, max {} faces and {} vertices per sector".format(
+        mesh.name, mesh.num_faces, len(mesh.vertices), len(parts), max(p.num_faces for p in parts), max(len(p.vertices) for p in parts)))
+    if num_open:
+        print("Warning: {} cut edges of sector '{}' don't form closed contour and couldn't be adjoined, mesh should be closed".format(num_open, mesh.name))
+    return parts
+
+def _get_world_vertices(model: _ExportModel) -> List[np.ndarray]:
+    # Returns global space vertices of every sector mesh, each converted with a single matrix multiply.
+    # Vertices are converted once and shared by vertices and sectors sections.
+    return [_mesh_world_vertices(m) for m in model.meshes]
+
+class _SectorLight(NamedTuple):
+    # Average light of sector
+    intensity: np.ndarray         # (3,) RGB
+    position: np.ndarray          # (3,) world space
+    falloff: Tuple[float, float]  # min and max distance of sector vertices from position
+
+_kBakeChunkSize      = 1 << 20 # max number of vertex-light pairs lit at once
+_kShadowBias         = 1e-3    # offset of shadow ray origin from vertex along normal
+_kShadowWeldDecimals = 6       # vertices equal when rounded to decimals share shadow rays
+
+class _BakeLights(NamedTuple):
+    is_sun: np.ndarray # (light)
+    pos: np.ndarray    # (light, axis)
+    sun_to: np.ndarray # (light, axis) unit direction towards sun
+    color: np.ndarray  # (light, RGB) scaled by energy and bake_light_scale
+    cutoff: np.ndarray # (light)
+
+def _scene_lights(scene) -> List[bpy.types.Object]:
+    return [o for o in scene.objects if o.type == 'LIGHT' and o.data.type in ('POINT', 'SUN') and not getattr(o, 'hide_render', False)]
+
+def _bake_light_arrays(lights: List[bpy.types.Object]) -> _BakeLights:
+    is_sun = np.array([l.data.type == 'SUN' for l in lights], dtype=bool)
+    mats   = np.array([np.array(l.matrix_world, dtype=np.float64) for l in lights]).reshape(-1, 4, 4)
+    sun_to = mats[:, :3, 2] / np.maximum(np.linalg.norm(mats[:, :3, 2], axis=1), 1e-12)[:, None] # sun shines along -Z
+    color  = np.array([tuple(l.data.color)[:3] for l in lights], dtype=np.float64).reshape(-1, 3)
+    color *= np.array([l.data.energy for l in lights], dtype=np.float64)[:, None] * bake_light_scale
+    color[~is_sun] /= 4 * pi
+    cutoff = np.array([l.data.cutoff_distance if getattr(l.data, 'use_custom_distance', False) else np.inf for l in lights], dtype=np.float64)
+    return _BakeLights(is_sun, mats[:, :3, 3], sun_to, color, cutoff)
+
+def _light_directions(lights: _BakeLights, verts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # Returns unit directions (vertex, light, axis) from vertices to lights and distances (vertex, light)
+    to_light = lights.pos[None, :, :] - verts[:, None, :]
+    to_light[:, lights.is_sun] = lights.sun_to[lights.is_sun]
+    dist = np.linalg.norm(to_light, axis=2)
+    return to_light / np.maximum(dist, 1e-12)[..., None], dist
+
+def _received_light(lights: _BakeLights, verts: np.ndarray, normals: np.ndarray) -> np.ndarray:
+    # Returns factor of light color received by vertices from each light (vertex, light), without shadows
+    dirs, dist = _light_directions(lights, verts)
+    lit  = np.maximum(np.einsum('vk,vlk->vl', normals, dirs), 0.0)
+    lit *= np.where(lights.is_sun, 1.0, 1.0 / np.maximum(dist * dist, 1e-12))
+    lit[dist > lights.cutoff] = 0.0
+    return lit
+
+def _vertex_normals(mesh: _ColumnarMesh) -> np.ndarray:
+    # Returns world space vertex normals as average of normals of faces with material (openings of split sectors are skipped)
+    normals = mesh.normals @ np.linalg.inv(mesh.world_matrix[:3, :3]) # inverse transpose of world matrix
+    normals[mesh.face_materials < 0] = 0.0
+    normals = np.repeat(normals / np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, None], np.diff(mesh.face_offsets), axis=0)
+    normals = np.stack([np.bincount(mesh.face_verts, normals[:, k], minlength=len(mesh.vertices)) for k in range(3)], axis=1)
+    return normals / np.maximum(np.linalg.norm(normals, axis=1), 1e-12)[:, None]
+
+def _shadow_tree(model: _ExportModel, world_verts: List[np.ndarray]) -> BVHTree:
+    # BVH of world space faces with material of all sectors
+    offsets = _prefix_sum([len(v) for v in world_verts])
+    polys   = []
+    for m, o in zip(model.meshes, offsets):
+        face_verts = (m.face_verts + o).tolist()
+        bounds = m.face_offsets.tolist()
+        polys += [face_verts[bounds[f]:bounds[f + 1]] for f in np.flatnonzero(m.face_materials > -1).tolist()]
+    return BVHTree.FromPolygons(np.concatenate(world_verts).tolist() if world_verts else [], polys)
+
+def _lit_pairs(lights: _BakeLights, lit: np.ndarray, position_ids: np.ndarray) -> np.ndarray:
+    # Returns keys (position * num lights + light) of vertex-light pairs which receive at least bake_shadow_min_light
+    vi, li = np.nonzero((lit[:, :, None] * lights.color[None]).max(axis=2, initial=0.0) >= max(bake_shadow_min_light, 1e-12))
+    return position_ids[vi] * len(lights.is_sun) + li
+
+def _vertex_positions(world_verts: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    # Returns unique world vertex positions of all sectors and index of position of each vertex
+    all_verts = np.concatenate(world_verts) if world_verts else np.zeros((0, 3))
+    positions, position_ids = np.unique(np.round(all_verts, _kShadowWeldDecimals), axis=0, return_inverse=True)
+    return positions, position_ids.reshape(-1)
+
+def _shadowed_pairs(model: _ExportModel, world_verts: List[np.ndarray], normals: List[np.ndarray], lights: _BakeLights,
+                    positions: np.ndarray, position_ids: np.ndarray) -> np.ndarray:
+    # Returns sorted keys (position * num lights + light) of unique vertex positions and lights occluded by exported surfaces.
+    # Vertices at the same position (e.g. shared by sectors) share rays and a ray is cast only for pairs which are lit
+    # enough to matter, rays which can't be vectorized are the remaining cost.
+    position_normals = np.zeros_like(positions)
+    np.add.at(position_normals, position_ids, np.concatenate(normals) if normals else np.zeros((0, 3)))
+    position_normals /= np.maximum(np.linalg.norm(position_normals, axis=1), 1e-12)[:, None]
+
+    offsets = _prefix_sum([len(v) for v in world_verts])
+    chunk   = max(1, _kBakeChunkSize // max(len(lights.is_sun), 1))
+    keys    = []
+    for verts, n, o in zip(world_verts, normals, offsets):
+        for start in range(0, len(verts), chunk):
+            lit = _received_light(lights, verts[start:start + chunk], n[start:start + chunk])
+            keys.append(np.unique(_lit_pairs(lights, lit, position_ids[o + start:o + start + chunk])))
+    keys = np.unique(np.concatenate(keys)) if keys else np.zeros(0, dtype=np.int64)
+    if len(keys) == 0:
+        return keys
+
+    pos_idx, li = np.divmod(keys, len(lights.is_sun))
+    p = positions[pos_idx]
+    dirs  = lights.pos[li] - p
+    dirs[lights.is_sun[li]] = lights.sun_to[li[lights.is_sun[li]]]
+    dist  = np.where(lights.is_sun[li], sys.float_info.max, np.linalg.norm(dirs, axis=1) - 2 * _kShadowBias)
+    dirs /= np.maximum(np.linalg.norm(dirs, axis=1), 1e-12)[:, None]
+    if bake_shadow_distance > 0:
+        dist = np.minimum(dist, bake_shadow_distance)
+    origins = (p + position_normals[pos_idx] * _kShadowBias).tolist()
+
+    tree = _shadow_tree(model, world_verts)
+    print("Warning: bake_shadows casts {} shadow rays one by one ({} unique vertex positions, {} lights), this can take a while".format(len(keys), len(positions), len(lights.is_sun)))
+    shadowed = np.array([tree.ray_cast(o, d, r)[0] is not None for o, d, r in zip(origins, dirs.tolist(), dist.tolist())], dtype=bool)
+    return keys[shadowed]
+
+def _bake_lights(model: _ExportModel, world_verts: List[np.ndarray], lights: List[bpy.types.Object]) -> Tuple[_ExportModel, List[Optional[_SectorLight]]]:
+    # Returns model with vertex colors multiplied by light of lights received by each vertex and average light of each sector
+    # (None if sector isn't lit). Vertex-light pairs of sector are lit in chunks of arrays, shadows see _shadowed_pairs.
+    # Average light intensity of sector is the sum of mean light of its vertices from each light,
+    # and position is average of light positions weighted by the light's intensity (sun is 2 radii from sector center).
+    bl       = _bake_light_arrays(lights)
+    normals  = [_vertex_normals(m) for m in model.meshes]
+    shadowed = None
+    if bake_shadows and len(lights):
+        positions, position_ids = _vertex_positions(world_verts)
+        shadowed = _shadowed_pairs(model, world_verts, normals, bl, positions, position_ids)
+
+    meshes, sector_lights = [], []
+    offsets = _prefix_sum([len(v) for v in world_verts])
+    chunk   = max(1, _kBakeChunkSize // max(len(lights), 1))
+    for m, verts, n, o in zip(model.meshes, world_verts, normals, offsets):
+        light = np.zeros((len(verts), 3))
+        light_sums = np.zeros((len(lights), 3)) # sum of light of sector vertices from each light
+        for start in range(0, len(verts), chunk):
+            lit = _received_light(bl, verts[start:start + chunk], n[start:start + chunk])
+            if shadowed is not None and len(shadowed):
+                vi, li = np.nonzero(lit)
+                hit = np.isin(position_ids[o + start + vi] * len(lights) + li, shadowed)
+                lit[vi[hit], li[hit]] = 0.0
+            light[start:start + chunk] = lit @ bl.color
+            light_sums += lit.sum(axis=0)[:, None] * bl.color
+
+        colors = m.vertex_colors.copy()
+        colors[:, :3] = np.clip(colors[:, :3] * (light + np.array(tuple(bake_ambient), dtype=np.float64)), 0.0, 1.0)
+        meshes.append(m._replace(vertex_colors=colors))
+
+        weights = light_sums.sum(axis=1)
+        if len(verts) == 0 or weights.sum() <= 0:
+            sector_lights.append(None)
+            continue
+        bb_min, bb_max = verts.min(axis=0), verts.max(axis=0)
+        light_pos = np.where(bl.is_sun[:, None], (bb_min + bb_max) * 0.5 + bl.sun_to * float(np.linalg.norm(bb_max - bb_min)), bl.pos)
+        position  = weights @ light_pos / weights.sum()
+        dist      = np.linalg.norm(verts - position, axis=1)
+        sector_lights.append(_SectorLight(light_sums.sum(axis=0) / len(verts), position, (float(dist.min()), float(dist.max()))))
+    return model._replace(meshes=meshes), sector_lights
 
 def _color_to_str(color: Tuple[Vector4f, Vector3f, float]) -> str:
     if isinstance(color, (Vector4f, Vector3f)):
@@ -61,9 +845,6 @@ def _rgba_to_rgb(rgba:Vector4f):
 def _rgba_to_intensity(rgba:Vector4f) -> float:
     return (rgba.x + rgba.y + rgba. z) * 0.33333 # divide by 3
 
-def _rgba_to_intensity_str(rgba:Vector4f) -> str:
-    return _color_to_str(_rgba_to_intensity(rgba))
-
 def _ndy_write_section_copyright_ijim(file):
     writeSectionTitle(file, "COPYRIGHT")
     writeLine(file,
@@ -189,6 +970,13 @@ def _ndy_write_section_lec_and_header(file, version: NdyVersion):
         _ndy_write_section_header_jkdf2(file)
     writeNewLine(file)
 
+def _ndy_material_rows(version: NdyVersion, materials, start_idx) -> Iterator[str]:
+    for idx, mat in enumerate(materials):
+        row = '{:}: {:>15}'.format(start_idx + idx, mat)
+        if version != NdyVersion.IJIM:
+           row += "\t1.000000\t1.000000"
+        yield row
+
 def _ndy_write_section_materials(file, version: NdyVersion, materials, start_idx):
     num_mats = len(materials)
     if num_mats < 1:
@@ -198,10 +986,7 @@ def _ndy_write_section_materials(file, version: NdyVersion, materials, start_idx
     writeKeyValue(file, "World materials", start_idx+ num_mats + 64)
     writeNewLine(file)
 
-    for idx, mat in enumerate(materials):
-        row = '{:}: {:>15}'.format(start_idx + idx, mat)
-        if version != NdyVersion.IJIM:
-           row += "\t1.000000\t1.000000"
+    for row in _ndy_material_rows(version, materials, start_idx):
         writeLine(file, row)
 
     writeLine(file, "end")
@@ -214,195 +999,298 @@ def _ndy_write_colormaps(file):
     for idx, cm in enumerate(colormaps):
         writeLine(file, '{:}:\t{}'.format(idx, cm))
 
-def _ndy_write_write_vertices(file, model: Model3do, start_idx) -> List[Mesh3do]:
-    vertices = []
-    meshes = []
-    for n in model.meshHierarchy:
-        if n.meshIdx < 0: continue
-        m = model.geosets[0].meshes[n.meshIdx]
-        meshes.append(m)
-        for v in m.vertices:
-            vert = _vec_convert_to_space(n.obj.matrix_world, v) # convert vertex coordinates to global
-            vertices.append(vert)
-
-    writeKeyValue(file, "World vertices", start_idx + len(vertices))
-    writeNewLine(file)
-
-    writeCommentLine(file, "num:     x:         y:         z:")
-    for idx, v in enumerate(vertices):
-        row = '{:}:'.format(start_idx + idx)
-        row += vec2str(v, True, 9)
-        writeLine(file, row)
-    writeNewLine(file)
-    writeNewLine(file)
-
-    return meshes
-
-def _ndy_write_uv_vertices(file, meshs: List[Mesh3do], start_idx):
-    uvs = []
-    for m in meshs:
-        for uv in m.uvs:
-            uvs.append(uv)
-
-    writeKeyValue(file, "World texture vertices", start_idx + len(uvs))
-    writeNewLine(file)
-
-    writeCommentLine(file, " num:	u:	v:")
-    for idx, vert in enumerate(uvs):
-        row = '{:}:'.format(start_idx + idx)
-        row += vec2str(vert, True, 9)
-        writeLine(file, row)
-    writeNewLine(file)
-    writeNewLine(file)
-
-def _surface_vertices_to_str(vert_idxs: List[int], vert_start_idx, uv_vert_idxs: List[int], uv_start_idx):
-    out = '{:>8}  '.format(len(vert_idxs))
-    for i in range(0, len(vert_idxs)):
-        out += "{:>3},{:>2}\t".format(vert_start_idx + vert_idxs[i], uv_start_idx + uv_vert_idxs[i])
-    return out
-
-def _surface_vertex_colors_to_str(version: NdyVersion, vert_idxs: List[int], vertices_color):
-    out =""
-    for vidx in vert_idxs:
-        color = vertices_color[vidx]
-        if version == NdyVersion.IJIM:
-            color = _rgba_to_rgb(vertices_color[vidx])
-            color = _color_to_str(color)
-        elif version == NdyVersion.MOTS:
-            color = Vector4f(color.w, color.x, color.y, color.z)
-            color = _color_to_str(color)
-        else: # JKDF2
-            color = _rgba_to_intensity_str(color)
-        out += '{}\t'.format(color)
-    return out
-
-def _is_floor(face: Mesh3doFace):
-    # if face is banked for less than 46 degrees it's a ground floor
-    return round(degrees(Vector(face.normal).angle((0.0, 0.0, 1.0)))) <= 45
-
-def _ndy_write_surfaces(file, version: NdyVersion, meshes: List[Mesh3do], mat_start_idx, vert_start_idx, uv_start_idx, surface_start_idx):
-    num_faces = sum(len(m.faces) for m in meshes)
-
-    writeKeyValue(file, "World surfaces", surface_start_idx + num_faces)
-    writeNewLine(file)
+def _join_rows(rows: Iterable[str]) -> Iterator[str]:
+    # Groups rows into pre-joined text chunks of at most _kRowsPerChunk lines
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, _kRowsPerChunk))
+        if not chunk:
+            return
+        yield _kNewLine.join(chunk) + _kNewLine
+
+def _join_block(rows: Iterable[str]) -> str:
+    # Joins rows into one text block, each row is terminated with new line
+    rows = list(rows)
+    return _kNewLine.join(rows) + _kNewLine if rows else ''
+
+def _ndy_indexed_rows(frags: List[str], start_idx, row_fmt = '{:}:') -> Iterator[str]:
+    # Prefixes fragments with consecutive row index
+    return map(str.__add__, map(row_fmt.format, range(start_idx, start_idx + len(frags))), frags)
+
+def _ndy_vertex_block(frags: '_SectorFragments', idx: int, start_idx) -> str:
+    return _join_block(_ndy_indexed_rows(frags.welded('vertices', idx), start_idx + frags.vert_offsets[idx]))
+
+def _ndy_uv_block(frags: '_SectorFragments', idx: int, start_idx) -> str:
+    return _join_block(_ndy_indexed_rows(frags.welded('uvs', idx), start_idx + frags.uv_offsets[idx]))
+
+def _ndy_iter_vertices(frags: '_SectorFragments', start_idx) -> Iterator[str]:
+    yield _to_str(writeKeyValue, "World vertices", start_idx + frags.num_verts)
+    yield _kNewLine
+
+    yield _to_str(writeCommentLine, "num:     x:         y:         z:")
+    yield from frags.blocks('vertices', start_idx)
+    yield _kNewLine
+    yield _kNewLine
+
+def _ndy_iter_uv_vertices(frags: '_SectorFragments', start_idx) -> Iterator[str]:
+    yield _to_str(writeKeyValue, "World texture vertices", start_idx + frags.num_uvs)
+    yield _kNewLine
+
+    yield _to_str(writeCommentLine, " num:	u:	v:")
+    yield from frags.blocks('uvs', start_idx)
+    yield _kNewLine
+    yield _kNewLine
+
+_surface_row_formats: Dict[int, str] = {}
+
+def _surface_row_format(num_verts: int) -> str:
+    # Returns %-format of surface row with num_verts vertices:
+    # row idx, mat idx, flags columns, adjoin, extralight, nverts, vertex and uv idx pairs, vertex colors
+    fmt = _surface_row_formats.get(num_verts)
+    if fmt is None:
+        fmt = '%d:\t%d\t%s%d\t%s%8d  ' + '%3d,%2d\t' * num_verts + '%s'
+        _surface_row_formats[num_verts] = fmt
+    return fmt
+
+def _format_colors(version: NdyVersion, rgba: np.ndarray) -> List[str]:
+    # Returns color strings of RGBA colors in version's color layout:
+    # IJIM - RGB, MOTS - ARGB, JKDF2 - intensity
+    if version == NdyVersion.IJIM:
+        return _format_vec_rows(rgba[:, :3], True, 0)
+    elif version == NdyVersion.MOTS:
+        return _format_vec_rows(rgba[:, [3, 0, 1, 2]], True, 0)
+    else: # JKDF2
+        return _format_float_rows((rgba[:, 0] + rgba[:, 1] + rgba[:, 2]) * 0.33333, '%.2f')
+
+def _classify_surfaces(materials: List[str], meshes: List[_ColumnarMesh]) -> List[np.ndarray]:
+    # Returns surfflags of faces of each sector.
+    # Faces of all sectors are classified in one pass over array of face normals
+    # by comparing cosine of angle to up axis with threshold, then overrides are applied.
+    normals = np.concatenate([m.normals for m in meshes]) if meshes else np.zeros((0, 3))
+    length  = np.linalg.norm(normals, axis=1)
+    flags   = np.full(len(normals), default_surfflags, dtype=np.int64)
+
+    # angles are rounded to whole degrees, hence + 0.5
+    flags[normals[:, 2] > length * cos(radians(floor_angle + 0.5))] |= 0x05 # 0x1 - floor | 0x4 - Collision
+    if ceiling_surfflags:
+        flags[normals[:, 2] < -length * cos(radians(ceiling_angle + 0.5))] |= ceiling_surfflags
+
+    sector_flags = np.split(flags, np.cumsum([m.num_faces for m in meshes])[:-1]) # views of flags
+    if surfflags_object_overrides:
+        for m, f in zip(meshes, sector_flags):
+            if m.name in surfflags_object_overrides:
+                f[:] = surfflags_object_overrides[m.name]
+
+    mat_idxs = np.concatenate([m.face_materials for m in meshes]) if meshes else np.zeros(0, dtype=np.int64)
+    mat_overrides = { name.lower(): value for name, value in surfflags_material_overrides.items() }
+    for idx, name in enumerate(materials):
+        if name.lower() in mat_overrides:
+            flags[mat_idxs == idx] = mat_overrides[name.lower()]
+    flags[mat_idxs < 0] = 0 # surfaces without material are openings of split sectors
+    return sector_flags
+
+def _ndy_surface_rows(frags: '_SectorFragments', sec_idx: int, mat_idx_map, vert_start_idx, uv_start_idx, adjoin_start_idx, surface_start_idx) -> Iterator[str]:
+    # mat_idx_map maps index of model material to index of material in NDY/JKL file
+    m = frags.meshes[sec_idx]
+    surface_start_idx += frags.surface_offsets[sec_idx]
+    if separate_sector_surfaces:
+        yield f"# Surfaces of Sector {sec_idx}"
+    # Index columns of all faces of sector are rebased at once,
+    # vertex and uv idx of face corners are interleaved into one flat list
+    mat_idxs = np.append(np.asarray(mat_idx_map, dtype=np.int64), -1)[m.face_materials].tolist() # -1 (no material) maps to -1
+    adjoins  = frags.surface_adjoins[sec_idx]
+    adjoins  = np.where(adjoins > -1, adjoin_start_idx + adjoins, -1).tolist()
+    corners  = np.empty((len(m.face_verts), 2), dtype=np.int64)
+    corners[:, 0] = vert_start_idx + frags.vert_map[sec_idx][m.face_verts]
+    corners[:, 1] = uv_start_idx + frags.uv_map[sec_idx][m.face_uvs]
+    corners  = corners.ravel().tolist()
+    offsets  = m.face_offsets.tolist()
+    for idx, (flags, extralight, colors) in enumerate(frags.get('surfaces', sec_idx)):
+        start, end = offsets[idx], offsets[idx + 1]
+        yield _surface_row_format(end - start) % (
+            surface_start_idx + idx,            # row idx
+            mat_idxs[idx],                      # mat idx
+            flags,                              # surfflags, faceflags, geo, light, tex
+            adjoins[idx],                       # adjoin
+            extralight,                         # extralight
+            end - start,                        # nverts
+            *corners[2 * start:2 * end],        # vertices
+            colors)                             # intensities
+
+    if separate_sector_surfaces:
+        yield "#######################################"
+        yield ""
+
+def _ndy_surface_block(frags: '_SectorFragments', idx: int, mat_idx_map, vert_start_idx, uv_start_idx, adjoin_start_idx, surface_start_idx) -> str:
+    return _join_block(_ndy_surface_rows(frags, idx, mat_idx_map, vert_start_idx, uv_start_idx, adjoin_start_idx, surface_start_idx))
+
+def _ndy_iter_surfaces(frags: '_SectorFragments', mat_idx_map, vert_start_idx, uv_start_idx, adjoin_start_idx, surface_start_idx) -> Iterator[str]:
+    yield _to_str(writeKeyValue, "World surfaces", surface_start_idx + frags.num_faces)
+    yield _kNewLine
+
+    yield _to_str(writeCommentLine, " num:	mat:	surfflags:	faceflags:	geo:	light:	tex:	adjoin:	extralight:	nverts:	vertices:	intensities:")
+    yield from frags.blocks('surfaces', mat_idx_map, vert_start_idx, uv_start_idx, adjoin_start_idx, surface_start_idx)
+    if not separate_sector_surfaces:
+        yield _kNewLine
+    yield _kNewLine
 
-    writeCommentLine(file, " num:	mat:	surfflags:	faceflags:	geo:	light:	tex:	adjoin:	extralight:	nverts:	vertices:	intensities:")
-    face_normals = []
-    for sec_idx, m in enumerate(meshes):
-        if separate_sector_surfaces:
-            writeLine(file, f"# Surfaces of Sector {sec_idx}")
-        for idx, face in enumerate(m.faces):
-            surfflags = default_surfflags
-            if _is_floor(face):
-                surfflags |= 0x05 # 0x1 - floor | 0x4 - Collision
-
-            row = '{}:\t'.format(surface_start_idx + idx)          # row idx
-            row += '{}\t'.format(mat_start_idx + face.materialIdx) # mat idx
-            row += '0x{:01x}\t'.format(surfflags)                  # surfflags
-            row += '0x{:01x}\t'.format(face.type)                  # faceflags
-            row += '{}\t'.format(face.geometryMode)                # geo
-            row += '{}\t'.format(face.lightMode)                   # light
-            row += '{}\t'.format(face.textureMode)                 # tex
-            row += '{}\t'.format(-1)                               # adjoin
-            row += '{}\t'.format(_color_to_str(face.color) if version == NdyVersion.IJIM else _rgba_to_intensity_str(face.color))     # extralight
-            row += _surface_vertices_to_str(face.vertexIdxs, vert_start_idx, face.uvIdxs, uv_start_idx)
-            row += _surface_vertex_colors_to_str(version, face.vertexIdxs, m.vertexColors)
-            writeLine(file, row)
-
-            # Local space face normal coordinates
-            face_normals.append(face.normal)
-
-        # increment start indices
-        surface_start_idx += len(m.faces)
-        vert_start_idx    += len(m.vertices)
-        uv_start_idx      += len(m.uvs)
-        if separate_sector_surfaces:
-                writeLine(file, f"#######################################")
-                writeNewLine(file)
+def _ndy_normal_block(frags: '_SectorFragments', idx: int, surface_start_idx) -> str:
+    return _join_block(_ndy_indexed_rows(frags.get('normals', idx), surface_start_idx + frags.surface_offsets[idx], '{}:\t'))
 
-    if not separate_sector_surfaces:
-        writeNewLine(file)
-    writeNewLine(file)
+def _ndy_iter_surface_normals(frags: '_SectorFragments', surface_start_idx) -> Iterator[str]:
+    yield _to_str(writeCommentLine, " --- Surface normals ---")
+    yield from frags.blocks('normals', surface_start_idx)
+    yield _kNewLine
+    yield _kNewLine
 
-    # write face normals
-    writeCommentLine(file, " --- Surface normals ---")
-    surface_start_idx -= len(face_normals)
-    for idx, n in enumerate(face_normals):
-        row = '{}:\t'.format(surface_start_idx + idx)
-        row += vec2str(n, True, 0)
-        writeLine(file, row)
+def _ndy_adjoin_rows(version: NdyVersion, frags: '_SectorFragments', start_idx) -> Iterator[str]:
+    dist = '0.00000000' if version == NdyVersion.IJIM else '0.00'
+    for idx, mirror in enumerate(frags.adjoins):
+        yield '{}:\t0x{:x}\t{}\t{}'.format(start_idx + idx, adjoin_flags, start_idx + mirror, dist)
 
-    writeNewLine(file)
-    writeNewLine(file)
+def _ndy_iter_adjoins(version: NdyVersion, frags: '_SectorFragments', start_idx) -> Iterator[str]:
+    yield _to_str(writeLine, "World adjoins {}".format(start_idx + len(frags.adjoins)))
+    yield _kNewLine
+    yield _to_str(writeCommentLine, " num:	flags:	mirror:	dist:")
+    yield from _join_rows(_ndy_adjoin_rows(version, frags, start_idx))
+    yield _kNewLine
 
-def _ndy_write_section_georesource(file, version: NdyVersion, model: Model3do, mat_start_idx, vert_start_idx, uv_start_idx, surface_start_idx):
-    writeSectionTitle(f, "GEORESOURCE")
+def _ndy_iter_section_georesource(version: NdyVersion, frags: '_SectorFragments', mat_idx_map, vert_start_idx, uv_start_idx, adjoin_start_idx, surface_start_idx, profiler: _ExportProfiler = _kNoProfiler) -> Iterator[str]:
+    yield _to_str(writeSectionTitle, "GEORESOURCE")
 
     if version != NdyVersion.IJIM:
-        writeCommentLine(f, " ------ Palette Subsection -----")
-        _ndy_write_colormaps(f)
-
-    writeCommentLine(f, " ----- Vertices Subsection -----")
-    meshes = _ndy_write_write_vertices(f, model, vert_start_idx)
-
-    writeCommentLine(f, " -- Texture Verts Subsection ---")
-    _ndy_write_uv_vertices(f, meshes, uv_start_idx)
-
-    writeCommentLine(f, " ----- Surfaces Subsection -----")
-    writeLine(f, "World adjoins 0")
-    writeNewLine(f)
-    writeCommentLine(f, " num:	flags:	mirror:	dist:")
-    writeNewLine(f)
-
-    writeCommentLine(f, " ----- Surfaces Subsection -----")
-    _ndy_write_surfaces(f, version, meshes, mat_start_idx, vert_start_idx, uv_start_idx, surface_start_idx)
-
-def _get_sector_dimensions(mesh: Mesh3do, world_matrix):
-    bb_min = Vector((999999999999.0, 999999999999.0, 999999999999.0))
-    bb_max = Vector((-999999999999.0, -999999999999.0, -999999999999.0))
-    center = Vector((0.0, 0.0, 0.0))
-
-    for vert in mesh.vertices:
-        vert = _vec_convert_to_space(world_matrix, vert) # convert vertex coordinates to global
-        if vert.x < bb_min.x:
-            bb_min.x = vert.x
-        if vert.x > bb_max.x:
-            bb_max.x = vert.x
-        if vert.y < bb_min.y:
-            bb_min.y = vert.y
-        if vert.y > bb_max.y:
-            bb_max.y = vert.y
-        if vert.z < bb_min.z:
-            bb_min.z = vert.z
-        if vert.z > bb_max.z:
-            bb_max.z = vert.z
-
-        center.x += vert.x
-        center.y += vert.y
-        center.z += vert.z
-
-    center.x /= len(mesh.vertices)
-    center.y /= len(mesh.vertices)
-    center.z /= len(mesh.vertices)
-
-    r = 0.0
-    for vert in mesh.vertices:
-        vert = _vec_convert_to_space(world_matrix, vert) # convert vertex coordinates to global
-        dist = sqrt(pow(vert.x - center.x, 2) + pow(vert.y - center.y, 2) + pow(vert.y - center.y, 2))
-        if dist > r:
-            r = dist
+        yield _to_str(writeCommentLine, " ------ Palette Subsection -----")
+        yield _to_str(_ndy_write_colormaps)
+
+    yield _to_str(writeCommentLine, " ----- Vertices Subsection -----")
+    yield from profiler.iter_stage('vertices', _ndy_iter_vertices(frags, vert_start_idx), frags.num_verts)
+
+    yield _to_str(writeCommentLine, " -- Texture Verts Subsection ---")
+    yield from profiler.iter_stage('uvs', _ndy_iter_uv_vertices(frags, uv_start_idx), frags.num_uvs)
+
+    yield _to_str(writeCommentLine, " ----- Surfaces Subsection -----")
+    yield from profiler.iter_stage('adjoins', _ndy_iter_adjoins(version, frags, adjoin_start_idx), len(frags.adjoins))
+
+    yield _to_str(writeCommentLine, " ----- Surfaces Subsection -----")
+    yield from profiler.iter_stage('surfaces', _ndy_iter_surfaces(frags, mat_idx_map, vert_start_idx, uv_start_idx, adjoin_start_idx, surface_start_idx), frags.num_faces)
+
+    # Local space face normal coordinates are streamed in second pass over faces
+    yield from profiler.iter_stage('normals', _ndy_iter_surface_normals(frags, surface_start_idx), frags.num_faces)
+
+_kSphereIterations = 32 # iterations of bounding sphere refinement
+
+def _farthest_point(points: np.ndarray, center: np.ndarray) -> Tuple[int, float]:
+    d = points - center
+    d = np.einsum('ij,ij->i', d, d)
+    idx = int(np.argmax(d))
+    return idx, float(np.sqrt(d[idx]))
+
+def _bounding_sphere(points: np.ndarray) -> Tuple[np.ndarray, float]:
+    # Returns center and radius of approximate minimal sphere enclosing points.
+    # Initial sphere is found by Ritter's method, growing sphere towards the farthest point until all points are inside.
+    # Then center is moved towards the farthest point in decreasing steps (Badoiu-Clarkson iteration) and
+    # the smallest sphere is kept. Radius is always distance to the farthest point, so sphere encloses all points.
+    # Sphere of no points is at origin with zero radius.
+    if len(points) == 0:
+        return np.zeros(3), 0.0
+    a = points[_farthest_point(points, points[0])[0]]
+    b = points[_farthest_point(points, a)[0]]
+    center = (a + b) * 0.5
+    radius = float(np.linalg.norm(b - a)) * 0.5
+    for _ in range(len(points)):
+        idx, d = _farthest_point(points, center)
+        if d <= radius:
+            break
+        radius  = (radius + d) * 0.5
+        center += (points[idx] - center) * ((d - radius) / d)
+
+    best_center, best_radius = center, _farthest_point(points, center)[1]
+    for k in range(1, _kSphereIterations + 1):
+        idx, d = _farthest_point(points, center)
+        if d < best_radius:
+            best_center, best_radius = center, d
+        center = center + (points[idx] - center) / (k + 1)
+    return best_center, best_radius
+
+def _get_sector_dimensions(world_verts: np.ndarray):
+    bb_min = world_verts.min(axis=0) if len(world_verts) else np.zeros(3)
+    bb_max = world_verts.max(axis=0) if len(world_verts) else np.zeros(3)
+    center, r = _bounding_sphere(world_verts)
     return (bb_min, bb_max, center, r)
 
-def _ndy_write_section_sectors(file, version: NdyVersion, model: Model3do, sector_idx, vert_start_idx, surface_start_idx):
-    meshes = model.geosets[0].meshes
+def _sector_bounds_report(frags: '_SectorFragments') -> List[dict]:
+    # Returns bounding sphere of each sector and radius of sphere around vertex average which was written before,
+    # and prints how much sector radii shrank
+    sectors = []
+    for idx, (m, verts) in enumerate(zip(frags.meshes, frags.world_verts)):
+        if len(verts) == 0:
+            continue
+        center, radius = _bounding_sphere(verts)
+        avg_radius = float(np.linalg.norm(verts - verts.mean(axis=0), axis=1).max())
+        sectors.append({
+            'sector'     : idx,
+            'name'       : m.name,
+            'center'     : center.tolist(),
+            'radius'     : radius,
+            'avg_radius' : avg_radius,
+            'shrink'     : 1.0 - radius / avg_radius if avg_radius > 0 else 0.0
+        })
+    if sectors:
+        top = max(sectors, key=lambda s: s['shrink'])
+        print("Info: sector radii shrank by {:.1f}% on average, max {:.1f}% (sector {} '{}')".format(
+            100 * sum(s['shrink'] for s in sectors) / len(sectors), 100 * top['shrink'], top['sector'], top['name']))
+    return sectors
+
+def _ndy_iter_section_sectors(frags: '_SectorFragments', sector_idx, vert_start_idx, surface_start_idx) -> Iterator[str]:
+    buf = io.StringIO()
+    writeCommentLine(buf, "###### Sector information ######")
+    writeSectionTitle(buf, "SECTORS")
+
+    writeKeyValue(buf, "World sectors", sector_idx + len(frags.meshes))
+    writeNewLine(buf)
+    writeNewLine(buf)
+    yield buf.getvalue()
+
+    yield from frags.blocks('sectors', sector_idx, vert_start_idx, surface_start_idx)
+
+def _ndy_sector_block(frags: '_SectorFragments', idx: int, sector_idx, vert_start_idx, surface_start_idx) -> str:
+    vert_idxs = frags.sector_vertices(idx)
+    return ''.join([
+        _to_str(writeKeyValue, "SECTOR", sector_idx + idx),
+        frags.get('sector', idx),
+        _to_str(writeKeyValue, 'VERTICES', len(vert_idxs)),
+        _join_block(_kSectorVertexRow.format(i, vert_start_idx + v) for i, v in enumerate(vert_idxs)),
+        _to_str(writeKeyValue, 'SURFACES', '{} {}'.format(surface_start_idx + frags.surface_offsets[idx], frags.meshes[idx].num_faces)),
+        _kNewLine
+    ])
+
+def _vertex_frags(world_verts: np.ndarray) -> List[str]:
+    return _format_vec_rows(world_verts, True, 9)
+
+def _uv_frags(mesh: _ColumnarMesh) -> List[str]:
+    return _format_vec_rows(mesh.uvs, True, 9)
+
+def _surface_frags(version: NdyVersion, mesh: _ColumnarMesh, surfflags: np.ndarray) -> List[Tuple[str, str, str]]:
+    # Returns (flags columns, extralight, vertex colors) of each face.
+    # Columns which depend on start indices or other sectors (index columns, adjoin) are formatted when rows are written.
+    # Colors of all vertices and faces are formatted at once
+    vert_colors = [c + '\t' for c in _format_colors(version, mesh.vertex_colors)]
+    if version == NdyVersion.IJIM:
+        extralights = _format_vec_rows(mesh.face_colors, True, 0)
+    else:
+        extralights = _format_colors(NdyVersion.JKDF2, mesh.face_colors)
 
-    writeCommentLine(f, "###### Sector information ######")
-    writeSectionTitle(f, "SECTORS")
+    # surfflags, faceflags, geo, light, tex
+    flags   = map('0x%x\t0x%x\t%d\t%d\t%d\t'.__mod__, zip(surfflags.tolist(), *mesh.face_modes.T.tolist()))
+    corners = [vert_colors[i] for i in mesh.face_verts.tolist()]
+    offsets = mesh.face_offsets.tolist()
+    return [(f, extralight + '\t', ''.join(corners[offsets[i]:offsets[i + 1]])) for i, (f, extralight) in enumerate(zip(flags, extralights))]
 
-    writeKeyValue(file, "World sectors", sector_idx + len(meshes))
-    writeNewLine(f)
-    writeNewLine(f)
+def _normal_frags(mesh: _ColumnarMesh) -> List[str]:
+    return _format_vec_rows(mesh.normals, True, 0)
 
+def _sector_frag(version: NdyVersion, world_verts: np.ndarray, light: Optional[_SectorLight] = None) -> str:
+    # Returns sector lines from FLAGS to RADIUS
     def _sec_color_2_str(color: Vector4f, version) -> str:
         if version == NdyVersion.IJIM:
             color = _rgba_to_rgb(color)
@@ -410,75 +1298,716 @@ def _ndy_write_section_sectors(file, version: NdyVersion, model: Model3do, secto
             color = _rgba_to_intensity(color)
         return _color_to_str(color)
 
-    idx = 0
-    for n in model.meshHierarchy:
-        if n.meshIdx < 0:
-            continue
-        m = meshes[n.meshIdx]
-
-        writeKeyValue(file, "SECTOR", sector_idx + idx)
-        writeKeyValue(file, "FLAGS", '0x{:01x}'.format(0))
-        writeKeyValue(file, "AMBIENT LIGHT", _sec_color_2_str(ambient_light, version))
-        writeKeyValue(file, "EXTRA LIGHT", _sec_color_2_str(sector_extra_light, version))
-        if version  == NdyVersion.IJIM:
-            writeKeyValue(file, "AVERAGE LIGHT INTENSITY", '0.0 0.0 0.0')
-            writeKeyValue(file, "AVERAGE LIGHT POSITION", '0.0 0.0 0.0')
-            writeKeyValue(file, "AVERAGE LIGHT FALLOFF", '0.0 0.0')
-        else: # JKDF2 & MOTS
-            writeKeyValue(file, "COLORMAP", default_colormap_idx)
-            writeKeyValue(file, "TINT", '0.0 0.0 0.0')
-
-        bb_min, bb_max, center, radius = _get_sector_dimensions(m, n.obj.matrix_world)
-        writeKeyValue(file, "BOUNDBOX", vec2str(bb_min) + vec2str(bb_max))
-        writeKeyValue(file, "CENTER", vec2str(center))
-        writeKeyValue(file, "RADIUS", r2str(radius))
-
-        writeKeyValue(file, 'VERTICES', len(m.vertices))
-        for i in range(len(m.vertices)):
-            writeKeyValue(file, '', '{}: {}'.format(i, vert_start_idx + i))
-        vert_start_idx += len(m.vertices)
-
-        writeKeyValue(file, 'SURFACES', '{} {}'.format(surface_start_idx, len(m.faces)))
-        surface_start_idx += len(m.faces)
-        writeNewLine(f)
-
-        idx += 1
-
-def _make_model3do_from_obj(obj: bpy.types.Object, version: NdyVersion):
-    model = Model3do(obj.name)
-    model.geosets.append(Model3doGeoSet())
-    uvAbsolute = False if version == NdyVersion.IJIM else True
-    model3do_add_obj(model, obj, parent=obj, uvAbsolute=uvAbsolute, exportVertexColors=True)
-    return model
-
-# Get one selected object
-if len(bpy.context.selected_objects) == 0:
-    print("Error: could not determine which objects to export. Put into '{}' group or select (1) top object in hierarchy!".format(kGModel3do))
-    raise Exception('No object selected to export')
-
-if len(bpy.context.selected_objects) > 1:
-    print("Error: could not determine which objects to export, more then 1 object selected!")
-    raise Exception('Too many objects selected to export')
-
-obj = bpy.context.selected_objects[0]
-model = _make_model3do_from_obj(obj, out_version)
-
-assert len(model.geosets) == 1, "Converted OBJ to 3DO model must have exact 1 geoset"
-
-# Write to ndy file
-f = open(out_file, 'w', encoding='utf-8')
-
-# write copyright and header sections
-_ndy_write_section_lec_and_header(f, out_version)
-
-# Write materials
-_ndy_write_section_materials(f, out_version, model.materials, mat_start_idx)
-
-# Write Georesources
-_ndy_write_section_georesource(f, out_version, model, mat_start_idx, vert_start_idx, uv_start_idx, surface_start_idx)
-
-# Write sector
-_ndy_write_section_sectors(f, out_version, model, sector_idx, vert_start_idx, surface_start_idx)
+    buf = io.StringIO()
+    writeKeyValue(buf, "FLAGS", '0x{:01x}'.format(0))
+    writeKeyValue(buf, "AMBIENT LIGHT", _sec_color_2_str(ambient_light, version))
+    writeKeyValue(buf, "EXTRA LIGHT", _sec_color_2_str(sector_extra_light, version))
+    if version  == NdyVersion.IJIM and light is not None:
+        writeKeyValue(buf, "AVERAGE LIGHT INTENSITY", vec2str(light.intensity.tolist()))
+        writeKeyValue(buf, "AVERAGE LIGHT POSITION", vec2str(light.position.tolist()))
+        writeKeyValue(buf, "AVERAGE LIGHT FALLOFF", vec2str(light.falloff))
+    elif version  == NdyVersion.IJIM:
+        writeKeyValue(buf, "AVERAGE LIGHT INTENSITY", '0.0 0.0 0.0')
+        writeKeyValue(buf, "AVERAGE LIGHT POSITION", '0.0 0.0 0.0')
+        writeKeyValue(buf, "AVERAGE LIGHT FALLOFF", '0.0 0.0')
+    else: # JKDF2 & MOTS
+        writeKeyValue(buf, "COLORMAP", default_colormap_idx)
+        writeKeyValue(buf, "TINT", '0.0 0.0 0.0')
+
+    bb_min, bb_max, center, radius = _get_sector_dimensions(world_verts)
+    writeKeyValue(buf, "BOUNDBOX", vec2str(bb_min.tolist()) + vec2str(bb_max.tolist()))
+    writeKeyValue(buf, "CENTER", vec2str(center.tolist()))
+    writeKeyValue(buf, "RADIUS", r2str(radius))
+    return buf.getvalue()
+
+_kNeighbourCells = [d for d in np.ndindex(3, 3, 3) if (np.array(d) - 1).tolist() > [0, 0, 0]] # 13 cells after cell
+
+def _merge_points(points: np.ndarray, tolerance: float) -> np.ndarray:
+    # Returns id of each point, points closer than tolerance (also through chain of such points) have the same id.
+    # Points are binned to grid of tolerance size, so points within tolerance are in the same or in neighbouring cells,
+    # and cell is merged with each neighbouring cell whose first point is within tolerance of the cell's first point.
+    # Cells are looked up by int key of ranks of their coordinates, so keys don't overflow for any coordinates.
+    cells = np.floor(points / tolerance).astype(np.int64)
+    axis_values = [np.unique(cells[:, k]) for k in range(3)]
+    ranks = np.stack([np.searchsorted(v, cells[:, k]) for k, v in enumerate(axis_values)], axis=1)
+    ny, nz = len(axis_values[1]), len(axis_values[2])
+    xy_keys = np.unique(ranks[:, 0] * ny + ranks[:, 1])
+    def _keys(r: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        xy  = r[:, 0] * ny + r[:, 1]
+        idx = np.minimum(np.searchsorted(xy_keys, xy), len(xy_keys) - 1)
+        return idx * nz + r[:, 2], xy_keys[idx] == xy
+    cell_keys, first, cell_ids = np.unique(_keys(ranks)[0], return_index=True, return_inverse=True)
+
+    cell_ranks = ranks[first]
+    firsts     = points[first]
+    pairs_a, pairs_b = [], []
+    for d in _kNeighbourCells:
+        r  = cell_ranks + (np.array(d) - 1)
+        ok = np.ones(len(r), dtype=bool)
+        for k, v in enumerate(axis_values): # neighbouring coordinate exists only if it's next value of axis
+            valid = (r[:, k] >= 0) & (r[:, k] < len(v))
+            r[~valid, k] = 0
+            ok &= valid & (v[r[:, k]] == v[cell_ranks[:, k]] + d[k] - 1)
+        keys, found = _keys(r)
+        idx = np.minimum(np.searchsorted(cell_keys, keys), len(cell_keys) - 1)
+        ok &= found & (cell_keys[idx] == keys)
+        a, b = np.flatnonzero(ok), idx[ok]
+        close = np.linalg.norm(firsts[a] - firsts[b], axis=1) <= tolerance
+        pairs_a.append(a[close])
+        pairs_b.append(b[close])
+
+    # connected cells get the smallest cell id of their component
+    labels = np.arange(len(cell_keys))
+    a, b = np.concatenate(pairs_a), np.concatenate(pairs_b)
+    while len(a):
+        low = np.minimum(labels[a], labels[b])
+        if np.array_equal(low, labels[a]) and np.array_equal(low, labels[b]):
+            break
+        np.minimum.at(labels, a, low)
+        np.minimum.at(labels, b, low)
+        labels = labels[labels]
+    return labels[cell_ids.reshape(-1)]
+
+def _find_adjoins(meshes: List[_ColumnarMesh], world_verts: List[np.ndarray], tolerance: float, caps_only: bool = False) -> Tuple[List[int], List[np.ndarray]]:
+    # Finds coincident faces of different sectors and connects each pair with two mirrored adjoins.
+    # Vertices within tolerance are mapped to shared point ids (see _merge_points),
+    # then faces of each vertex count are matched by rows of sorted point ids of their corners.
+    # If caps_only is set, only faces without material (caps of split sectors) are adjoined.
+    # Adjoins are numbered in order of the first face of each pair.
+    # Returns mirror index of each adjoin and per sector array of face adjoin indices (-1 = no adjoin).
+    sizes   = [m.num_faces for m in meshes]
+    adjoins = np.full(sum(sizes), -1, dtype=np.int64)
+    eligible = np.concatenate([m.face_materials < 0 for m in meshes]) if caps_only else np.ones(len(adjoins), dtype=bool)
+    if len(meshes) < 2 or not eligible.any():
+        return [], np.split(adjoins, np.cumsum(sizes)[:-1])
+
+    vert_offsets = np.cumsum([0] + [len(v) for v in world_verts])
+    corners      = np.concatenate([o + m.face_verts for o, m in zip(vert_offsets.tolist(), meshes)])
+    face_sizes   = np.concatenate([np.diff(m.face_offsets) for m in meshes])
+    face_offsets = np.concatenate(([0], np.cumsum(face_sizes)))
+    face_sectors = np.repeat(np.arange(len(meshes)), sizes)
+
+    # only vertices of eligible faces are merged into point ids
+    used = np.unique(corners[np.repeat(eligible, face_sizes)])
+    point_ids = np.zeros(vert_offsets[-1], dtype=np.int64)
+    point_ids[used] = _merge_points(np.concatenate(world_verts)[used], tolerance)
+    corners = point_ids[corners]
+
+    # key of each face, faces are coincident if they have the same key, faces which aren't eligible have unique keys
+    keys = np.empty(len(face_sizes), dtype=np.int64)
+    num_keys = 0
+    for n in np.unique(face_sizes[eligible]).tolist():
+        faces = np.flatnonzero((face_sizes == n) & eligible)
+        rows  = np.sort(corners[face_offsets[faces, None] + np.arange(n)], axis=1)
+        inverse = np.unique(rows, axis=0, return_inverse=True)[1].reshape(-1)
+        keys[faces] = num_keys + inverse
+        num_keys += int(inverse.max()) + 1
+    keys[~eligible] = num_keys + np.arange(int((~eligible).sum()))
+
+    order  = np.argsort(keys, kind='stable')
+    starts = np.flatnonzero(np.diff(keys[order], prepend=-1))
+    counts = np.diff(starts, append=len(keys))
+    pairs  = starts[counts == 2]
+    face_a, face_b = order[pairs], order[pairs + 1]
+    same   = face_sectors[face_a] == face_sectors[face_b]
+    ambiguous = int((counts > 2).sum() + same.sum())
+    face_a, face_b = face_a[~same], face_b[~same]
+    first  = np.argsort(face_a)
+    adjoins[face_a[first]] = np.arange(0, 2 * len(first), 2)
+    adjoins[face_b[first]] = np.arange(1, 2 * len(first), 2)
+
+    if ambiguous:
+        print("Warning: {} coincident surfaces couldn't be adjoined, each must be shared by exactly 2 sectors".format(ambiguous))
+    return (np.arange(2 * len(first)) ^ 1).tolist(), np.split(adjoins, np.cumsum(sizes)[:-1])
+
+def _clear_adjoined(mesh: _ColumnarMesh, adjoins: np.ndarray) -> _ColumnarMesh:
+    # Returns mesh with adjoined faces without material and geo mode (not drawn), as caps of split sectors are
+    faces = np.flatnonzero((adjoins >= 0) & (mesh.face_materials >= 0))
+    if len(faces) == 0:
+        return mesh
+    materials, modes = mesh.face_materials.copy(), mesh.face_modes.copy()
+    materials[faces] = -1
+    modes[faces, 1]  = 0
+    return mesh._replace(face_materials=materials, face_modes=modes)
+
+def _weld(points: List[np.ndarray], tolerance: float) -> Tuple[List[np.ndarray], List[Optional[np.ndarray]], int]:
+    # Merges points of all sectors which fall into the same cell of tolerance sized grid.
+    # Returns per sector array of welded point indices, per sector mask of points which are kept
+    # (the first point of each cell, None = all points are kept) and number of welded points.
+    # Welded points are numbered in order of kept points. If tolerance is 0 points are not welded.
+    sizes   = [len(p) for p in points]
+    offsets = np.cumsum([0] + sizes)
+    if tolerance <= 0 or offsets[-1] == 0:
+        return [np.arange(offsets[i], offsets[i + 1]) for i in range(len(points))], [None] * len(points), int(offsets[-1])
+
+    grid = np.floor(np.concatenate(points) / tolerance + 0.5).astype(np.int64)
+    _, first, inverse = np.unique(grid, axis=0, return_index=True, return_inverse=True)
+    # renumber cells by their first point
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    welded = rank[inverse.reshape(-1)]
+    kept   = np.zeros(len(grid), dtype=bool)
+    kept[first] = True
+    return np.split(welded, offsets[1:-1]), np.split(kept, offsets[1:-1]), len(first)
+
+class _ExportCache:
+    # Persistent cache of formatted sector fragments, keyed by content hash of hierarchy node
+    # (mesh data, world space vertices, materials and export settings).
+    # Each fragment part of node is stored in separate file '<key>.<part>', so parts can be loaded pass by pass.
+    # Least recently used entries are evicted when cache grows over max_size bytes.
+    kVersion = 5
+
+    def __init__(self, cache_dir: str, max_size: int):
+        self.cache_dir = cache_dir
+        self.max_size  = max_size
+        self.hits      = 0
+        self.misses    = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key: str, part: str) -> str:
+        return os.path.join(self.cache_dir, key + '.' + part)
+
+    def node_key(self, version: NdyVersion, mesh: _ColumnarMesh, world_verts: np.ndarray, surfflags: np.ndarray, light: Optional[_SectorLight] = None) -> str:
+        # Material indices are not part of cached fragments, so only mesh arrays which are formatted
+        # and export settings are hashed and node doesn't get dirty when material order changes
+        h = hashlib.blake2b(digest_size=16)
+        h.update(repr((self.kVersion, version.name, tuple(ambient_light), tuple(sector_extra_light), default_colormap_idx, mesh.face_colors.shape)).encode())
+        for arr in (surfflags, world_verts, mesh.uvs, mesh.vertex_colors, mesh.face_offsets, mesh.face_verts,
+                    mesh.face_modes, mesh.face_colors, mesh.normals):
+            h.update(np.ascontiguousarray(arr).tobytes())
+        if light is not None:
+            h.update(repr((light.intensity.tolist(), light.position.tolist(), light.falloff)).encode())
+        return h.hexdigest()
+
+    def lookup(self, key: str) -> bool:
+        # Returns True if all parts of node are cached and marks entry as recently used
+        try:
+            for part in _SectorFragments.kParts:
+                os.utime(self._path(key, part))
+            self.hits += 1
+            return True
+        except OSError:
+            self.misses += 1
+            return False
+
+    def load(self, key: str, part: str):
+        with open(self._path(key, part), 'rb') as f:
+            return pickle.load(f)
+
+    def store(self, key: str, part: str, frags):
+        path = self._path(key, part)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(frags, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def evict(self) -> Tuple[int, int]:
+        # Removes least recently used entries until cache size is under max_size.
+        # Returns number of entries and cache size in bytes.
+        entries: Dict[str, List[int]] = {} # key -> [size, last use]
+        for e in os.scandir(self.cache_dir):
+            key, _, part = e.name.partition('.')
+            if part not in _SectorFragments.kParts:
+                continue
+            st = e.stat()
+            entry = entries.setdefault(key, [0, 0])
+            entry[0] += st.st_size
+            entry[1]  = max(entry[1], st.st_mtime_ns)
+
+        size = sum(e[0] for e in entries.values())
+        for key, (entry_size, _) in sorted(entries.items(), key=lambda e: e[1][1]):
+            if size <= self.max_size:
+                break
+            for part in _SectorFragments.kParts:
+                try:
+                    os.remove(self._path(key, part))
+                except OSError:
+                    pass
+            size -= entry_size
+            del entries[key]
+        return len(entries), size
+
+    def report(self):
+        num_entries, size = self.evict()
+        print("Info: export cache: {} hits, {} misses, {} entries ({:.1f} MB)".format(self.hits, self.misses, num_entries, size / (1024 * 1024)))
+
+class _SectorFragments:
+    # Formatted row fragments of each sector (mesh in model hierarchy) with indices relative to the sector.
+    # Fragments are formatted pass by pass, or loaded from export cache for sectors which didn't change,
+    # and are rebased to start indices by the section writers.
+    # Adjoins and welded vertices depend on neighbouring sectors, so they are not cached and are computed on every export.
+    # Start of each sector's rows is known up front (prefix sums), so text blocks of sectors
+    # can be formatted independently, and concurrently if worker pool is set.
+    kParts = ('vertices', 'uvs', 'surfaces', 'normals', 'sector')
+
+    def __init__(self, version: NdyVersion, model: _ExportModel, world_verts: List[np.ndarray], cache: Optional[_ExportCache] = None,
+                 sector_lights: Optional[List[Optional[_SectorLight]]] = None):
+        self.version     = version
+        self.world_verts = world_verts
+        self.cache       = cache
+
+        # Caps of split sectors are always adjoined, other coincident surfaces only with auto_adjoins.
+        # Adjoined surfaces are openings, so they are cleared of material and geo mode as caps are.
+        self.adjoins, self.surface_adjoins = _find_adjoins(model.meshes, world_verts, adjoin_tolerance, caps_only=not auto_adjoins)
+        self.model       = model._replace(meshes=[_clear_adjoined(m, a) for m, a in zip(model.meshes, self.surface_adjoins)])
+        self.meshes      = self.model.meshes
+        self.sector_lights = sector_lights or [None] * len(self.meshes)
+        self.num_faces   = sum(m.num_faces for m in self.meshes)
+        self.surfflags   = _classify_surfaces(model.materials, self.meshes)
+        self.keys        = []
+        self.clean       = [False] * len(self.meshes)
+        if cache:
+            self.keys  = [cache.node_key(version, m, v, f, l) for m, v, f, l in zip(self.meshes, world_verts, self.surfflags, self.sector_lights)]
+            self.clean = [cache.lookup(k) for k in self.keys]
+
+        # Maps of sector's vertex and uv indices to indices in world vertex lists, relative to start index
+        self.vert_map, self.vert_kept, self.num_verts = _weld(world_verts, weld_tolerance if weld_vertices else 0)
+        self.uv_map, self.uv_kept, self.num_uvs = _weld([m.uvs for m in self.meshes], weld_uv_tolerance if weld_vertices else 0)
+
+        # Offsets of sector's first vertex, texture vertex and surface row relative to start index
+        self.vert_offsets    = _prefix_sum([len(m) if k is None else int(k.sum()) for m, k in zip(self.vert_map, self.vert_kept)])
+        self.uv_offsets      = _prefix_sum([len(m) if k is None else int(k.sum()) for m, k in zip(self.uv_map, self.uv_kept)])
+        self.surface_offsets = _prefix_sum([m.num_faces for m in self.meshes])
+        self.pool      = None # worker process pool, see _sector_block_pool
+        self.pool_size = 0
+
+    def sector_vertices(self, idx: int) -> List[int]:
+        # Returns world vertex indices of sector, relative to start index
+        return list(dict.fromkeys(self.vert_map[idx].tolist()))
+
+    def _format(self, part: str, idx: int):
+        m = self.meshes[idx]
+        if part == 'vertices':
+            return _vertex_frags(self.world_verts[idx])
+        elif part == 'uvs':
+            return _uv_frags(m)
+        elif part == 'surfaces':
+            return _surface_frags(self.version, m, self.surfflags[idx])
+        elif part == 'normals':
+            return _normal_frags(m)
+        elif part == 'sector':
+            return _sector_frag(self.version, self.world_verts[idx], self.sector_lights[idx])
+        raise ValueError(f"Invalid sector fragment part '{part}'")
+
+    def welded(self, part: str, idx: int) -> List[str]:
+        # Returns 'vertices' or 'uvs' fragments of sector without fragments of welded points
+        mask  = (self.vert_kept if part == 'vertices' else self.uv_kept)[idx]
+        frags = self.get(part, idx)
+        return frags if mask is None else list(compress(frags, mask))
+
+    def get(self, part: str, idx: int):
+        # Returns fragments of part of sector
+        if self.clean[idx]:
+            return self.cache.load(self.keys[idx], part)
+        frags = self._format(part, idx)
+        if self.cache:
+            self.cache.store(self.keys[idx], part, frags)
+        return frags
+
+    def blocks(self, part: str, *args) -> Iterator[str]:
+        # Yields text block of section part ('vertices', 'uvs', 'surfaces', 'normals' or 'sectors') of each sector in order.
+        # With worker pool, at most 2 blocks per worker are formatted ahead of the block being written.
+        block_fn = _kSectorBlocks[part]
+        if self.pool is None:
+            for idx in range(len(self.meshes)):
+                yield block_fn(self, idx, *args)
+            return
+
+        pending = deque()
+        for idx in range(len(self.meshes)):
+            pending.append(self.pool.submit(_ndy_sector_block_worker, part, idx, args))
+            if len(pending) >= 2 * self.pool_size:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+_kSectorBlocks = {
+    'vertices' : _ndy_vertex_block,
+    'uvs'      : _ndy_uv_block,
+    'surfaces' : _ndy_surface_block,
+    'normals'  : _ndy_normal_block,
+    'sectors'  : _ndy_sector_block
+}
+
+_worker_frags: Optional[_SectorFragments] = None # fragments of running export, inherited by forked worker processes
+
+def _ndy_sector_block_worker(part: str, idx: int, args: tuple) -> str:
+    return _kSectorBlocks[part](_worker_frags, idx, *args)
+
+@contextmanager
+def _sector_block_pool(frags: _SectorFragments):
+    # Starts pool of forked worker processes which format sector blocks of frags.
+    # Workers inherit frags from this process (copy-on-write), so only part name and start indices
+    # are sent to them. Small exports, Blender with UI (see parallel_in_ui) and platforms without fork
+    # are formatted on this process. Yields number of processes formatting sectors.
+    global _worker_frags
+    workers = min(num_workers or os.cpu_count() or 1, len(frags.meshes))
+    if workers < 2 or frags.num_faces < parallel_min_faces or 'fork' not in multiprocessing.get_all_start_methods() \
+        or not (getattr(bpy.app, 'background', False) or parallel_in_ui):
+        yield 1
+        return
+    # Worker function is sent to workers by reference, which works only if script runs as a module (e.g. in Blender)
+    if getattr(sys.modules.get(_ndy_sector_block_worker.__module__), _ndy_sector_block_worker.__name__, None) is not _ndy_sector_block_worker:
+        print("Warning: script doesn't run as module, sectors are formatted serially")
+        yield 1
+        return
 
-f.flush()
-f.close()
\ No newline at end of file
+    _worker_frags = frags
+    try:
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            frags.pool, frags.pool_size = pool, workers
+            yield workers
+    finally:
+        frags.pool, frags.pool_size = None, 0
+        _worker_frags = None
+
+def _prefix_sum(sizes: List[int]) -> List[int]:
+    return np.cumsum([0] + sizes).tolist()
+
+def _ndy_iter_export(version: NdyVersion, frags: _SectorFragments, mat_start_idx, vert_start_idx, uv_start_idx, adjoin_start_idx, surface_start_idx, sector_idx, profiler: _ExportProfiler = _kNoProfiler) -> Iterator[str]:
+    # write copyright and header sections
+    yield from profiler.iter_stage('header', [_to_str(_ndy_write_section_lec_and_header, version)])
+
+    # Write materials
+    yield from profiler.iter_stage('materials', [_to_str(_ndy_write_section_materials, version, frags.model.materials, mat_start_idx)], len(frags.model.materials))
+
+    # Write Georesources
+    mat_idx_map = mat_start_idx + np.arange(len(frags.model.materials), dtype=np.int64)
+    yield from _ndy_iter_section_georesource(version, frags, mat_idx_map, vert_start_idx, uv_start_idx, adjoin_start_idx, surface_start_idx, profiler)
+
+    # Write sector
+    yield from profiler.iter_stage('sectors', _ndy_iter_section_sectors(frags, sector_idx, vert_start_idx, surface_start_idx), len(frags.meshes))
+
+def _join_blocks(chunks: Iterable[str], buffer_size: int) -> Iterator[str]:
+    # Joins text chunks into blocks of at least buffer_size characters
+    block = []
+    block_size = 0
+    for c in chunks:
+        block.append(c)
+        block_size += len(c)
+        if block_size >= buffer_size:
+            yield ''.join(block)
+            block.clear()
+            block_size = 0
+    if block:
+        yield ''.join(block)
+
+def _ndy_write_chunks(file, chunks: Iterable[str], buffer_size: int, profiler: _ExportProfiler = _kNoProfiler):
+    for block in _join_blocks(chunks, buffer_size):
+        with profiler.stage('write'):
+            file.write(block)
+
+class _NdyListIndex(NamedTuple):
+    count: int                  # value of 'World <list>' count line
+    count_span: Tuple[int, int] # byte offsets of count value
+    num_rows: int               # number of existing rows in list
+    rows_end: int               # byte offset where new rows are inserted
+
+_kReNdySection   = re.compile(rb'^[ \t]*SECTION:[ \t]*(\w+)', re.M | re.I)
+_kReNdyListCount = re.compile(rb'^[ \t]*World[ \t]+(materials|vertices|texture vertices|adjoins|surfaces|sectors)[ \t]+(\d+)', re.M | re.I)
+_kReNdyRow       = re.compile(rb'^[ \t]*(\d+):')
+_kReNdyMatRow    = re.compile(rb'^[ \t]*(\d+):[ \t]*(\S+)', re.M)
+_kReNdyRows      = re.compile(rb'^[ \t]*\d+:', re.M)
+_kReNdySurfRow   = re.compile(rb'[ \t]*\d+:(?:[ \t]+[^ \t\r\n]+){4}') # surface row has more values than normal row (x, y, z)
+_kReNdyEnd       = re.compile(rb'^[ \t]*end\b', re.M | re.I)
+_kReNdySurfaces  = re.compile(rb'^[ \t]*SURFACES\b', re.I)
+_kReNdySeparator = re.compile(rb'[ \t]*#+[ \t]*\r?\n([ \t]*\r?\n)?')
+_kReNdyComment   = re.compile(rb'^[ \t]*#', re.M)
+
+def _find_last_line(mm: mmap.mmap, start: int, end: int, regex: re.Pattern) -> Tuple[int, int]:
+    # Scans lines backwards from end and returns (start, end) offsets of the last line in range which matches regex.
+    # The end offset includes line terminator. Returns (-1, start) if no line matches.
+    pos = end
+    while pos > start:
+        line_end   = pos - 1 if mm[pos - 1] == ord('\n') else pos
+        line_start = max(mm.rfind(b'\n', start, line_end) + 1, start)
+        if regex.match(mm[line_start:line_end]):
+            return (line_start, pos)
+        pos = line_start
+    return (-1, start)
+
+def _next_line(mm: mmap.mmap, pos: int, end: int) -> int:
+    # Returns offset of line following the line at pos
+    line_end = mm.find(b'\n', pos, end)
+    return line_end + 1 if line_end > -1 else end
+
+def _ndy_index_lists(mm: mmap.mmap) -> Dict[str, _NdyListIndex]:
+    # Builds byte offset index of NDY/JKL lists (materials, vertices, texture vertices, surfaces, surface normals and sectors)
+    # by scanning only section titles, list count lines and list ends without parsing list rows.
+    size     = len(mm)
+    sections = [m.start() for m in _kReNdySection.finditer(mm)]
+    counts   = list(_kReNdyListCount.finditer(mm))
+
+    def _region_end(pos: int, next_count: int) -> int:
+        # list ends at next list count line or next section, whichever comes first
+        next_section = next((s for s in sections if s > pos), size)
+        return min(next_count, next_section)
+
+    lists = {}
+    for i, m in enumerate(counts):
+        name  = m.group(1).decode().lower()
+        count = int(m.group(2))
+        span  = m.span(2)
+        end   = _region_end(m.end(), counts[i + 1].start() if i + 1 < len(counts) else size)
+
+        if name == 'materials':
+            e = _kReNdyEnd.search(mm, m.end(), end)
+            end = e.start() if e else end
+            row_start, rows_end = _find_last_line(mm, m.end(), end, _kReNdyRow)
+            num_rows = int(_kReNdyRow.match(mm[row_start:rows_end]).group(1)) + 1 if row_start > -1 else 0
+            lists[name] = _NdyListIndex(count, span, num_rows, rows_end)
+        elif name == 'surfaces':
+            # Surface list is followed by surface normals list, surfaces end at the first row which isn't surface row
+            # (same rule as ndy_reader.build_index, 'World surfaces' count isn't used to find list end)
+            normals_start = next((r.start() for r in _kReNdyRows.finditer(mm, m.end(), end) if not _kReNdySurfRow.match(mm, r.start())), end)
+            _, rows_end = _find_last_line(mm, m.end(), normals_start, _kReNdyRow)
+            # skip sector surfaces separator (see separate_sector_surfaces)
+            sep = _kReNdySeparator.match(mm, rows_end, normals_start)
+            rows_end = sep.end() if sep and rows_end > m.end() else rows_end
+            _, normals_end = _find_last_line(mm, rows_end, end, _kReNdyRow)
+            lists[name] = _NdyListIndex(count, span, count, rows_end)
+            lists['normals'] = _NdyListIndex(count, span, count, max(normals_end, rows_end))
+        elif name == 'sectors':
+            _, rows_end = _find_last_line(mm, m.end(), end, _kReNdySurfaces)
+            lists[name] = _NdyListIndex(count, span, count, rows_end)
+        else:
+            row_start, rows_end = _find_last_line(mm, m.end(), end, _kReNdyRow)
+            if row_start < 0:
+                # empty list, rows are inserted after list's column header comment or count line
+                rows_end = _next_line(mm, m.end(), end)
+                pos = rows_end
+                while pos < end and not mm[pos:_next_line(mm, pos, end)].strip(): # skip empty lines
+                    pos = _next_line(mm, pos, end)
+                if pos < end and _kReNdyComment.match(mm, pos):
+                    rows_end = _next_line(mm, pos, end)
+            lists[name] = _NdyListIndex(count, span, count, rows_end)
+    return lists
+
+def _ndy_material_map(mm: mmap.mmap, index: _NdyListIndex, materials: List[str]) -> Tuple[np.ndarray, List[str]]:
+    # Returns index of each model material in file and materials which aren't listed in file yet.
+    # Materials are matched by name case-insensitively, missing materials are numbered after the last row.
+    file_mats: Dict[str, int] = {}
+    for m in _kReNdyMatRow.finditer(mm, index.count_span[1], index.rows_end):
+        file_mats.setdefault(m.group(2).decode('utf-8', 'replace').lower(), int(m.group(1)))
+    new_mats = []
+    for name in materials:
+        if name.lower() not in file_mats:
+            file_mats[name.lower()] = index.num_rows + len(new_mats)
+            new_mats.append(name)
+    return np.array([file_mats[name.lower()] for name in materials], dtype=np.int64), new_mats
+
+def _ndy_splice(splice_file, out_file, version: NdyVersion, frags: _SectorFragments, profiler: _ExportProfiler = _kNoProfiler):
+    # Merges exported geometry into existing NDY/JKL file in one streaming pass.
+    # Start indices are taken from the existing lists, new rows are inserted at the end of each list
+    # and only list count lines are rewritten.
+    model  = frags.model
+    meshes = frags.meshes
+
+    with open(splice_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        lists = _ndy_index_lists(mm)
+        for name in ('materials', 'vertices', 'texture vertices', 'adjoins', 'surfaces', 'sectors'):
+            if name not in lists:
+                raise Exception("Couldn't find 'World {}' in '{}'".format(name, splice_file))
+
+        mat_start_idx     = lists['materials'].num_rows
+        mat_idx_map, new_mats = _ndy_material_map(mm, lists['materials'], model.materials)
+        vert_start_idx    = lists['vertices'].count
+        uv_start_idx      = lists['texture vertices'].count
+        adjoin_start_idx  = lists['adjoins'].count
+        surface_start_idx = lists['surfaces'].count
+        sector_idx        = lists['sectors'].count
+        print("Info: splicing into '{}' at mat_start_idx={} vert_start_idx={} uv_start_idx={} adjoin_start_idx={} surface_start_idx={} sector_idx={}, {} of {} materials are already in file"
+              .format(splice_file, mat_start_idx, vert_start_idx, uv_start_idx, adjoin_start_idx, surface_start_idx, sector_idx, len(model.materials) - len(new_mats), len(model.materials)))
+
+        num_mats  = len(new_mats)
+        num_verts = frags.num_verts
+        num_uvs   = frags.num_uvs
+        num_faces = frags.num_faces
+
+        # List of edits (start offset, end offset, replacement chunks) ordered by file offset
+        def _count(name: str, value: int):
+            return (*lists[name].count_span, [str(value)])
+        def _insert(name: str, stage: str, chunks: Iterable[str], items: int):
+            return (lists[name].rows_end, lists[name].rows_end, profiler.iter_stage(stage, chunks, items))
+
+        mat_count = lists['materials'].count
+        if mat_start_idx + num_mats > mat_count:
+            mat_count = mat_start_idx + num_mats + 64
+        edits = [
+            _count('materials', mat_count),
+            _insert('materials', 'materials', _join_rows(_ndy_material_rows(version, new_mats, mat_start_idx)), num_mats),
+            _count('vertices', vert_start_idx + num_verts),
+            _insert('vertices', 'vertices', frags.blocks('vertices', vert_start_idx), num_verts),
+            _count('texture vertices', uv_start_idx + num_uvs),
+            _insert('texture vertices', 'uvs', frags.blocks('uvs', uv_start_idx), num_uvs),
+            _count('adjoins', adjoin_start_idx + len(frags.adjoins)),
+            _insert('adjoins', 'adjoins', _join_rows(_ndy_adjoin_rows(version, frags, adjoin_start_idx)), len(frags.adjoins)),
+            _count('surfaces', surface_start_idx + num_faces),
+            _insert('surfaces', 'surfaces', frags.blocks('surfaces', mat_idx_map, vert_start_idx, uv_start_idx, adjoin_start_idx, surface_start_idx), num_faces),
+            _insert('normals', 'normals', frags.blocks('normals', surface_start_idx), num_faces),
+            _count('sectors', sector_idx + len(meshes)),
+            _insert('sectors', 'sectors', chain([_kNewLine], frags.blocks('sectors', sector_idx, vert_start_idx, surface_start_idx)), len(meshes)),
+        ]
+        edits.sort(key=lambda e: e[0]) # stable sort keeps inserts at the same offset in order
+
+        newline = '\r\n' if mm.find(b'\r\n', 0, 4096) > -1 else '\n'
+        tmp_file = out_file + '.tmp'
+        with open(tmp_file, 'wb', buffering=out_buffer_size) as out:
+            view = memoryview(mm)
+            try:
+                pos = 0
+                for start, end, chunks in edits:
+                    with profiler.stage('write'):
+                        out.write(view[pos:start])
+                    for block in _join_blocks(chunks, out_buffer_size):
+                        with profiler.stage('write'):
+                            out.write(block.replace('\n', newline).encode('utf-8'))
+                    pos = end
+                with profiler.stage('write'):
+                    out.write(view[pos:])
+            finally:
+                view.release()
+    os.replace(tmp_file, out_file)
+
+def _export_objs_to_ndy(objs: List[bpy.types.Object], out_file, version: NdyVersion, mat_start_idx, vert_start_idx, uv_start_idx, adjoin_start_idx, surface_start_idx, sector_idx, splice_file = '', export_cache_dir = '', profile = False, profile_report = ''):
+    # Exports hierarchies of objs, sectors of hierarchies are numbered in order of objs
+    profiler = _ExportProfiler(profile, profile_memory, profile_cprofile)
+    with profiler.stage('model', len(objs)):
+        model = _make_export_model(objs, version)
+
+    with profiler.stage('world_vertices', len(model.meshes)):
+        world_verts = _get_world_vertices(model)
+
+    sector_lights = None
+    lights = _scene_lights(bpy.context.scene) if bake_lights else []
+    if bake_lights and not lights:
+        print("Warning: scene has no point or sun lights, light isn't baked")
+    elif lights:
+        with profiler.stage('bake_lights', len(lights)):
+            model, sector_lights = _bake_lights(model, world_verts, lights)
+        print("Info: baked light of {} lights, {} of {} sectors are lit".format(len(lights), sum(l is not None for l in sector_lights), len(sector_lights)))
+
+    cache = _ExportCache(export_cache_dir, export_cache_max_size) if export_cache_dir else None
+    with profiler.stage('fragments', len(model.meshes)):
+        frags = _SectorFragments(version, model, world_verts, cache, sector_lights)
+
+    with _sector_block_pool(frags) as workers:
+        if splice_file:
+            _ndy_splice(splice_file, out_file, version, frags, profiler)
+        else:
+            # Write to ndy file
+            with open(out_file, 'w', encoding='utf-8', buffering=out_buffer_size) as f:
+                _ndy_write_chunks(f, _ndy_iter_export(version, frags, mat_start_idx, vert_start_idx, uv_start_idx, adjoin_start_idx, surface_start_idx, sector_idx, profiler), out_buffer_size, profiler)
+
+    if cache:
+        cache.report()
+    sector_bounds = []
+    if profile:
+        with profiler.stage('sector_bounds', len(frags.meshes)):
+            sector_bounds = _sector_bounds_report(frags)
+    profiler.finish(profile_report or out_file + '.profile.json', {
+        'objects'       : [o.name for o in objs],
+        'out_file'      : out_file,
+        'splice_file'   : splice_file,
+        'version'       : version.name,
+        'sectors'       : len(frags.meshes),
+        'workers'       : workers,
+        'cache_hits'    : cache.hits if cache else 0,
+        'sector_bounds' : sector_bounds
+    })
+
+def _parse_cli_jobs(argv: List[str]) -> Tuple[List[dict], str]:
+    # Parses script arguments passed after '--' when run via: blender --background file.blend --python obj_to_ndy.py -- <args>
+    parser = argparse.ArgumentParser(prog='obj_to_ndy.py', description='Exports object hierarchy to NDY/JKL file format.')
+    parser.add_argument('--jobs', help='JSON file with list of export jobs')
+    parser.add_argument('--results', help='JSON file to write export results to')
+    parser.add_argument('--object', nargs='+', help='name of top object of each hierarchy to export')
+    parser.add_argument('--out-file', default=out_file)
+    parser.add_argument('--version', default=out_version.name, choices=[v.name for v in NdyVersion], type=str.upper)
+    parser.add_argument('--mat-start-idx', type=int, default=mat_start_idx)
+    parser.add_argument('--vert-start-idx', type=int, default=vert_start_idx)
+    parser.add_argument('--uv-start-idx', type=int, default=uv_start_idx)
+    parser.add_argument('--adjoin-start-idx', type=int, default=adjoin_start_idx)
+    parser.add_argument('--surface-start-idx', type=int, default=surface_start_idx)
+    parser.add_argument('--sector-idx', type=int, default=sector_idx)
+    parser.add_argument('--splice-file', default=splice_file, help='existing NDY/JKL file to splice exported geometry into')
+    parser.add_argument('--export-cache-dir', default=export_cache_dir, help='directory of persistent export cache')
+    parser.add_argument('--profile', action='store_true', default=profile, help='print export profile and write JSON report')
+    parser.add_argument('--profile-report', default=profile_report, help="path of JSON profile report, default: '<out_file>.profile.json'")
+    args = parser.parse_args(argv)
+
+    if args.jobs:
+        with open(args.jobs, 'r', encoding='utf-8') as f:
+            jobs = json.load(f)
+    elif args.object:
+        jobs = [{
+            'object'            : args.object if len(args.object) > 1 else args.object[0],
+            'out_file'          : args.out_file,
+            'version'           : args.version,
+            'mat_start_idx'     : args.mat_start_idx,
+            'vert_start_idx'    : args.vert_start_idx,
+            'uv_start_idx'      : args.uv_start_idx,
+            'adjoin_start_idx'  : args.adjoin_start_idx,
+            'surface_start_idx' : args.surface_start_idx,
+            'sector_idx'        : args.sector_idx,
+            'splice_file'       : args.splice_file,
+            'export_cache_dir'  : args.export_cache_dir,
+            'profile'           : args.profile,
+            'profile_report'    : args.profile_report,
+        }]
+    else:
+        parser.error('either --jobs or --object must be specified')
+    return jobs, args.results
+
+def _run_cli_jobs(jobs: List[dict]) -> List[dict]:
+    # Exports each job and returns list of per-job results.
+    # Unset job values default to script's variables.
+    results = []
+    for job in jobs:
+        result = { 'object': job.get('object'), 'out_file': job.get('out_file', out_file), 'ok': False, 'error': None }
+        start = time.perf_counter()
+        try:
+            # 'object' is name of one object or list of names
+            names = job['object'] if isinstance(job['object'], list) else [job['object']]
+            objs  = [bpy.data.objects.get(name) for name in names]
+            if None in objs:
+                raise Exception("Object '{}' not found".format(names[objs.index(None)]))
+            _export_objs_to_ndy(objs, result['out_file'],
+                NdyVersion[job.get('version', out_version.name).upper()],
+                job.get('mat_start_idx', mat_start_idx),
+                job.get('vert_start_idx', vert_start_idx),
+                job.get('uv_start_idx', uv_start_idx),
+                job.get('adjoin_start_idx', adjoin_start_idx),
+                job.get('surface_start_idx', surface_start_idx),
+                job.get('sector_idx', sector_idx),
+                job.get('splice_file', splice_file),
+                job.get('export_cache_dir', export_cache_dir),
+                job.get('profile', profile),
+                job.get('profile_report', profile_report))
+            result['ok'] = True
+        except Exception as e:
+            print("Error: failed to export object '{}': {}".format(job.get('object'), e))
+            result['error'] = str(e)
+        result['time'] = time.perf_counter() - start
+        results.append(result)
+    return results
+
+if __name__ == '__main__':
+    if '--' in sys.argv:
+        # Headless mode, e.g. invoked by ndy_batch_export.py
+        jobs, results_file = _parse_cli_jobs(sys.argv[sys.argv.index('--') + 1:])
+        results = _run_cli_jobs(jobs)
+        if results_file:
+            with open(results_file, 'w', encoding='utf-8') as f:
+                json.dump(results, f, indent=2)
+        if not all(r['ok'] for r in results):
+            sys.exit(1)
+    else:
+        # Get top objects of selected hierarchies, selected objects in hierarchy of another selected object are exported with it
+        if len(bpy.context.selected_objects) == 0:
+            print("Error: could not determine which objects to export. Put into '{}' group or select top object of each hierarchy!".format(kGModel3do))
+            raise Exception('No object selected to export')
+
+        objs = _top_level_objects(bpy.context.selected_objects)
+        if len(objs) > 1:
+            print("Info: exporting {} hierarchies: {}".format(len(objs), ', '.join(o.name for o in objs)))
+        _export_objs_to_ndy(objs, out_file, out_version, mat_start_idx, vert_start_idx, uv_start_idx, adjoin_start_idx, surface_start_idx, sector_idx, splice_file, export_cache_dir, profile, profile_report)